@@ -0,0 +1,219 @@
+import base64
+import json
+import os
+import threading
+from selenium import webdriver
+from selenium.webdriver.firefox.options import Options
+from selenium.webdriver.firefox.service import Service
+from selenium.common.exceptions import WebDriverException
+
+
+
+FIREFOX_BINARY = 'C:/Program Files/Mozilla Firefox/firefox.exe' # Replace with the path of Firefox!
+GECKODRIVER_PATH = 'C:/Users/zhang/Downloads/geckodriver-v0.36.0-win32/geckodriver.exe' # Replace with the path of geckodriver!
+
+# Set LEAN_PROFILE to False to compare with the full pages (e.g., bytes and page-ready time by page_metrics.summary())
+LEAN_PROFILE = True
+HEADLESS = True
+
+BLOCK_LIST_FILE = 'block_list.txt' # one host per line, used instead of the default list if the file exists
+
+# Third party ad and analytics hosts, and the hosts serving videos, that the scrapers never need
+DEFAULT_BLOCK_LIST = ['doubleclick.net', 'googlesyndication.com', 'googletagservices.com', 'googletagmanager.com',
+                      'google-analytics.com', 'googleadservices.com', 'adservice.google.com', 'amazon-adsystem.com',
+                      'aax-us-east.amazon-adsystem.com', 'fls-na.amazon.com', 'unagi.amazon.com', 'unagi-na.amazon.com',
+                      'scorecardresearch.com', 'quantserve.com', 'adsrvr.org', 'adnxs.com', 'criteo.com', 'criteo.net',
+                      'facebook.net', 'connect.facebook.net', 'hotjar.com', 'segment.io', 'sentry.io', 'newrelic.com',
+                      'nr-data.net', 'imdb-video.media-imdb.com', 'video.media-imdb.com']
+
+# Preferences that stop loading what is never read (images, media, fonts) and turn off unneeded features
+LEAN_PREFERENCES = {
+    'permissions.default.image': 2, # no images
+    'media.autoplay.default': 5, # no autoplay of audio or video
+    'media.autoplay.blocking_policy': 2,
+    'media.preload.default': 0,
+    'media.preload.auto': 0,
+    'gfx.downloadable_fonts.enabled': False, # no web fonts
+    'browser.display.use_document_fonts': 0,
+    'network.prefetch-next': False,
+    'network.dns.disablePrefetch': True,
+    'network.http.speculative-parallel-limit': 0,
+    'browser.cache.disk.enable': False, # keep the cache in memory only
+    'browser.cache.memory.enable': True,
+    'dom.webnotifications.enabled': False,
+    'dom.push.enabled': False,
+    'geo.enabled': False,
+    'extensions.pocket.enabled': False,
+    'browser.safebrowsing.malware.enabled': False,
+    'browser.safebrowsing.phishing.enabled': False,
+    'browser.safebrowsing.downloads.enabled': False,
+    'toolkit.telemetry.enabled': False,
+    'datareporting.healthreport.uploadEnabled': False,
+    'datareporting.policy.dataSubmissionEnabled': False,
+    'app.update.auto': False,
+    'browser.shell.checkDefaultBrowser': False,
+}
+
+
+
+#################################################
+### Functions to build the lean browser profile ###
+#################################################
+
+def load_block_list(path=BLOCK_LIST_FILE):
+
+    '''Returns the hosts in the block list file (one per line, '#' for comments) or the default list if there is no such file.'''
+
+    if not os.path.exists(path):
+        return list(DEFAULT_BLOCK_LIST)
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.strip().startswith('#')]
+
+
+
+def build_pac_url(block_list):
+
+    '''
+    Builds a proxy auto-config (PAC) file as a data url that sends the requests to the blocked hosts
+    (and their subdomains) to a closed local port, so they fail at once, and lets the other requests go directly.
+
+    Params:
+    -------
+    block_list: list.
+      The hosts to block.
+
+    Returns:
+    --------
+    The data url of the PAC file.
+    '''
+
+    pac = ('function FindProxyForURL(url, host) {\n'
+           '  var blocked = ' + json.dumps(list(block_list)) + ';\n'
+           '  for (var i = 0; i < blocked.length; i++) {\n'
+           '    if (host == blocked[i] || dnsDomainIs(host, "." + blocked[i])) { return "PROXY 127.0.0.1:9"; }\n'
+           '  }\n'
+           '  return "DIRECT";\n'
+           '}\n')
+    return 'data:application/x-ns-proxy-autoconfig;base64,' + base64.b64encode(pac.encode('utf-8')).decode('ascii')
+
+
+
+def build_options(identity, lean=None, headless=None, block_list=None, page_load_strategy='eager'):
+
+    '''
+    Builds the Firefox options shared by all scrapers.
+
+    Params:
+    -------
+    identity: Identity.
+      The identity whose user agent the browser is launched with.
+
+    lean: bool or None.
+      Whether to block images, media, fonts and the hosts in the block list and to turn off unneeded features.
+      LEAN_PROFILE by default.
+
+    headless: bool or None.
+      Whether to run without a window. HEADLESS by default.
+
+    block_list: list or None.
+      The hosts to block, by default the ones from load_block_list.
+
+    page_load_strategy: str.
+      'eager' for the IMDB pages, 'normal' for pages that load their content later (e.g., Justwatch).
+
+    Returns:
+    --------
+    options: Options.
+    '''
+
+    lean = LEAN_PROFILE if lean is None else lean
+    headless = HEADLESS if headless is None else headless
+
+    # The version (4.4.3) has a different way of setting params
+    # Instances of options and service as well as the binary locaion of firefox
+    # and the path to the webdriver (geckodriver) are needed
+    options = Options()
+    options.set_preference('intl.accept_languages', 'en-US')
+    options.binary_location = FIREFOX_BINARY
+    options.page_load_strategy = page_load_strategy
+    options.add_argument('--user-agent={}'.format(identity.user_agent))
+
+    if headless:
+        options.add_argument('-headless')
+
+    if lean:
+        for key, value in LEAN_PREFERENCES.items():
+            options.set_preference(key, value)
+        if block_list is None:
+            block_list = load_block_list()
+        if block_list:
+            options.set_preference('network.proxy.type', 2) # proxy auto-config
+            options.set_preference('network.proxy.autoconfig_url', build_pac_url(block_list))
+
+    return options
+
+
+
+def new_driver(identity, lean=None, headless=None, block_list=None, page_load_strategy='eager'):
+
+    '''Launches a Firefox driver with the options from build_options. See build_options for the params.'''
+
+    options = build_options(identity, lean=lean, headless=headless, block_list=block_list, page_load_strategy=page_load_strategy)
+    service = Service(executable_path=GECKODRIVER_PATH)
+    return webdriver.Firefox(options=options, service=service)
+
+
+
+###########################################################
+### Bytes transferred and page-ready time by page type ###
+###########################################################
+
+# Reads the navigation and resource timing entries of the page in the browser.
+# transferSize is 0 for cached or blocked resources, so the sum is what actually went over the network.
+METRICS_SCRIPT = '''
+var nav = performance.getEntriesByType('navigation')[0];
+var resources = performance.getEntriesByType('resource');
+var bytes = nav ? nav.transferSize : 0;
+for (var i = 0; i < resources.length; i++) { bytes += resources[i].transferSize || 0; }
+var ready = nav ? (nav.domContentLoadedEventEnd || nav.responseEnd) : null;
+return {bytes: bytes, ready_ms: ready, resources: resources.length};
+'''
+
+
+class PageMetrics:
+
+    '''Keeps the bytes transferred and the page-ready time (ms after the navigation started) by page type.'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.metrics = {}
+
+    def measure(self, driver, page_type):
+
+        '''Reads the timing entries of the current page and adds them to the page type. Returns the entry or None.'''
+
+        try:
+            result = driver.execute_script(METRICS_SCRIPT)
+        except WebDriverException as e:
+            print(f'Cannot measure the page: {e}', flush=True)
+            return None
+        with self._lock:
+            m = self.metrics.setdefault(page_type, {'pages': 0, 'bytes': 0, 'ready_ms': 0.0, 'resources': 0})
+            m['pages'] += 1
+            m['bytes'] += result['bytes'] or 0
+            m['ready_ms'] += result['ready_ms'] or 0
+            m['resources'] += result['resources'] or 0
+        return result
+
+    def summary(self):
+
+        '''Returns a dict by page type with the number of pages, and the mean KB, page-ready ms and resources per page.'''
+
+        with self._lock:
+            return {page_type: {'pages': m['pages'],
+                                'mean_kb': round(m['bytes'] / m['pages'] / 1024, 1),
+                                'mean_ready_ms': round(m['ready_ms'] / m['pages'], 1),
+                                'mean_resources': round(m['resources'] / m['pages'], 1)}
+                    for page_type, m in self.metrics.items()}
+
+page_metrics = PageMetrics()
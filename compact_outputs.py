@@ -0,0 +1,253 @@
+import argparse
+import concurrent.futures
+import os
+import re
+import time
+import numpy as np
+import pandas as pd
+from manifest import Manifest, TITLE_FILE_PATTERN, BATCH_FILE_PATTERN, STREAM_FILE_PATTERN
+from parquet_store import DATASETS, pa, pq
+from numeric_parse import normalise_main
+
+
+
+COMPACT_ROOT = 'Compacted'
+FILES_PER_TASK = 500 # files read by a worker process at a time
+
+# Folders of the CSV files (the company credits were saved in 'Company Credit', and checked in 'Company credit')
+TITLE_FOLDERS = ['Award', 'Release', 'Company Credit', 'Company credit']
+MAIN_FOLDER = 'Main'
+JUSTWATCH_FOLDERS = ['New_Content']
+# <platform>_<kind>_YYYY-MM-DD.csv of scrape_justwatch (justwatch_href_YYYY-MM-DD.csv is the list of platforms)
+JUSTWATCH_FILE_PATTERN = re.compile(r'(.+)_([a-z]+)_(\d{4}-\d{2}-\d{2})\.csv$')
+
+# Placeholder rows of the files of titles without data (see Record.empty and Record.not_found, scrape_award and scrape_view)
+NOT_FOUND_VALUE = '404'
+EMPTY_VALUE = 'NoInfo'
+# The columns whose placeholder differs: the award gen file of a title without award has 0 categories
+EMPTY_PLACEHOLDERS = {'awards_gen': {'num_category': '0'}}
+# A main page without watching options has '404' in these columns only, the other columns are scraped anyway
+# (a main page that is a 404 has it in every column, see MainRow.not_found)
+NOT_FOUND_COLUMNS = {'main': ['theater', 'price', 'season', 'streaming_provider', 'rent_provider']}
+NUMERIC_COLUMNS = {'awards_gen': ['num_category']}
+
+
+
+###########################################
+### Listing the files by their names ###
+###########################################
+
+def scan_files(root):
+
+    '''
+    Lists the CSV files of the scrapers under root by parsing their names.
+
+    Returns:
+    --------
+    files: list.
+      (path, dataset, key, fetch date) with the dataset of parquet_store.DATASETS and the tconst
+      (or the platform for JustWatch, or None when the file has a tconst column).
+    '''
+
+    files = []
+    scanned = set()
+    for folder in TITLE_FOLDERS:
+        directory = os.path.join(root, folder)
+        # 'Company Credit' and 'Company credit' are the same folder on Windows and macOS
+        if not os.path.isdir(directory) or os.path.normcase(os.path.realpath(directory)) in scanned:
+            continue
+        scanned.add(os.path.normcase(os.path.realpath(directory)))
+        for file_name in os.listdir(directory):
+            match = TITLE_FILE_PATTERN.match(file_name)
+            if match:
+                tconst, artifact, fetch_date = match.groups()
+                files.append((os.path.join(directory, file_name), DATASETS[artifact or 'award'], tconst, fetch_date))
+
+    directory = os.path.join(root, MAIN_FOLDER)
+    if os.path.isdir(directory):
+        for file_name in os.listdir(directory):
+            match = BATCH_FILE_PATTERN.match(file_name)
+            fetch_date = match.group(2) if match else None
+            if match is None:
+                match = STREAM_FILE_PATTERN.match(file_name)
+                fetch_date = match.group(1) if match else None
+            if match:
+                files.append((os.path.join(directory, file_name), 'main', None, fetch_date))
+
+    for folder in JUSTWATCH_FOLDERS:
+        directory = os.path.join(root, folder)
+        if not os.path.isdir(directory):
+            continue
+        for file_name in os.listdir(directory):
+            match = JUSTWATCH_FILE_PATTERN.match(file_name)
+            if match and match.group(2) != 'href':
+                platform, kind, fetch_date = match.groups()
+                files.append((os.path.join(directory, file_name), 'justwatch_' + kind, platform, fetch_date))
+    return files
+
+
+
+##########################################
+### Reading and normalising the files ###
+##########################################
+
+def key_column(dataset):
+    return 'platform' if dataset.startswith('justwatch') else 'tconst'
+
+
+def normalise_placeholders(df, dataset):
+
+    '''
+    Replaces the placeholder rows (None, 'NoInfo' or '404' for a title without data) by a status column:
+    'ok', 'empty' or '404', with the values of the placeholder rows left missing. A placeholder is a whole row:
+    '404' in every value (or in every watching option column for the main pages, whose other values are kept),
+    or every value missing except the placeholder of its column. A row with only some of these values is kept as it is.
+    '''
+
+    values = df.drop(columns=[key_column(dataset), 'fetch_date'])
+    not_found = (values.eq(NOT_FOUND_VALUE) | values.isna()).all(axis=1) & values.eq(NOT_FOUND_VALUE).any(axis=1)
+    df = df.copy()
+    df.loc[not_found, values.columns] = None
+    if dataset in NOT_FOUND_COLUMNS:
+        columns = [c for c in NOT_FOUND_COLUMNS[dataset] if c in values.columns]
+        no_option = values[columns].eq(NOT_FOUND_VALUE).all(axis=1) if columns else pd.Series(False, index=values.index)
+        # only the watching options are placeholders, the rest of the page is kept
+        df.loc[no_option, columns] = None
+        not_found |= no_option
+    placeholders = pd.Series({c: EMPTY_PLACEHOLDERS.get(dataset, {}).get(c, EMPTY_VALUE) for c in values.columns})
+    empty = (values.isna() | values.eq(placeholders, axis=1)).all(axis=1)
+    status = np.select([not_found, empty], ['404', 'empty'], 'ok')
+    df.loc[status == 'empty', values.columns] = None
+    df['status'] = status
+    return df
+
+
+def read_files(files):
+
+    '''Reads the files (from scan_files) in a worker process. Returns one normalised DataFrame by dataset.'''
+
+    frames = {}
+    for path, dataset, key, fetch_date in files:
+        try:
+            df = pd.read_csv(path, dtype=str)
+        except (pd.errors.EmptyDataError, pd.errors.ParserError, OSError) as e:
+            print(f'Cannot read {path}: {e}', flush=True)
+            continue
+        column = key_column(dataset)
+        if column not in df.columns:
+            df.insert(0, column, key)
+        df.insert(1, 'fetch_date', fetch_date)
+        frames.setdefault(dataset, []).append(df)
+    return {dataset: normalise_placeholders(pd.concat(dfs, ignore_index=True), dataset) for dataset, dfs in frames.items()}
+
+
+
+######################################
+### Snapshots of the datasets ###
+######################################
+
+def snapshot(df, dataset, history=False):
+
+    '''
+    Deduplicates the rows and types the columns of a dataset.
+
+    Params:
+    -------
+    history: bool.
+      False to keep only the latest fetch of each title (platform), True to keep all fetches.
+    '''
+
+    column = key_column(dataset)
+    if not history:
+        df = df[df['fetch_date'] == df.groupby(column)['fetch_date'].transform('max')]
+    # the main pages appended twice on the same day, and the placeholder rows, only once
+    df = df.drop_duplicates(keep='last').reset_index(drop=True)
+    df['fetch_date'] = pd.to_datetime(df['fetch_date'])
+    df['status'] = df['status'].astype('category')
+    for c in NUMERIC_COLUMNS.get(dataset, []):
+        df[c] = pd.to_numeric(df[c], errors='coerce').astype('Int64')
+    if dataset == 'main':
+        # the counts, scores and box office as numbers (with the currency and the estimate flag)
+        df = normalise_main(df)
+    for c in df.columns:
+        if df[c].dtype == object:
+            df[c] = df[c].astype('string')
+    return df
+
+
+def compact(root=None, out=COMPACT_ROOT, workers=None, history=False):
+
+    '''
+    Folds the CSV files of the scrapers under root into one Parquet snapshot by dataset (out/<dataset>.parquet),
+    and indexes the files in the manifest. Downstream analysis then reads one file by type.
+
+    Params:
+    -------
+    root: str or None.
+      The working directory of the scrapers, the current one by default.
+
+    out: str.
+      The folder of the snapshots.
+
+    workers: int or None.
+      The number of processes reading the files, the number of CPUs by default.
+
+    history: bool.
+      Whether to keep all fetches of each title instead of the latest one.
+
+    Returns:
+    --------
+    summary: DataFrame.
+      The rows, titles, status counts and fetch dates by dataset, also saved as out/_summary.csv.
+    '''
+
+    if pa is None:
+        raise ImportError('The compaction writes Parquet files with pyarrow: pip install pyarrow')
+    root = root or os.getcwd()
+    t1 = time.monotonic()
+    files = scan_files(root)
+    print(f'{len(files)} files to compact', flush=True)
+
+    tasks = [files[i:i + FILES_PER_TASK] for i in range(0, len(files), FILES_PER_TASK)]
+    parts = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(read_files, tasks):
+            for dataset, df in result.items():
+                parts.setdefault(dataset, []).append(df)
+
+    os.makedirs(out, exist_ok=True)
+    rows = []
+    for dataset, dfs in sorted(parts.items()):
+        df = snapshot(pd.concat(dfs, ignore_index=True), dataset, history)
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), os.path.join(out, dataset + '.parquet'))
+        counts = df['status'].value_counts()
+        rows.append({'dataset': dataset, 'rows': len(df), 'keys': df[key_column(dataset)].nunique(),
+                     'ok': counts.get('ok', 0), 'empty': counts.get('empty', 0), '404': counts.get('404', 0),
+                     'first_fetch': df['fetch_date'].min().date(), 'last_fetch': df['fetch_date'].max().date()})
+        print(f'{dataset}: {len(df)} rows', flush=True)
+
+    summary = pd.DataFrame(rows)
+    summary.to_csv(os.path.join(out, '_summary.csv'), index=False)
+    # the per-title files are also indexed in the manifest, for the freshness checks of the scrapers
+    Manifest().rebuild(root)
+    print(f'Compaction took {round(time.monotonic() - t1, 2)} seconds', flush=True)
+    return summary
+
+
+def read_snapshot(dataset, out=COMPACT_ROOT):
+
+    '''Reads the snapshot of a dataset (e.g., 'release', or an artifact name like 'pro') into a DataFrame.'''
+
+    return pd.read_parquet(os.path.join(out, DATASETS.get(dataset, dataset) + '.parquet'))
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Folds the per-title CSV files into one Parquet snapshot by type.')
+    parser.add_argument('--root', default=None, help='working directory of the scrapers (default: current)')
+    parser.add_argument('--out', default=COMPACT_ROOT, help='folder of the snapshots')
+    parser.add_argument('--workers', type=int, default=None, help='processes reading the files (default: CPUs)')
+    parser.add_argument('--history', action='store_true', help='keep all fetches instead of the latest one by title')
+    args = parser.parse_args()
+    print(compact(args.root, args.out, args.workers, args.history))
@@ -0,0 +1,424 @@
+import argparse
+import multiprocessing
+import os
+import random
+import socket
+import socketserver
+import sqlite3
+import threading
+import time
+import uuid
+import xmlrpc.client
+from xmlrpc.server import SimpleXMLRPCServer
+
+
+
+COORDINATOR_FILE = 'shards.sqlite'
+SHARD_SIZE = 50 # titles per shard
+LEASE_SECONDS = 300 # a shard without heartbeat for this long goes back to the other workers
+MIN_STEAL = 4 # a shard is split for an idle worker only if it has at least twice this number of titles left
+PORT = 8765
+# Written by the coordinator in its working directory, which every worker must share as its own (see check_shared_store)
+STORE_MARKER = '.crawl_store'
+
+# Status of a shard
+OPEN = 'open'
+LEASED = 'leased'
+DONE = 'done'
+
+
+
+#########################################################
+### Coordinator: shards of titles with time-limited leases ###
+#########################################################
+
+class ShardCoordinator:
+
+    '''
+    Hands out disjoint ranges (shards) of the title list to the workers, each under a time-limited lease renewed by heartbeats.
+    A shard whose lease runs out (e.g., the worker or its machine died) is given to another worker from where it stopped.
+    When no shard is left, an idle worker steals the second half of the remaining titles of the slowest shard:
+    the owner learns its new end at its next heartbeat.
+    The state is kept in a SQLite file, so the coordinator can be restarted too.
+
+    Params:
+    -------
+    path: str.
+      The SQLite file of the coordinator.
+
+    lease_seconds: int.
+      How long a shard stays with a worker without heartbeat.
+    '''
+
+    def __init__(self, path=COORDINATOR_FILE, lease_seconds=LEASE_SECONDS):
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS titles (idx INTEGER PRIMARY KEY, tconst TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS shards (
+                shard_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                start_idx INTEGER NOT NULL,
+                next_idx INTEGER NOT NULL,
+                end_idx INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                owner TEXT,
+                lease_until REAL,
+                titles_done INTEGER NOT NULL DEFAULT 0);
+            CREATE TABLE IF NOT EXISTS workers (worker_id TEXT PRIMARY KEY, titles_done INTEGER NOT NULL DEFAULT 0, last_seen REAL);
+        ''')
+
+
+    def load_titles(self, tconsts, shard_size=SHARD_SIZE):
+
+        '''Stores the titles and cuts them into shards. Does nothing if the titles were already loaded (e.g., after a restart).'''
+
+        with self._lock:
+            if self.conn.execute('SELECT COUNT(*) FROM titles').fetchone()[0]:
+                return False
+            tconsts = list(tconsts)
+            self.conn.execute('BEGIN')
+            self.conn.executemany('INSERT INTO titles VALUES (?, ?)', enumerate(tconsts))
+            self.conn.executemany('INSERT INTO shards (start_idx, next_idx, end_idx, status) VALUES (?, ?, ?, ?)',
+                                  ((i, i, min(i + shard_size, len(tconsts)), OPEN) for i in range(0, len(tconsts), shard_size)))
+            self.conn.execute('COMMIT')
+            return True
+
+
+    def _titles(self, start, end):
+        return [r[0] for r in self.conn.execute('SELECT tconst FROM titles WHERE idx >= ? AND idx < ? ORDER BY idx', (start, end))]
+
+
+    def claim_shard(self, worker_id):
+
+        '''
+        Gives a shard to the worker: an open one, one whose lease expired, or half of the slowest one.
+
+        Returns:
+        --------
+        A dict with shard_id, next_idx, end_idx and the tconsts from next_idx, or an empty dict when all the work is done or leased.
+        '''
+
+        now = time.time()
+        with self._lock:
+            self.conn.execute('BEGIN')
+            row = self.conn.execute('''
+                SELECT shard_id, next_idx, end_idx FROM shards
+                WHERE status = ? OR (status = ? AND lease_until < ?)
+                ORDER BY shard_id LIMIT 1''', (OPEN, LEASED, now)).fetchone()
+
+            if row is None:
+                # Work stealing: split the leased shard with the most titles left
+                victim = self.conn.execute('''
+                    SELECT shard_id, next_idx, end_idx FROM shards
+                    WHERE status = ? AND end_idx - next_idx >= ?
+                    ORDER BY end_idx - next_idx DESC LIMIT 1''', (LEASED, 2 * MIN_STEAL)).fetchone()
+                if victim is None:
+                    self.conn.execute('COMMIT')
+                    return {}
+                shard_id, next_idx, end_idx = victim
+                middle = (next_idx + end_idx + 1) // 2
+                self.conn.execute('UPDATE shards SET end_idx = ? WHERE shard_id = ?', (middle, shard_id))
+                cur = self.conn.execute('INSERT INTO shards (start_idx, next_idx, end_idx, status) VALUES (?, ?, ?, ?)',
+                                        (middle, middle, end_idx, OPEN))
+                row = (cur.lastrowid, middle, end_idx)
+                print(f'{worker_id} steals titles {middle}-{end_idx} of shard {shard_id}', flush=True)
+
+            shard_id, next_idx, end_idx = row
+            self.conn.execute('UPDATE shards SET status = ?, owner = ?, lease_until = ? WHERE shard_id = ?',
+                              (LEASED, worker_id, now + self.lease_seconds, shard_id))
+            self.conn.execute('INSERT OR REPLACE INTO workers VALUES (?, COALESCE((SELECT titles_done FROM workers WHERE worker_id = ?), 0), ?)',
+                              (worker_id, worker_id, now))
+            self.conn.execute('COMMIT')
+            return {'shard_id': shard_id, 'next_idx': next_idx, 'end_idx': end_idx,
+                    'tconsts': self._titles(next_idx, end_idx), 'lease_seconds': self.lease_seconds}
+
+
+    def heartbeat(self, worker_id, shard_id, next_idx):
+
+        '''
+        Records that the worker finished the titles before next_idx and renews its lease.
+
+        Returns:
+        --------
+        The current end of the shard (smaller than before if half of it was stolen), or -1 if the worker lost the lease.
+        '''
+
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute('SELECT owner, next_idx, end_idx FROM shards WHERE shard_id = ?', (shard_id,)).fetchone()
+            if row is None or row[0] != worker_id:
+                return -1
+            done = max(0, min(next_idx, row[2]) - row[1])
+            self.conn.execute('UPDATE shards SET next_idx = MAX(next_idx, ?), lease_until = ?, titles_done = titles_done + ? WHERE shard_id = ?',
+                              (min(next_idx, row[2]), now + self.lease_seconds, done, shard_id))
+            self.conn.execute('UPDATE workers SET titles_done = titles_done + ?, last_seen = ? WHERE worker_id = ?', (done, now, worker_id))
+            return row[2]
+
+
+    def complete_shard(self, worker_id, shard_id, next_idx):
+
+        '''Records the last titles of the shard and closes it.'''
+
+        end = self.heartbeat(worker_id, shard_id, next_idx)
+        if end < 0:
+            return False
+        with self._lock:
+            self.conn.execute('UPDATE shards SET status = ?, owner = NULL, lease_until = NULL WHERE shard_id = ? AND next_idx >= end_idx',
+                              (DONE, shard_id))
+        return True
+
+
+    def status(self):
+
+        '''Returns the number of shards by status, the titles done and left, and the titles done by worker.'''
+
+        with self._lock:
+            shards = dict(self.conn.execute('SELECT status, COUNT(*) FROM shards GROUP BY status').fetchall())
+            left = self.conn.execute('SELECT COALESCE(SUM(end_idx - next_idx), 0) FROM shards WHERE status != ?', (DONE,)).fetchone()[0]
+            workers = dict(self.conn.execute('SELECT worker_id, titles_done FROM workers').fetchall())
+        return {'shards': shards, 'titles_left': left, 'titles_done': sum(workers.values()), 'workers': workers}
+
+
+    def finished(self):
+        return self.status()['titles_left'] == 0
+
+
+
+class _ThreadedXMLRPCServer(socketserver.ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+
+def mark_store(directory='.'):
+
+    '''Writes a new random token to the marker of the output store in the directory. Returns the token.'''
+
+    token = uuid.uuid4().hex
+    tmp = os.path.join(directory, STORE_MARKER + '.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(token)
+    os.replace(tmp, os.path.join(directory, STORE_MARKER))
+    return token
+
+
+def check_shared_store(proxy, directory='.'):
+
+    '''
+    Checks that the working directory of the worker is the output store of the coordinator, i.e., the same folder
+    shared by all machines (e.g., over NFS or SMB), by comparing the marker token. Raises RuntimeError otherwise,
+    since the files of the worker would not reach the other outputs.
+    '''
+
+    token = proxy.store_token()
+    try:
+        with open(os.path.join(directory, STORE_MARKER), encoding='utf-8') as f:
+            found = f.read().strip()
+    except OSError:
+        found = None
+    if token and found != token:
+        raise RuntimeError(f'{os.path.abspath(directory)} is not the output folder of the coordinator. '
+                           'Run the worker in the folder of the coordinator, shared with this machine.')
+
+
+def serve_coordinator(coordinator, host='0.0.0.0', port=PORT, store_token=None):
+
+    '''
+    Serves the coordinator over XML-RPC (in a background thread) so that workers on other machines can reach it. Returns the server.
+    store_token is the token of the output store (see mark_store), checked by the workers at startup.
+    '''
+
+    server = _ThreadedXMLRPCServer((host, port), allow_none=True, logRequests=False)
+    server.register_function(lambda: store_token, 'store_token')
+    server.register_function(coordinator.claim_shard, 'claim_shard')
+    server.register_function(coordinator.heartbeat, 'heartbeat')
+    server.register_function(coordinator.complete_shard, 'complete_shard')
+    server.register_function(coordinator.status, 'status')
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+
+##############################################
+### Worker: claims shards and scrapes them ###
+##############################################
+
+def scrape_title(t, worker_id):
+
+    '''
+    Scrapes one title like the streaming pipeline: the main page, and the sub pages if the title has streaming options.
+    The files are written under the working directory of the worker, which must be the folder of the coordinator
+    (shared by all machines, see check_shared_store), so the per-title files of all workers end up in the same folders.
+    The main rows of each worker go to their own file, merged by merge_main_files when the crawl is done.
+    '''
+
+    import scrape_imdb_titles
+    scrape_imdb_titles.MAIN_STREAM_SUFFIX = '_' + worker_id
+    row = scrape_imdb_titles.save_main_row(t)
+    if scrape_imdb_titles.streaming_gate(row) is not None:
+        scrape_imdb_titles.save_title_files(t)
+
+
+def simulate_title(t, worker_id):
+
+    '''Stands in for scrape_title to test the coordination on one machine without browsers: sleeps 0.05-0.5s, sometimes 2s.'''
+
+    time.sleep(2 if random.random() < 0.05 else random.uniform(0.05, 0.5))
+
+
+def run_worker(coordinator_url, worker_id=None, threads=1, simulate=False):
+
+    '''
+    Claims shards from the coordinator and processes their titles until all the work is done.
+    A heartbeat before each title renews the lease and tells whether part of the shard was stolen.
+
+    Params:
+    -------
+    coordinator_url: str.
+      E.g., 'http://10.0.0.5:8765'.
+
+    worker_id: str or None.
+      The name of the worker, by default host-pid. It is part of the name of its main file.
+
+    threads: int.
+      The number of shards processed at the same time by this worker.
+
+    simulate: bool.
+      Whether to use simulate_title instead of scrape_title.
+    '''
+
+    worker_id = worker_id or f'{socket.gethostname()}-{os.getpid()}'
+    process_title = simulate_title if simulate else scrape_title
+    if not simulate:
+        # the outputs are only shared through the folder of the coordinator
+        check_shared_store(xmlrpc.client.ServerProxy(coordinator_url, allow_none=True))
+        # Outputs left incomplete by killed workers of this host (the journal entries of other hosts are left to their own workers)
+        from write_journal import get_write_journal
+        get_write_journal().recover()
+
+    def loop(thread_id):
+        name = f'{worker_id}/{thread_id}'
+        proxy = xmlrpc.client.ServerProxy(coordinator_url, allow_none=True)
+        while True:
+            shard = proxy.claim_shard(name)
+            if not shard:
+                # Nothing to claim or steal: stop when everything is done, otherwise wait for expired leases
+                if proxy.status()['titles_left'] == 0:
+                    return
+                time.sleep(5)
+                continue
+
+            idx, end = shard['next_idx'], shard['end_idx']
+            tconsts = shard['tconsts']
+            while idx < end:
+                try:
+                    process_title(tconsts[idx - shard['next_idx']], worker_id)
+                except Exception as e:
+                    print(f'{name} failed on {tconsts[idx - shard["next_idx"]]}: {e}', flush=True)
+                idx += 1
+                end = proxy.heartbeat(name, shard['shard_id'], idx)
+                if end < 0:
+                    print(f'{name} lost the lease of shard {shard["shard_id"]}', flush=True)
+                    break
+            else:
+                proxy.complete_shard(name, shard['shard_id'], idx)
+
+    workers = [threading.Thread(target=loop, args=(i,)) for i in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    if not simulate:
+        # the exit handlers do not run in the worker processes started by multiprocessing
+        from output_writer import flush_outputs
+        flush_outputs()
+
+
+def merge_main_files(folder='Main'):
+
+    '''
+    Merges the main rows of the workers (main_stream_<worker>_YYYY-MM-DD.csv) into main_stream_YYYY-MM-DD.csv by date.
+    The merged file is written atomically, and the worker files are removed only once it is in place and the manifest points to it.
+    '''
+
+    import re
+    import pandas as pd
+    from manifest import get_manifest
+    from write_journal import atomic_to_csv
+    pattern = re.compile(r'main_stream_(.+)_(\d{4}-\d{2}-\d{2})\.csv')
+    by_date = {}
+    for f in os.listdir(folder):
+        m = pattern.match(f)
+        if m:
+            by_date.setdefault(m.group(2), []).append(os.path.join(folder, f))
+    for day, paths in by_date.items():
+        output_file_path = os.path.join(folder, 'main_stream_' + day + '.csv')
+        frames = [pd.read_csv(p) for p in paths]
+        if os.path.exists(output_file_path):
+            frames.insert(0, pd.read_csv(output_file_path))
+        atomic_to_csv(pd.concat(frames).drop_duplicates(), output_file_path)
+        get_manifest().move(paths, output_file_path)
+        for p in paths:
+            os.remove(p)
+        print(f'Merged {len(paths)} worker files into {output_file_path}', flush=True)
+
+
+def recent_titles():
+
+    '''The stale titles released in or after 2024 from imdb_merged.csv (see scrape_imdb_titles), by refresh priority (see refresh_policy).'''
+
+    import pandas as pd
+    from refresh_policy import refresh_policy
+    df = pd.read_csv('imdb_merged.csv', usecols=['tconst', 'title_yr'])
+    df['title_yr'] = pd.to_numeric(df['title_yr'], errors='coerce')
+    recent = df[df['title_yr']>=2024]
+    refresh_policy.add_titles(recent['tconst'], recent['title_yr'])
+    refresh_policy.load_votes()
+    return refresh_policy.schedule(recent['tconst'])
+
+
+
+if __name__ == '__main__':
+
+    # On one machine:        python crawl_shards.py --workers 3
+    # To test without Firefox: python crawl_shards.py --workers 3 --simulate 600
+    # On several machines:   python crawl_shards.py --workers 0             (coordinator)
+    #                        python crawl_shards.py --join http://HOST:8765 --threads 2   (on each node, run in the coordinator's folder on a shared file system)
+    parser = argparse.ArgumentParser(description='Sharded crawl of the IMDB titles with a lease-based coordinator.')
+    parser.add_argument('--join', help='url of a running coordinator: run only a worker')
+    parser.add_argument('--workers', type=int, default=2, help='local worker processes started with the coordinator')
+    parser.add_argument('--threads', type=int, default=1, help='shards processed at the same time by each worker')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--simulate', type=int, default=0, help='number of fake titles to test the coordination without browsers')
+    args = parser.parse_args()
+
+    if args.join:
+        run_worker(args.join, threads=args.threads, simulate=bool(args.simulate))
+
+    else:
+        if not args.simulate:
+            # Outputs left incomplete by killed workers: cleaned up and not fresh anymore, so recent_titles schedules them again
+            from write_journal import get_write_journal
+            get_write_journal().recover()
+        coordinator = ShardCoordinator(COORDINATOR_FILE + '.simulate' if args.simulate else COORDINATOR_FILE)
+        coordinator.load_titles([f'tt{i:07d}' for i in range(args.simulate)] if args.simulate else recent_titles())
+        server = serve_coordinator(coordinator, port=args.port, store_token=None if args.simulate else mark_store())
+        url = f'http://127.0.0.1:{args.port}'
+        t1 = time.monotonic()
+
+        processes = [multiprocessing.Process(target=run_worker, args=(url, f'worker{i}', args.threads, bool(args.simulate)))
+                     for i in range(args.workers)]
+        for p in processes:
+            p.start()
+        while not coordinator.finished() and (not processes or any(p.is_alive() for p in processes)):
+            time.sleep(10)
+            print(f'Coordinator: {coordinator.status()}', flush=True)
+        for p in processes:
+            p.join()
+
+        elapsed = time.monotonic() - t1
+        status = coordinator.status()
+        print(f'Done: {status}. {round(status["titles_done"] / elapsed * 60, 1)} titles per minute.', flush=True)
+        if not args.simulate and os.path.isdir('Main'):
+            merge_main_files()
+        server.shutdown()
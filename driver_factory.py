@@ -0,0 +1,229 @@
+import atexit
+import concurrent.futures
+import hashlib
+import json
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import uuid
+from selenium import webdriver
+from selenium.webdriver.firefox.service import Service
+from selenium.common.exceptions import WebDriverException
+from identity import get_identity_manager, IMDB_BASE_URL
+from browser_profile import build_options, GECKODRIVER_PATH
+from memory_governor import get_memory_governor
+
+
+
+# RAM-backed location for the profiles (tmpfs on Linux), the temp folder otherwise
+PROFILE_ROOT = os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'scraper_profiles')
+
+# Number of browsers started ahead of demand
+SPARE_DRIVERS = 2
+
+# Files that Firefox keeps while a profile is in use, which must not be copied to the clones
+LOCK_FILES = ['lock', '.parentlock', 'parent.lock']
+
+
+
+##########################################################
+### Driver factory with pre-warmed profiles and spares ###
+##########################################################
+
+class DriverFactory:
+
+    '''
+    Launches the Firefox drivers from a clone of a pre-warmed profile template and keeps a few spare drivers started ahead of demand.
+    There is one template per identity, which already contains the consent cookies of the identity and the lean preferences
+    (see browser_profile), so a new driver neither creates a fresh profile on disk nor restores the cookies.
+    The templates and clones are kept under PROFILE_ROOT, which is on tmpfs where available.
+    A driver is launched only when the memory governor admits one more browser (see memory_governor).
+    Quitting a driver and removing its profile are done in the background, so recycling a driver costs
+    almost nothing on the critical path of the crawl.
+
+    Params:
+    -------
+    spares: int.
+      The number of browsers started ahead of demand. 0 to launch on demand only.
+
+    profile_root: str.
+      The folder of the templates and the clones.
+    '''
+
+    def __init__(self, spares=SPARE_DRIVERS, profile_root=PROFILE_ROOT):
+        self.profile_root = profile_root
+        self.spares = queue.Queue(maxsize=max(spares, 1))
+        self._profiles = {} # id of the driver: its profile folder
+        self._templates = {} # user agent: (consent key, template folder)
+        self._lock = threading.Lock()
+        self._template_lock = threading.Lock()
+        self._stop = threading.Event()
+        # quitting the drivers in the background
+        self._cleaner = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+        os.makedirs(self.profile_root, exist_ok=True)
+
+        self._filler = None
+        if spares > 0:
+            self._filler = threading.Thread(target=self._fill_spares, daemon=True)
+            self._filler.start()
+
+
+    def _consent_key(self, identity):
+        return hashlib.md5(json.dumps(identity.cookies, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+    def _template(self, identity):
+
+        '''Returns the template folder of the identity and (re)builds it when its consent cookies changed.'''
+
+        key = self._consent_key(identity)
+        with self._template_lock:
+            saved = self._templates.get(identity.user_agent)
+            if saved and saved[0] == key:
+                return saved[1]
+
+            template_dir = os.path.join(self.profile_root, 'template_' + uuid.uuid4().hex[:8])
+            os.makedirs(template_dir)
+            # Let Firefox write the profile (prefs and cookies) once in the template folder
+            options = build_options(identity)
+            options.add_argument('-profile')
+            options.add_argument(template_dir)
+            driver = webdriver.Firefox(options=options, service=Service(executable_path=GECKODRIVER_PATH))
+            try:
+                get_identity_manager().restore_consent(driver, identity, IMDB_BASE_URL)
+            finally:
+                driver.quit()
+            for f in LOCK_FILES:
+                if os.path.exists(os.path.join(template_dir, f)):
+                    os.remove(os.path.join(template_dir, f))
+
+            if saved:
+                shutil.rmtree(saved[1], ignore_errors=True)
+            self._templates[identity.user_agent] = (key, template_dir)
+            return template_dir
+
+
+    def _launch(self):
+
+        '''Launches a driver from a clone of the template of the next identity, once the memory allows one more browser.'''
+
+        identity = get_identity_manager().next_identity()
+        template_dir = self._template(identity)
+        governor = get_memory_governor()
+        governor.admit()
+        profile_dir = os.path.join(self.profile_root, 'profile_' + uuid.uuid4().hex)
+        try:
+            shutil.copytree(template_dir, profile_dir, ignore=shutil.ignore_patterns(*LOCK_FILES))
+            options = build_options(identity)
+            # geckodriver uses the folder given by -profile in place instead of creating a new profile
+            options.add_argument('-profile')
+            options.add_argument(profile_dir)
+            driver = webdriver.Firefox(options=options, service=Service(executable_path=GECKODRIVER_PATH))
+        except (OSError, WebDriverException):
+            governor.cancel()
+            shutil.rmtree(profile_dir, ignore_errors=True)
+            raise
+        governor.register(driver)
+        with self._lock:
+            self._profiles[id(driver)] = profile_dir
+        return driver, identity
+
+
+    def _fill_spares(self):
+        while not self._stop.is_set():
+            try:
+                spare = self._launch()
+            except Exception as e:
+                print(f'Cannot start a spare driver: {e}', flush=True)
+                self._stop.wait(5)
+                continue
+            while not self._stop.is_set():
+                try:
+                    self.spares.put(spare, timeout=1)
+                    break
+                except queue.Full:
+                    continue
+            else:
+                self.release(spare[0])
+
+
+    def get(self):
+
+        '''
+        Returns a ready driver and its identity: a spare one if there is any, otherwise a newly launched one.
+
+        Returns:
+        --------
+        driver: WebDriver.
+
+        identity: Identity.
+          The identity the driver was launched with, needed to decline the preferences.
+        '''
+
+        try:
+            return self.spares.get_nowait()
+        except queue.Empty:
+            return self._launch()
+
+
+    def _quit(self, driver, profile_dir):
+        try:
+            driver.quit()
+        except Exception:
+            pass
+        get_memory_governor().unregister(driver)
+        if profile_dir:
+            shutil.rmtree(profile_dir, ignore_errors=True)
+
+
+    def release(self, driver):
+
+        '''Quits the driver and removes its profile in the background. Releasing the same driver twice does nothing.'''
+
+        with self._lock:
+            if id(driver) not in self._profiles:
+                return
+            profile_dir = self._profiles.pop(id(driver))
+        self._cleaner.submit(self._quit, driver, profile_dir)
+
+
+    def shutdown(self):
+
+        '''Stops starting spares, quits the spare drivers and removes the templates.'''
+
+        self._stop.set()
+        if self._filler is not None:
+            self._filler.join(timeout=60)
+        while True:
+            try:
+                self.release(self.spares.get_nowait()[0])
+            except queue.Empty:
+                break
+        self._cleaner.shutdown(wait=True)
+        for _, template_dir in self._templates.values():
+            shutil.rmtree(template_dir, ignore_errors=True)
+
+
+
+_factory = None
+_factory_lock = threading.Lock()
+
+def get_driver_factory():
+
+    '''Returns the driver factory of the process, which is built (and starts the spares) on the first call.'''
+
+    global _factory
+    with _factory_lock:
+        if _factory is None:
+            _factory = DriverFactory()
+            atexit.register(_factory.shutdown)
+    return _factory
+
+
+def release_driver(driver):
+
+    '''Gives the driver back to the factory, which quits it off the critical path.'''
+
+    get_driver_factory().release(driver)
@@ -0,0 +1,164 @@
+import collections
+import threading
+import time
+from selenium.common.exceptions import WebDriverException
+from driver_factory import get_driver_factory, release_driver
+from memory_governor import get_memory_governor
+from tab_mux import NAV_START_SCRIPT, NAV_READY_SCRIPT
+
+
+
+MIN_SAMPLES = 20 # no hedging until there are enough load times to estimate the p95
+WINDOW = 200 # number of recent load times kept by page type
+MAX_HEDGE_SHARE = 0.1 # at most this share of the pages gets a second fetch
+LOAD_TIMEOUT = 60 # seconds before giving up on both fetches
+
+
+
+###################################################
+### Running p95 of the load time by page type   ###
+###################################################
+
+class LoadTimeTracker:
+
+    '''Keeps the recent load times by page type, the running p95 and the number of fetches, hedges and hedge wins.'''
+
+    def __init__(self, window=WINDOW):
+        self._lock = threading.Lock()
+        self.times = collections.defaultdict(lambda: collections.deque(maxlen=window))
+        self.counts = collections.defaultdict(lambda: {'fetches': 0, 'hedged': 0, 'hedge_won': 0})
+
+    def record(self, page_type, seconds):
+        with self._lock:
+            self.times[page_type].append(seconds)
+
+    def p95(self, page_type):
+
+        '''Returns the p95 of the recent load times, or None if there are fewer than MIN_SAMPLES.'''
+
+        with self._lock:
+            times = sorted(self.times[page_type])
+        if len(times) < MIN_SAMPLES:
+            return None
+        return times[int(0.95 * (len(times) - 1))]
+
+    def count(self, page_type, key):
+        with self._lock:
+            self.counts[page_type][key] += 1
+
+    def may_hedge(self, page_type):
+        with self._lock:
+            c = self.counts[page_type]
+            return c['hedged'] < MAX_HEDGE_SHARE * max(c['fetches'], 1)
+
+    def summary(self):
+        with self._lock:
+            return {page_type: dict(c, p95_s=None) for page_type, c in self.counts.items()}
+
+load_times = LoadTimeTracker()
+
+
+def hedging_summary():
+
+    '''Returns the fetches, hedges, hedge wins and the current p95 (seconds) by page type.'''
+
+    s = load_times.summary()
+    for page_type in s:
+        p95 = load_times.p95(page_type)
+        s[page_type]['p95_s'] = round(p95, 2) if p95 is not None else None
+    return s
+
+
+
+##############################
+### Function to hedge a get ###
+##############################
+
+def _start(driver, url):
+    if hasattr(driver, 'start_navigation'):
+        driver.start_navigation(url)
+    else:
+        driver.execute_script(NAV_START_SCRIPT, url)
+
+
+def _ready(driver):
+    try:
+        # the ms since the page became interactive, 0 included, or None while it loads
+        return driver.execute_script(NAV_READY_SCRIPT) is not None
+    except WebDriverException:
+        # the document is being replaced
+        return False
+
+
+def _cancel(driver):
+    try:
+        driver.execute_script('window.stop();')
+    except WebDriverException:
+        pass
+    release_driver(driver)
+
+
+def hedged_get(driver, identity, url, page_type, poll=0.1):
+
+    '''
+    Loads the url like driver.get, but when the page takes longer than the running p95 load time of its page type,
+    the same url is also loaded by a spare driver of the factory. Whichever is ready first is kept and the other one
+    is stopped and released. Only use it with drivers taken from the driver factory by the caller.
+    No second fetch is made when the memory governor has no room for one more browser.
+
+    Params:
+    -------
+    driver: WebDriver.
+      The driver of the caller.
+
+    identity: Identity.
+      The identity of the driver.
+
+    url: str.
+      The url to load.
+
+    page_type: str.
+      E.g., 'main', 'awards', 'releaseinfo' or 'companycredits'. The p95 is kept by page type.
+
+    Returns:
+    --------
+    driver: WebDriver.
+      The driver with the loaded page, which may be the spare driver.
+
+    identity: Identity.
+      The identity of the returned driver.
+    '''
+
+    load_times.count(page_type, 'fetches')
+    t1 = time.monotonic()
+    _start(driver, url)
+
+    threshold = load_times.p95(page_type)
+    backup, backup_identity = None, None
+    while time.monotonic() - t1 < LOAD_TIMEOUT:
+        if _ready(driver):
+            load_times.record(page_type, time.monotonic() - t1)
+            if backup is not None:
+                _cancel(backup)
+            return driver, identity
+
+        if backup is None and threshold is not None and time.monotonic() - t1 > threshold and load_times.may_hedge(page_type) \
+                and get_memory_governor().has_headroom():
+            print(f'{url} is slower than the p95 ({round(threshold, 2)}s). Fetching it again.', flush=True)
+            load_times.count(page_type, 'hedged')
+            backup, backup_identity = get_driver_factory().get()
+            _start(backup, url)
+
+        if backup is not None and _ready(backup):
+            load_times.record(page_type, time.monotonic() - t1)
+            load_times.count(page_type, 'hedge_won')
+            _cancel(driver)
+            return backup, backup_identity
+
+        time.sleep(poll)
+
+    # Neither is ready, keep the original driver and let the error checks of the caller handle the page
+    if backup is not None:
+        _cancel(backup)
+    load_times.record(page_type, time.monotonic() - t1)
+    return driver, identity
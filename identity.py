@@ -0,0 +1,263 @@
+import json
+import os
+import threading
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.wait import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException, WebDriverException
+# !pip install random_user_agent
+from random_user_agent.user_agent import UserAgent
+from random_user_agent.params import SoftwareName, OperatingSystem
+
+
+
+IMDB_BASE_URL = 'https://www.imdb.com'
+CONSENT_FILE = 'consent_state.json' # saved under the current working directory
+REJECT_BUTTON_XPATH = "//button[@data-testid='reject-button']"
+
+# A light page on the domain to land on before adding cookies (cookies can only be set for the current domain)
+COOKIE_LANDING_PATH = '/robots.txt'
+
+
+
+###########################################
+### Identity: a user agent + its cookies ###
+###########################################
+
+class Identity:
+
+    '''
+    A user agent together with the consent cookies obtained with it, one list of cookies per site.
+    The same identity is bound to a browser (or HTTP) session for its whole life,
+    so that the site sees a consistent user agent and consent state.
+
+    Params:
+    -------
+    user_agent: str.
+      The user agent string sent by the session.
+
+    cookies: dict or None.
+      The consent cookies by the base url of the site, e.g., {'https://www.imdb.com': [cookie, ...]}.
+    '''
+
+    def __init__(self, user_agent, cookies=None):
+        self.user_agent = user_agent
+        self.cookies = cookies if cookies else {}
+
+    def has_consent(self, base_url):
+        return bool(self.cookies.get(base_url))
+
+    def to_dict(self):
+        return {'user_agent': self.user_agent, 'cookies': self.cookies}
+
+
+
+##########################################################
+### Manager that builds the pool once and shares it    ###
+##########################################################
+
+class IdentityManager:
+
+    '''
+    Builds the user agent rotator only once and hands out identities in turn.
+    The consent cookies saved after declining the preferences are written to a json file
+    and restored in later sessions (and later runs), so the cookie banner does not need to be clicked on every page.
+
+    Params:
+    -------
+    consent_file: str.
+      The json file where the identities and their consent cookies are kept.
+
+    pool_size: int.
+      The number of identities (user agents) to rotate over.
+
+    limit: int.
+      The number of user agents the rotator is built with.
+    '''
+
+    def __init__(self, consent_file=CONSENT_FILE, pool_size=10, limit=100):
+        self.consent_file = consent_file
+        self._lock = threading.Lock()
+        self._next = 0
+
+        self.identities = self._load()
+        if len(self.identities) < pool_size:
+            # The rotator is expensive to construct, so it is only built when new identities are needed
+            software_names = [SoftwareName.FIREFOX.value, SoftwareName.CHROME.value]
+            operating_sys = [OperatingSystem.WINDOWS.value, OperatingSystem.LINUX.value]
+            user_agent_rotator = UserAgent(software_names=software_names, operating_systems=operating_sys, limit=limit)
+            known = {x.user_agent for x in self.identities}
+            attempts = 0
+            while len(self.identities) < pool_size and attempts < limit:
+                attempts += 1
+                user_agent = user_agent_rotator.get_random_user_agent()
+                if user_agent not in known:
+                    known.add(user_agent)
+                    self.identities.append(Identity(user_agent))
+
+
+    def _load(self):
+        if not os.path.exists(self.consent_file):
+            return []
+        try:
+            with open(self.consent_file, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            return [Identity(x['user_agent'], x.get('cookies')) for x in saved]
+        except (ValueError, KeyError, OSError) as e:
+            print(f'Cannot read the consent state {self.consent_file}: {e}', flush=True)
+            return []
+
+
+    def _save(self):
+        # Write to a temporary file first so that a crash does not leave a broken json file
+        tmp_path = self.consent_file + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump([x.to_dict() for x in self.identities], f)
+        os.replace(tmp_path, self.consent_file)
+
+
+    def next_identity(self):
+
+        '''Returns the next identity in the pool (round robin, safe to call from several threads).'''
+
+        with self._lock:
+            if not self.identities:
+                raise RuntimeError(f'The identity pool is empty: no identity in {self.consent_file} and the user agent rotator gave none')
+            identity = self.identities[self._next % len(self.identities)]
+            self._next += 1
+        return identity
+
+
+    def save_consent(self, identity, base_url, cookies):
+
+        '''Keeps the cookies obtained after declining the preferences and writes them to the consent file.'''
+
+        with self._lock:
+            identity.cookies[base_url] = cookies
+            self._save()
+
+
+    def forget_consent(self, identity, base_url):
+
+        '''Drops the saved cookies, e.g., when the banner shows up although they were restored.'''
+
+        with self._lock:
+            identity.cookies.pop(base_url, None)
+            self._save()
+
+
+    def restore_consent(self, driver, identity, base_url=IMDB_BASE_URL):
+
+        '''
+        Adds the saved consent cookies of the identity to the browser session.
+        Call it once per driver, before the first page of the site is loaded.
+
+        Params:
+        -------
+        driver: WebDriver.
+          A newly launched driver.
+
+        identity: Identity.
+          The identity the driver was launched with.
+
+        base_url: str.
+          The site the cookies belong to.
+
+        Returns:
+        --------
+        True if the cookies were restored, False if there was none to restore.
+        '''
+
+        if not identity.has_consent(base_url):
+            return False
+        try:
+            driver.get(base_url + COOKIE_LANDING_PATH)
+            for cookie in identity.cookies[base_url]:
+                driver.add_cookie(cookie)
+            return True
+        except WebDriverException as e:
+            print(f'Cannot restore the consent cookies: {e}', flush=True)
+            return False
+
+
+    def bind_http_session(self, session, identity, base_url=IMDB_BASE_URL):
+
+        '''
+        Binds the identity to an HTTP session (e.g., requests.Session): the user agent header and the consent cookies.
+
+        Returns:
+        --------
+        session: the same session, for chaining.
+        '''
+
+        session.headers.update({'User-Agent': identity.user_agent, 'Accept-Language': 'en-US'})
+        for cookie in identity.cookies.get(base_url, []):
+            session.cookies.set(cookie['name'], cookie['value'], domain=cookie.get('domain'), path=cookie.get('path', '/'))
+        return session
+
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+def get_identity_manager():
+
+    '''Returns the identity manager of the process, which is built on the first call.'''
+
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = IdentityManager()
+    return _manager
+
+
+
+###########################################
+### Function to decline the preferences ###
+###########################################
+
+def decline_preferences(driver, identity, base_url=IMDB_BASE_URL, timeout=30):
+
+    '''
+    Declines the preferences on the cookie banner.
+    When the consent cookies of the identity were restored, the banner normally does not show up,
+    so it is only checked once without waiting. Otherwise, wait for the banner as before,
+    click the reject button and save the resulting cookies for the later sessions.
+
+    Params:
+    -------
+    driver: WebDriver.
+      The driver on a page of the site.
+
+    identity: Identity.
+      The identity the driver was launched with.
+
+    base_url: str.
+      The site the cookies belong to.
+
+    timeout: int.
+      Seconds to wait for the banner when there is no saved consent.
+
+    Returns:
+    --------
+    None.
+    '''
+
+    manager = get_identity_manager()
+
+    if identity.has_consent(base_url):
+        # execute_script does not trigger the implicit wait, unlike find_elements
+        decline_button = driver.execute_script("return document.querySelector(\"button[data-testid='reject-button']\");")
+        if decline_button is None:
+            return
+        # The saved cookies are no longer accepted, click and save them again
+        driver.execute_script("arguments[0].click();", decline_button)
+        manager.save_consent(identity, base_url, driver.get_cookies())
+        return
+
+    try:
+        decline_button = WebDriverWait(driver, timeout).until(EC.element_to_be_clickable((By.XPATH, REJECT_BUTTON_XPATH)))
+        driver.execute_script("arguments[0].click();", decline_button)
+        manager.save_consent(identity, base_url, driver.get_cookies())
+    except TimeoutException:
+        print('No preference banner found.', flush=True)
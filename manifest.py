@@ -0,0 +1,415 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import date, timedelta
+from write_journal import get_write_journal, atomic_to_csv, append_csv
+
+
+
+MANIFEST_FILE = 'manifest.sqlite'
+RECENT = timedelta(weeks=2) # an artifact fetched within this period is not scraped again
+
+# 'csv' for one file per title, artifact and day, 'parquet' to append the rows to the datasets of parquet_store (needs pyarrow),
+# 'sqlite' to insert them into the tables of sqlite_sink
+OUTPUT_BACKEND = 'csv'
+# Whether write_artifact hands the data frames to the writer thread of output_writer instead of writing them in the scraper thread
+BACKGROUND_WRITES = True
+# Whether an output with the same content as the last stored version is not written again (only its last_verified date is updated)
+SKIP_UNCHANGED = True
+
+# Folders of the scraped files, scanned by rebuild ('Company credit' is the name used by the checks before the manifest)
+ARTIFACT_FOLDERS = ['Award', 'Release', 'Company Credit', 'Company credit', 'Main']
+
+# tconst_YYYY-MM-DD.csv (the award details) or tconst_<artifact>_YYYY-MM-DD.csv
+TITLE_FILE_PATTERN = re.compile(r'(tt\d+)_(?:([a-z]+)_)?(\d{4}-\d{2}-\d{2})\.csv$')
+# main_(i)_YYYY-MM-DD.csv, the main pages of the i-th batch
+BATCH_FILE_PATTERN = re.compile(r'main_\((\d+)\)_(\d{4}-\d{2}-\d{2})\.csv$')
+# main_stream[_worker]_YYYY-MM-DD.csv, the main pages appended by the streaming pipeline
+STREAM_FILE_PATTERN = re.compile(r'main_stream(?:_.+)?_(\d{4}-\d{2}-\d{2})\.csv$')
+
+
+
+def batch_key(i):
+
+    '''The key of the main file of the i-th batch (0-based) in the manifest, in place of a tconst.'''
+
+    return f'batch_{i+1}'
+
+
+def content_hash(df):
+
+    '''
+    Hash of the normalised content of a data frame: the values as stripped strings (missing values as ''), the rows in sorted order,
+    so the same data scraped in another order, or read back from its CSV file, has the same hash.
+    '''
+
+    values = df.astype(object).where(df.notna(), '').astype(str)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr(list(df.columns)).encode())
+    for row in sorted(tuple(v.strip() for v in row) for row in values.itertuples(index=False, name=None)):
+        h.update(repr(row).encode())
+    return h.hexdigest()
+
+
+
+########################################################
+### Manifest of the scraped files, indexed by title ###
+########################################################
+
+class Manifest:
+
+    '''
+    An index of every file written by the scrapers: the tconst, the artifact (e.g., 'gen', 'award', 'release', 'pro',
+    'distribution', 'main'), the fetch date, the number of rows, the path and the hash of the content. Checking whether a title has a recent file
+    is an indexed lookup instead of listing and matching every file of the folder.
+    Each record is one SQLite transaction, made right after the file is written (see write_artifact).
+    A title scraped again with the same content keeps its former file, and the last_verified date of that version is updated:
+    the freshness of an artifact is its last_verified date, and a new version is stored only when the content changes.
+
+    Params:
+    -------
+    path: str.
+      The SQLite file.
+    '''
+
+    def __init__(self, path=MANIFEST_FILE):
+        self.path = path
+        self._local = threading.local()
+        self._conn().executescript('''
+            CREATE TABLE IF NOT EXISTS artifacts (
+                tconst TEXT NOT NULL,
+                artifact TEXT NOT NULL,
+                fetch_date TEXT NOT NULL,
+                rows INTEGER,
+                path TEXT,
+                written_at REAL,
+                content_hash TEXT,
+                last_verified TEXT,
+                PRIMARY KEY (tconst, artifact, fetch_date));
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        ''')
+        # manifests created before the content hashes
+        columns = [c[1] for c in self._conn().execute('PRAGMA table_info(artifacts)')]
+        for c in ['content_hash', 'last_verified']:
+            if c not in columns:
+                self._conn().execute(f'ALTER TABLE artifacts ADD COLUMN {c} TEXT')
+
+
+    def _conn(self):
+        # One connection per thread, SQLite connections cannot be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+
+    def record(self, tconst, artifact, path, rows, fetch_date=None, digest=None):
+
+        '''Records a written file. Writing the same artifact again on the same day replaces the record.'''
+
+        fetch_date = str(fetch_date or date.today())
+        self._conn().execute('INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                             (tconst, artifact, fetch_date, rows, path, time.time(), digest, fetch_date))
+
+
+    def record_many(self, records):
+
+        '''
+        Records the written files [(tconst, artifact, path, rows, digest), ...] of the same day in one transaction.
+        A record without a path is an unchanged output: the last_verified date of the latest version is updated instead.
+        '''
+
+        fetch_date = str(date.today())
+        now = time.time()
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany('INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                             ((t, a, fetch_date, n, p, now, h, fetch_date) for t, a, p, n, h in records if p is not None))
+            conn.executemany('''
+                UPDATE artifacts SET last_verified = ? WHERE rowid = (
+                    SELECT rowid FROM artifacts WHERE tconst = ? AND artifact = ? ORDER BY fetch_date DESC LIMIT 1)''',
+                             ((fetch_date, t, a) for t, a, p, _, _ in records if p is None))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+
+    def latest_hash(self, tconst, artifact):
+
+        '''
+        Returns the content hash of the latest version of the artifact, or None. The hash of a file indexed by rebuild
+        (before the hashes) is computed from the file the first time.
+        '''
+
+        row = self._conn().execute('''
+            SELECT fetch_date, path, content_hash FROM artifacts WHERE tconst = ? AND artifact = ?
+            ORDER BY fetch_date DESC LIMIT 1''', (tconst, artifact)).fetchone()
+        if row is None:
+            return None
+        fetch_date, path, digest = row
+        if digest is None and path and TITLE_FILE_PATTERN.match(os.path.basename(path)) and os.path.isfile(path):
+            import pandas as pd
+            try:
+                digest = content_hash(pd.read_csv(path, dtype=str))
+            except (pd.errors.EmptyDataError, pd.errors.ParserError):
+                return None
+            self._conn().execute('UPDATE artifacts SET content_hash = ? WHERE tconst = ? AND artifact = ? AND fetch_date = ?',
+                                 (digest, tconst, artifact, fetch_date))
+        return digest
+
+
+    def forget(self, tconst, artifact, fetch_date):
+
+        '''Removes the record of an artifact that was not completely written (see write_journal).'''
+
+        self._conn().execute('DELETE FROM artifacts WHERE tconst = ? AND artifact = ? AND fetch_date = ?', (tconst, artifact, str(fetch_date)))
+
+
+    def move(self, old_paths, new_path):
+
+        '''Points the records of the files old_paths to new_path, e.g., when the main files of the workers are merged (see crawl_shards).'''
+
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for p in old_paths:
+                conn.execute('UPDATE artifacts SET path = ? WHERE path IN (?, ?)', (os.path.abspath(new_path), p, os.path.abspath(p)))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+
+    def latest(self, tconst, artifact):
+
+        '''Returns (fetch_date, rows, path) of the latest file of the artifact, or None.'''
+
+        return self._conn().execute('''
+            SELECT fetch_date, rows, path FROM artifacts WHERE tconst = ? AND artifact = ?
+            ORDER BY fetch_date DESC LIMIT 1''', (tconst, artifact)).fetchone()
+
+
+    def latest_dates(self, artifacts):
+
+        '''Returns the latest fetch (or verification) date (a date) of each (tconst, artifact) for the given artifacts, in one query.'''
+
+        marks = ', '.join('?' * len(artifacts))
+        rows = self._conn().execute(f'''
+            SELECT tconst, artifact, MAX(COALESCE(last_verified, fetch_date)) FROM artifacts WHERE artifact IN ({marks})
+            GROUP BY tconst, artifact''', list(artifacts))
+        return {(t, a): date.fromisoformat(d) for t, a, d in rows}
+
+
+    def has_recent(self, tconst, artifact, max_age=RECENT):
+
+        '''Whether the artifact of the title was fetched (or found unchanged) within max_age (and not in the future).'''
+
+        today = date.today()
+        return self._conn().execute('''
+            SELECT 1 FROM artifacts WHERE tconst = ? AND artifact = ? AND COALESCE(last_verified, fetch_date) BETWEEN ? AND ? LIMIT 1''',
+            (tconst, artifact, str(today - max_age), str(today))).fetchone() is not None
+
+
+    def is_built(self):
+        return self._conn().execute("SELECT 1 FROM meta WHERE key = 'rebuilt_at'").fetchone() is not None
+
+
+    def rebuild(self, root=None):
+
+        '''
+        Indexes the files already in the folders of the scrapers (ARTIFACT_FOLDERS under root, the working directory by default).
+        Only needed once: afterwards every write is recorded. Returns the number of files indexed.
+        '''
+
+        root = root or os.getcwd()
+        records = []
+        for folder in ARTIFACT_FOLDERS:
+            directory = os.path.join(root, folder)
+            if not os.path.isdir(directory):
+                continue
+            for file_name in os.listdir(directory):
+                path = os.path.join(directory, file_name)
+                match = TITLE_FILE_PATTERN.match(file_name)
+                if match:
+                    tconst, artifact, fetch_date = match.groups()
+                    records.append((tconst, artifact or 'award', fetch_date, _count_rows(path), path))
+                    continue
+                match = BATCH_FILE_PATTERN.match(file_name)
+                if match:
+                    records.append((batch_key(int(match.group(1)) - 1), 'main', match.group(2), _count_rows(path), path))
+                    continue
+                match = STREAM_FILE_PATTERN.match(file_name)
+                if match:
+                    # one record per title appended to the file
+                    import pandas as pd
+                    tconsts = pd.read_csv(path, usecols=['tconst'])['tconst']
+                    records.extend((t, 'main', match.group(1), 1, path) for t in tconsts)
+
+        now = time.time()
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # the hashes and verification dates already recorded are kept
+            conn.executemany('''
+                INSERT INTO artifacts (tconst, artifact, fetch_date, rows, path, written_at) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (tconst, artifact, fetch_date) DO UPDATE SET rows = excluded.rows, path = excluded.path''',
+                             ((t, a, d, n, p, now) for t, a, d, n, p in records))
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('rebuilt_at', ?)", (str(now),))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        print(f'Manifest rebuilt from {len(records)} files', flush=True)
+        return len(records)
+
+
+    def counts(self):
+
+        '''Returns the number of files by artifact.'''
+
+        return dict(self._conn().execute('SELECT artifact, COUNT(*) FROM artifacts GROUP BY artifact').fetchall())
+
+
+
+def _count_rows(path):
+    # the data rows of a CSV file, without the header
+    with open(path, 'rb') as f:
+        return max(0, sum(1 for _ in f) - 1)
+
+
+
+_manifest = None
+_manifest_lock = threading.Lock()
+
+def get_manifest():
+
+    '''Returns the manifest of the process. The first time the manifest file is created, it is rebuilt from the existing folders.'''
+
+    global _manifest
+    with _manifest_lock:
+        if _manifest is None:
+            _manifest = Manifest()
+            if not _manifest.is_built():
+                _manifest.rebuild()
+    return _manifest
+
+
+
+#####################################################
+### Function every scraper uses to write its files ###
+#####################################################
+
+def write_artifact(df, path, tconst, artifact, append=False, negative=None):
+
+    '''
+    Writes the data frame to the CSV file (or appends it to the Parquet dataset of the artifact with OUTPUT_BACKEND = 'parquet',
+    or inserts it into the SQLite table of the artifact with OUTPUT_BACKEND = 'sqlite') and records it in the manifest. With BACKGROUND_WRITES, the data frame is queued for the writer thread and
+    the scraper thread goes on at once (see output_writer).
+    Placeholder files (the title returned nothing) are also recorded in the negative cache with the reason,
+    and a file with data removes the title from the negative cache.
+    The output is recorded in the write journal first and removed from it once written and recorded, so the outputs
+    lost by a crash are found at the next start (see write_journal). A CSV file is written to a temp file and renamed.
+    With SKIP_UNCHANGED, an output with the same content hash as the latest version of the artifact is not written:
+    only the last_verified date of that version is updated in the manifest.
+
+    Params:
+    -------
+    df: DataFrame.
+      The scraped data.
+
+    path: str.
+      The output file path. Not used with the Parquet store and the SQLite sink.
+
+    tconst: str.
+      The title id (or batch_key(i) for the main file of a batch).
+
+    artifact: str.
+      The kind of file, e.g., 'gen', 'award', 'release', 'pro', 'distribution' or 'main'.
+
+    append: bool.
+      Whether to append to the file (with the header only if the file is new), like the main file of the streaming pipeline.
+
+    negative: str or None.
+      The reason why the file is a placeholder (page_classifier.NOT_FOUND, EMPTY or ERROR), None if it has data.
+    '''
+
+    journal_id = get_write_journal().begin(tconst, artifact, path, append)
+    # hashed in the scraper thread, the writer thread only compares
+    digest = content_hash(df) if SKIP_UNCHANGED else None
+    if BACKGROUND_WRITES:
+        # imported here since output_writer uses the functions below
+        from output_writer import get_output_writer
+        get_output_writer().submit(df, path, tconst, artifact, append, negative, journal_id, digest)
+        return
+    path = store_artifact(df, path, tconst, artifact, append, journal_id, digest)
+    flush_stores()
+    record_artifacts([(tconst, artifact, path, len(df), append, negative, journal_id, digest)])
+
+
+def store_artifact(df, path, tconst, artifact, append=False, journal_id=None, digest=None):
+
+    '''
+    Writes the data frame like write_artifact, without recording it. Returns the path to record,
+    or None if the content has the digest of the latest version (nothing is written).
+    '''
+
+    if digest is not None and digest == get_manifest().latest_hash(tconst, artifact):
+        return None
+    if OUTPUT_BACKEND == 'parquet':
+        # imported here since pyarrow is only needed for this backend
+        from parquet_store import get_parquet_store, STORE_ROOT, DATASETS
+        # the journal entry is completed when the buffer is written
+        get_parquet_store().append(artifact, df, tconst, journal_id)
+        return os.path.join(STORE_ROOT, DATASETS.get(artifact, artifact))
+    if OUTPUT_BACKEND == 'sqlite':
+        from sqlite_sink import get_sqlite_sink, SINK_FILE
+        get_sqlite_sink().append(artifact, df, tconst)
+        return SINK_FILE
+    if append:
+        append_csv(df, path)
+    else:
+        atomic_to_csv(df, path)
+    return path
+
+
+def flush_stores():
+
+    '''Inserts the rows buffered by store_artifact into the SQLite sink in one transaction (nothing to do for the other backends).'''
+
+    if OUTPUT_BACKEND == 'sqlite':
+        from sqlite_sink import get_sqlite_sink
+        get_sqlite_sink().flush()
+
+
+def record_artifacts(items):
+
+    '''Records the written data frames [(tconst, artifact, path, rows, append, negative, journal_id, digest), ...] in the manifest
+    (in one transaction, a path None being an unchanged output) and in the negative cache, and completes their entries of the write journal.'''
+
+    get_manifest().record_many([(t, a, p, n, h) for t, a, p, n, _, _, _, h in items])
+
+    # imported here since the negative cache needs selenium (through page_classifier) while the manifest does not
+    from negative_cache import get_negative_cache
+    for tconst, artifact, _, _, append, negative, _, _ in items:
+        if negative is not None:
+            get_negative_cache().record(tconst, artifact, negative)
+        elif not append:
+            get_negative_cache().clear(tconst, artifact)
+    # the Parquet store completes the entries of the rows it buffered once they are written
+    get_write_journal().complete([i[6] for i in items if OUTPUT_BACKEND != 'parquet' or i[2] is None])
+
+
+if __name__ == '__main__':
+
+    # Rebuilds the manifest from the folders of the working directory, e.g., after moving or deleting files by hand
+    manifest = Manifest()
+    manifest.rebuild()
+    print(f'Files by artifact: {manifest.counts()}')
@@ -0,0 +1,187 @@
+import threading
+import time
+# !pip install psutil
+import psutil
+
+
+
+MEMORY_RESERVE_MB = 1024 # RAM left free for the system and the Python process
+BROWSER_ESTIMATE_MB = 500 # expected RSS of a new browser until there are measures
+RECYCLE_MB = 1500 # a browser whose process tree grows past this is quit at the next safe point
+SAMPLE_EVERY = 2 # seconds between two samples of the browser processes
+
+
+
+##################################################################
+### Governor admitting new browsers by the free memory ###
+##################################################################
+
+class MemoryGovernor:
+
+    '''
+    Samples the RSS of the process tree (geckodriver, Firefox and its content processes) of each browser,
+    and lets a new browser start only when the available memory minus MEMORY_RESERVE_MB can hold one more,
+    estimated by the largest running browser. Since every title needs a browser, this limits the titles
+    in flight by the memory instead of the thread count. Browsers that grow past RECYCLE_MB are reported by
+    should_recycle, so that the scraper replaces them between two pages.
+
+    Params:
+    -------
+    reserve_mb: int.
+      The memory (MB) to keep available.
+
+    recycle_mb: int.
+      The RSS (MB) of a browser tree above which it should be replaced.
+
+    sample_every: float.
+      Seconds between two samples.
+    '''
+
+    def __init__(self, reserve_mb=MEMORY_RESERVE_MB, recycle_mb=RECYCLE_MB, sample_every=SAMPLE_EVERY):
+        self.reserve = reserve_mb * 2**20
+        self.recycle = recycle_mb * 2**20
+        self.sample_every = sample_every
+        self._cond = threading.Condition()
+        self._pids = {} # id of the driver: pid of its geckodriver
+        self._rss = {} # id of the driver: last RSS of its process tree
+        self._starting = 0 # browsers admitted but not registered yet
+        self.estimate = BROWSER_ESTIMATE_MB * 2**20
+        self.stats = {'admitted': 0, 'waited': 0, 'wait_s': 0.0, 'recycled': 0, 'peak_browser_mb': 0, 'min_available_mb': None}
+        threading.Thread(target=self._sample_loop, daemon=True).start()
+
+
+    def _tree_rss(self, pid):
+        try:
+            process = psutil.Process(pid)
+            processes = [process] + process.children(recursive=True)
+        except psutil.Error:
+            return 0
+        rss = 0
+        for p in processes:
+            try:
+                rss += p.memory_info().rss
+            except psutil.Error:
+                # the process ended between the listing and the measure
+                pass
+        return rss
+
+
+    def _sample_loop(self):
+        while True:
+            with self._cond:
+                pids = dict(self._pids)
+            rss = {key: self._tree_rss(pid) for key, pid in pids.items()}
+            with self._cond:
+                for key, value in rss.items():
+                    if key in self._pids:
+                        self._rss[key] = value
+                        self.stats['peak_browser_mb'] = max(self.stats['peak_browser_mb'], value // 2**20)
+                # a new browser is expected to grow like the largest running one
+                self.estimate = max([BROWSER_ESTIMATE_MB * 2**20] + list(self._rss.values()))
+                # memory may have been freed by quit browsers
+                self._cond.notify_all()
+            time.sleep(self.sample_every)
+
+
+    def _headroom(self):
+        available = psutil.virtual_memory().available
+        mb = available // 2**20
+        if self.stats['min_available_mb'] is None or mb < self.stats['min_available_mb']:
+            self.stats['min_available_mb'] = mb
+        return available - self.reserve - self._starting * self.estimate
+
+
+    def has_headroom(self):
+
+        '''Whether one more browser fits in the memory now.'''
+
+        with self._cond:
+            return self._headroom() >= self.estimate
+
+
+    def admit(self):
+
+        '''
+        Waits until one more browser fits in the memory, then counts it as starting until register is called.
+        A browser is always admitted when none is running or starting, so the crawl cannot stall.
+        '''
+
+        t1 = time.monotonic()
+        waited = False
+        with self._cond:
+            while self._headroom() < self.estimate and (self._pids or self._starting):
+                if not waited:
+                    print(f'Waiting for memory: {psutil.virtual_memory().available // 2**20} MB available, '
+                          f'{len(self._pids)} browsers running', flush=True)
+                    waited = True
+                self._cond.wait(self.sample_every)
+            self._starting += 1
+            self.stats['admitted'] += 1
+            if waited:
+                self.stats['waited'] += 1
+                self.stats['wait_s'] += time.monotonic() - t1
+
+
+    def cancel(self):
+
+        '''Gives back an admission whose browser did not start.'''
+
+        with self._cond:
+            self._starting = max(0, self._starting - 1)
+            self._cond.notify_all()
+
+
+    def register(self, driver):
+
+        '''Tracks the process tree of an admitted browser, found from the pid of its geckodriver.'''
+
+        with self._cond:
+            self._starting = max(0, self._starting - 1)
+            try:
+                self._pids[id(driver)] = driver.service.process.pid
+            except AttributeError:
+                pass
+
+
+    def unregister(self, driver):
+        with self._cond:
+            self._pids.pop(id(driver), None)
+            self._rss.pop(id(driver), None)
+            self._cond.notify_all()
+
+
+    def should_recycle(self, driver):
+
+        '''Whether the browser grew past recycle_mb at the last sample. Counts the browsers to recycle.'''
+
+        with self._cond:
+            recycle = self._rss.get(id(driver), 0) > self.recycle
+            if recycle:
+                self.stats['recycled'] += 1
+        return recycle
+
+
+    def summary(self):
+
+        '''Returns the browsers admitted, how many waited for memory and how long, the recycled browsers,
+        the largest browser tree (MB), the current estimate (MB) and the lowest available memory (MB).'''
+
+        with self._cond:
+            s = dict(self.stats, running=len(self._pids), estimate_mb=self.estimate // 2**20)
+        s['wait_s'] = round(s['wait_s'], 2)
+        return s
+
+
+
+_governor = None
+_governor_lock = threading.Lock()
+
+def get_memory_governor():
+
+    '''Returns the memory governor of the process, which starts sampling on the first call.'''
+
+    global _governor
+    with _governor_lock:
+        if _governor is None:
+            _governor = MemoryGovernor()
+    return _governor
@@ -0,0 +1,215 @@
+import os
+import sqlite3
+import threading
+from datetime import date, timedelta
+import pandas as pd
+from manifest import BATCH_FILE_PATTERN, STREAM_FILE_PATTERN
+from numeric_parse import parse_count
+
+
+
+METRICS_FILE = 'metrics.sqlite'
+# Fast-moving columns of the main page (see scrape_view)
+METRICS = ['num_watchlist', 'num_review', 'num_critic', 'metascore', 'num_photo', 'num_video', 'streaming_provider', 'rent_provider']
+PROVIDER_METRICS = ['streaming_provider', 'rent_provider']
+
+
+
+########################################################
+### Time series of the main page metrics, by change ###
+########################################################
+
+class MetricsStore:
+
+    '''
+    Keeps the metrics of the main page (METRICS) as one time series per (tconst, metric), delta-encoded:
+    an observation is stored only when the value differs from the previous one, with the numeric change (delta) from it.
+    An unchanged observation only moves the last_seen date of the current value. The changes are clustered by
+    (tconst, metric, date), so the history of a title over a period is one index range, without reading the dated main files.
+
+    Params:
+    -------
+    path: str.
+      The SQLite file.
+    '''
+
+    def __init__(self, path=METRICS_FILE):
+        self.path = path
+        self._local = threading.local()
+        self._conn().executescript('''
+            CREATE TABLE IF NOT EXISTS changes (
+                tconst TEXT NOT NULL,
+                metric TEXT NOT NULL,
+                obs_date TEXT NOT NULL,
+                value TEXT,
+                num REAL,
+                delta REAL,
+                PRIMARY KEY (tconst, metric, obs_date)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_changes_metric ON changes (metric, obs_date);
+            CREATE TABLE IF NOT EXISTS latest (
+                tconst TEXT NOT NULL,
+                metric TEXT NOT NULL,
+                value TEXT,
+                num REAL,
+                since TEXT NOT NULL,
+                last_seen TEXT NOT NULL,
+                PRIMARY KEY (tconst, metric)) WITHOUT ROWID;
+        ''')
+
+
+    def _conn(self):
+        # One connection per thread, SQLite connections cannot be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+
+    def observe(self, df, obs_date=None):
+
+        '''
+        Records the metrics of the main page rows (a data frame or a dict of columns) observed on obs_date (today by default),
+        in one transaction. Returns the number of changes stored. Observations older than the last one of a series are ignored,
+        and so are the missing counts (e.g., of a main page that failed to load): a missing value is not a change.
+        A missing provider is a change (the title left the platform) only when the page had counts, i.e., it loaded.
+        '''
+
+        df = pd.DataFrame(df)
+        obs_date = str(obs_date or date.today())
+        metrics = [m for m in METRICS if m in df.columns]
+        df = df[['tconst'] + metrics].astype(object).where(df[['tconst'] + metrics].notna(), None)
+        conn = self._conn()
+        changes = 0
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for row in df.itertuples(index=False, name=None):
+                tconst = row[0]
+                loaded = any(v is not None for m, v in zip(metrics, row[1:]) if m not in PROVIDER_METRICS)
+                for metric, value in zip(metrics, row[1:]):
+                    if value is None and not (loaded and metric in PROVIDER_METRICS):
+                        continue
+                    value = None if value is None else str(value)
+                    current = conn.execute('SELECT value, num, last_seen FROM latest WHERE tconst = ? AND metric = ?',
+                                           (tconst, metric)).fetchone()
+                    if current is not None and current[2] >= obs_date:
+                        continue
+                    if current is not None and current[0] == value:
+                        conn.execute('UPDATE latest SET last_seen = ? WHERE tconst = ? AND metric = ?', (obs_date, tconst, metric))
+                        continue
+                    # the count (e.g., '1.2K' -> 1200.0) for the deltas, None for the providers
+                    num = parse_count(value)
+                    delta = num - current[1] if num is not None and current is not None and current[1] is not None else None
+                    conn.execute('INSERT OR REPLACE INTO changes VALUES (?, ?, ?, ?, ?, ?)', (tconst, metric, obs_date, value, num, delta))
+                    conn.execute('INSERT OR REPLACE INTO latest VALUES (?, ?, ?, ?, ?, ?)', (tconst, metric, value, num, obs_date, obs_date))
+                    changes += 1
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return changes
+
+
+    def series(self, tconst, metric, start=None, end=None):
+
+        '''
+        Returns the changes of the metric of the title between start and end (dates or YYYY-MM-DD, all by default):
+        a DataFrame with obs_date, value, num and delta, starting with the value in effect at start.
+        '''
+
+        start = str(start or '0000-00-00')
+        end = str(end or '9999-12-31')
+        return pd.read_sql_query('''
+            SELECT obs_date, value, num, delta FROM (
+                SELECT * FROM changes WHERE tconst = ? AND metric = ? AND obs_date < ? ORDER BY obs_date DESC LIMIT 1)
+            UNION ALL
+            SELECT obs_date, value, num, delta FROM changes WHERE tconst = ? AND metric = ? AND obs_date BETWEEN ? AND ?
+            ORDER BY obs_date''', self._conn(), params=(tconst, metric, start, tconst, metric, start, end))
+
+
+    def values_at(self, metric, day=None, tconsts=None):
+
+        '''Returns the value of the metric in effect on day (today by default) for each title (or the given ones): a DataFrame with tconst, value and num.'''
+
+        day = str(day or date.today())
+        sql = '''
+            SELECT c.tconst, c.value, c.num FROM changes c
+            JOIN (SELECT tconst, MAX(obs_date) AS obs_date FROM changes WHERE metric = ? AND obs_date <= ? GROUP BY tconst) last
+            ON c.tconst = last.tconst AND c.metric = ? AND c.obs_date = last.obs_date'''
+        df = pd.read_sql_query(sql, self._conn(), params=(metric, day, metric))
+        if tconsts is not None:
+            df = df[df['tconst'].isin(set(tconsts))]
+        return df.reset_index(drop=True)
+
+
+    def growth(self, metric, days=90, end=None, tconsts=None):
+
+        '''
+        Returns the change of a numeric metric over the days before end (today by default), e.g., growth('num_watchlist', 90):
+        a DataFrame with tconst, start, end and growth (end - start), the titles with the largest growth first.
+        '''
+
+        end = date.fromisoformat(str(end)) if end else date.today()
+        first = self.values_at(metric, end - timedelta(days=days), tconsts)[['tconst', 'num']].rename(columns={'num': 'start'})
+        last = self.values_at(metric, end, tconsts)[['tconst', 'num']].rename(columns={'num': 'end'})
+        df = first.merge(last, on='tconst')
+        df['growth'] = df['end'] - df['start']
+        return df.sort_values('growth', ascending=False, ignore_index=True)
+
+
+    def backfill(self, root=None):
+
+        '''
+        Records the metrics of the main files already in the Main folder (batch and stream files), oldest first.
+        Returns the number of changes stored.
+        '''
+
+        directory = os.path.join(root or os.getcwd(), 'Main')
+        files = []
+        for file_name in os.listdir(directory) if os.path.isdir(directory) else []:
+            match = BATCH_FILE_PATTERN.match(file_name)
+            fetch_date = match.group(2) if match else None
+            if match is None:
+                match = STREAM_FILE_PATTERN.match(file_name)
+                fetch_date = match.group(1) if match else None
+            if match:
+                files.append((fetch_date, os.path.join(directory, file_name)))
+        changes = 0
+        for fetch_date, path in sorted(files):
+            changes += self.observe(pd.read_csv(path, dtype=str), fetch_date)
+        print(f'{changes} changes from {len(files)} main files', flush=True)
+        return changes
+
+
+    def counts(self):
+
+        '''Returns the number of series and of stored changes by metric.'''
+
+        return {m: {'series': s, 'changes': c} for m, s, c in self._conn().execute('''
+            SELECT metric, COUNT(DISTINCT tconst), COUNT(*) FROM changes GROUP BY metric''')}
+
+
+
+_metrics_store = None
+_metrics_store_lock = threading.Lock()
+
+def get_metrics_store():
+
+    '''Returns the metrics store of the process.'''
+
+    global _metrics_store
+    with _metrics_store_lock:
+        if _metrics_store is None:
+            _metrics_store = MetricsStore()
+    return _metrics_store
+
+
+
+if __name__ == '__main__':
+
+    # Loads the main files of the working directory into the store, e.g., once before the first crawl that records the metrics
+    store = get_metrics_store()
+    store.backfill()
+    print(f'Metrics: {store.counts()}')
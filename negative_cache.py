@@ -0,0 +1,133 @@
+import collections
+import sqlite3
+import threading
+from datetime import date, timedelta
+from page_classifier import NOT_FOUND, EMPTY, ERROR
+
+
+
+NEGATIVE_CACHE_FILE = 'negative_cache.sqlite'
+
+# Days before a title that returned nothing is fetched again, by reason. The TTL doubles each time the title
+# returns nothing again, up to NEGATIVE_MAX_DAYS. Other errors are retried soon, they may be transient.
+NEGATIVE_TTL_DAYS = {NOT_FOUND: 30, EMPTY: 60, ERROR: 3}
+NEGATIVE_MAX_DAYS = 365
+
+
+
+###############################################
+### Cache of the titles that returned nothing ###
+###############################################
+
+class NegativeCache:
+
+    '''
+    Records the artifacts of a title that returned nothing (a 404, an empty section such as no awards, or another error)
+    with the reason and an expiry date, so these titles are skipped before any browser is launched.
+    The TTL grows each time the same artifact returns nothing again, and the entry is removed when data is found.
+
+    Params:
+    -------
+    path: str.
+      The SQLite file.
+    '''
+
+    def __init__(self, path=NEGATIVE_CACHE_FILE):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.skipped = collections.Counter() # reason: titles skipped in this run
+        self._conn().executescript('''
+            CREATE TABLE IF NOT EXISTS negative (
+                tconst TEXT NOT NULL,
+                artifact TEXT NOT NULL,
+                reason TEXT NOT NULL,
+                hits INTEGER NOT NULL,
+                first_seen TEXT NOT NULL,
+                last_seen TEXT NOT NULL,
+                expires TEXT NOT NULL,
+                PRIMARY KEY (tconst, artifact));
+        ''')
+
+
+    def _conn(self):
+        # One connection per thread, SQLite connections cannot be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+
+    def record(self, tconst, artifact, reason):
+
+        '''Records that the artifact of the title returned nothing, and doubles its TTL if it already did last time.'''
+
+        conn = self._conn()
+        today = date.today()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT hits, first_seen FROM negative WHERE tconst = ? AND artifact = ?', (tconst, artifact)).fetchone()
+            hits, first_seen = (row[0] + 1, row[1]) if row else (1, str(today))
+            days = min(NEGATIVE_TTL_DAYS.get(reason, NEGATIVE_TTL_DAYS[ERROR]) * 2**(hits - 1), NEGATIVE_MAX_DAYS)
+            conn.execute('INSERT OR REPLACE INTO negative VALUES (?, ?, ?, ?, ?, ?, ?)',
+                         (tconst, artifact, reason, hits, first_seen, str(today), str(today + timedelta(days=days))))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+
+    def clear(self, tconst, artifact):
+
+        '''Removes the entry once the artifact of the title has data.'''
+
+        self._conn().execute('DELETE FROM negative WHERE tconst = ? AND artifact = ?', (tconst, artifact))
+
+
+    def lookup(self, tconst, artifact):
+
+        '''Returns (reason, hits, expires) if the artifact of the title is cached as returning nothing and not expired, else None.'''
+
+        return self._conn().execute('SELECT reason, hits, expires FROM negative WHERE tconst = ? AND artifact = ? AND expires >= ?',
+                                    (tconst, artifact, str(date.today()))).fetchone()
+
+
+    def should_skip(self, tconst, artifact):
+
+        '''Whether to skip the artifact of the title. Counts the skipped titles by reason.'''
+
+        entry = self.lookup(tconst, artifact)
+        if entry is None:
+            return False
+        with self._lock:
+            self.skipped[entry[0]] += 1
+        print(f'{tconst} {artifact} skipped: {entry[0]} {entry[1]} time(s), until {entry[2]}', flush=True)
+        return True
+
+
+    def summary(self):
+
+        '''Returns the entries in the cache and the titles skipped in this run, by reason.'''
+
+        cached = dict(self._conn().execute('SELECT reason, COUNT(*) FROM negative WHERE expires >= ? GROUP BY reason',
+                                           (str(date.today()),)).fetchall())
+        with self._lock:
+            return {'cached': cached, 'skipped': dict(self.skipped)}
+
+
+
+_negative_cache = None
+_negative_cache_lock = threading.Lock()
+
+def get_negative_cache():
+
+    '''Returns the negative cache of the process.'''
+
+    global _negative_cache
+    with _negative_cache_lock:
+        if _negative_cache is None:
+            _negative_cache = NegativeCache()
+    return _negative_cache
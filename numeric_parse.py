@@ -0,0 +1,182 @@
+import argparse
+import re
+import time
+import numpy as np
+import pandas as pd
+
+
+
+# 1.2K, 3M, 12,345, 87 or 99+ (the counts of the main page, see scrape_watchlist, scrape_score and scrape_visual)
+COUNT_PATTERN = r'^\s*(?P<number>\d[\d,]*(?:\.\d+)?|\.\d+)\s*(?P<suffix>[KMB]?)\+?\s*$'
+COUNT_SUFFIXES = {'': 1.0, 'K': 1e3, 'M': 1e6, 'B': 1e9}
+# $12,345,678 (estimated), CA$1,000,000, €5,000,000 or ₹ 2,000,000,000; the opening weekend is followed by its date ('; Jul 21, 2023')
+MONEY_PATTERN = r'^\s*(?P<symbol>[^\d\s;]*)\s*(?P<amount>\d[\d,]*(?:\.\d+)?)'
+# ISO code of the currency prefixes shown by IMDB (other prefixes are kept as they are)
+CURRENCIES = {'$': 'USD', 'US$': 'USD', 'CA$': 'CAD', 'A$': 'AUD', 'NZ$': 'NZD', 'HK$': 'HKD', 'R$': 'BRL', 'MX$': 'MXN',
+              '€': 'EUR', '£': 'GBP', '¥': 'JPY', 'JP¥': 'JPY', 'CN¥': 'CNY', '₹': 'INR', '₩': 'KRW', '₽': 'RUB', '₺': 'TRY'}
+
+COUNT_COLUMNS = ['num_watchlist', 'num_review', 'num_critic', 'num_photo', 'num_video']
+SCORE_COLUMNS = ['metascore']
+MONEY_COLUMNS = ['budget', 'open_boxoffice_america', 'gross_boxoffice_america', 'gross_boxoffice_world']
+
+
+
+###########################################
+### Vectorised parsing of the text values ###
+###########################################
+
+def _factorize(s):
+    # the same texts come back in many rows (e.g., '1.2K'), so each distinct text is parsed once
+    codes, uniques = pd.factorize(s, use_na_sentinel=True)
+    return codes, pd.Series(uniques, dtype='string')
+
+
+def _take(values, codes, missing=np.nan):
+    # the parsed value of each row, missing for the missing texts (code -1)
+    if len(values) == 0:
+        return np.full(len(codes), missing)
+    return np.where(codes >= 0, np.asarray(values)[codes], missing)
+
+
+def parse_counts(s):
+
+    '''Turns a series of counts ('1.2K', '3M', '12,345', '99+') into floats, NaN for the missing and unparsable values.'''
+
+    codes, uniques = _factorize(s)
+    parts = uniques.str.extract(COUNT_PATTERN)
+    number = pd.to_numeric(parts['number'].str.replace(',', '', regex=False), errors='coerce')
+    values = (number * parts['suffix'].map(COUNT_SUFFIXES)).to_numpy(dtype='float64', na_value=np.nan)
+    return pd.Series(_take(values, codes), index=s.index, name=s.name)
+
+
+def parse_count(value):
+
+    '''parse_counts for one value: the count as a float, or None.'''
+
+    if value is None:
+        return None
+    match = re.match(COUNT_PATTERN, str(value))
+    if match is None:
+        return None
+    return float(match.group('number').replace(',', '')) * COUNT_SUFFIXES[match.group('suffix')]
+
+
+def parse_money(s):
+
+    '''
+    Turns a series of amounts ('$12,345,678 (estimated)', 'CA$1,000,000; Jul 21, 2023') into a DataFrame with the columns
+    <name>_amount (float), <name>_currency (category of ISO codes) and <name>_estimated (boolean, missing if the amount is missing).
+    '''
+
+    codes, uniques = _factorize(s)
+    parts = uniques.str.extract(MONEY_PATTERN)
+    amount = pd.to_numeric(parts['amount'].str.replace(',', '', regex=False), errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    symbol = parts['symbol'].astype(object)
+    currency = symbol.map(CURRENCIES).fillna(symbol).where(~np.isnan(amount)).astype('category')
+    estimated = uniques.str.contains('estimated', case=False, regex=False).to_numpy(dtype=bool, na_value=False)
+    amount = _take(amount, codes)
+    # the currencies stay codes into their categories
+    currency = pd.Categorical.from_codes(_take(currency.cat.codes.to_numpy(), codes, missing=-1), currency.cat.categories)
+    estimated = pd.array(_take(estimated, codes, missing=False), dtype='boolean')
+    estimated[np.isnan(amount)] = pd.NA
+    return pd.DataFrame({f'{s.name}_amount': amount, f'{s.name}_currency': currency, f'{s.name}_estimated': estimated}, index=s.index)
+
+
+def normalise_main(df, keep_raw=False):
+
+    '''
+    Types the columns of the main pages (scrape_view): the counts and the metascore as floats, and each box office column
+    as amount, currency and estimate flag (see parse_money).
+
+    Params:
+    -------
+    df: DataFrame.
+      The main rows, e.g., read from the main files or the 'main' dataset of the store.
+
+    keep_raw: bool.
+      Whether to keep the text columns of the box office next to the parsed ones.
+
+    Returns:
+    --------
+    df: DataFrame.
+      A copy with the typed columns.
+    '''
+
+    df = df.copy()
+    for c in COUNT_COLUMNS:
+        if c in df.columns:
+            df[c] = parse_counts(df[c])
+    for c in SCORE_COLUMNS:
+        if c in df.columns:
+            df[c] = pd.to_numeric(df[c], errors='coerce').astype('float64')
+    for c in MONEY_COLUMNS:
+        if c in df.columns:
+            money = parse_money(df[c])
+            position = df.columns.get_loc(c)
+            if not keep_raw:
+                df = df.drop(columns=c)
+                position -= 1
+            for i, m in enumerate(money.columns):
+                df.insert(position + 1 + i, m, money[m])
+    return df
+
+
+
+#################
+### Benchmark ###
+#################
+
+def _parse_row(row):
+    # the former way, one Python call per value
+    out = {c: parse_count(row[c]) for c in COUNT_COLUMNS}
+    for c in MONEY_COLUMNS:
+        match = re.match(MONEY_PATTERN, row[c]) if isinstance(row[c], str) else None
+        out[c + '_amount'] = float(match.group('amount').replace(',', '')) if match else None
+        out[c + '_currency'] = CURRENCIES.get(match.group('symbol'), match.group('symbol')) if match else None
+        out[c + '_estimated'] = ('estimated' in row[c]) if match else None
+    return out
+
+
+def sample_frame(rows, seed=0):
+
+    '''A frame of main rows with the value formats of the main pages, for the benchmark.'''
+
+    rng = np.random.default_rng(seed)
+    counts = np.array(['87', '1.2K', '3M', '12,345', '99+', '450K', None], dtype=object)
+    money = np.array(['$12,345,678 (estimated)', 'CA$1,000,000', '€5,000,000 (estimated)', '$10,123,456; Jul 21, 2023',
+                      '₹ 2,000,000,000 (estimated)', None], dtype=object)
+    data = {c: counts[rng.integers(0, len(counts), rows)] for c in COUNT_COLUMNS}
+    data.update({c: money[rng.integers(0, len(money), rows)] for c in MONEY_COLUMNS})
+    return pd.DataFrame(data)
+
+
+def benchmark(rows=2_000_000, row_sample=100_000):
+
+    '''
+    Times normalise_main on a frame of rows main rows against the per-row parsing (measured on row_sample rows and scaled).
+    Returns the seconds of both and the speedup.
+    '''
+
+    df = sample_frame(rows)
+    t1 = time.perf_counter()
+    normalise_main(df)
+    vectorised = time.perf_counter() - t1
+
+    sample = df.head(row_sample)
+    t1 = time.perf_counter()
+    pd.DataFrame([_parse_row(r) for r in sample.to_dict('records')])
+    per_row = (time.perf_counter() - t1) * rows / len(sample)
+
+    result = {'rows': rows, 'vectorised_s': round(vectorised, 2), 'per_row_s': round(per_row, 2), 'speedup': round(per_row / vectorised, 1)}
+    print(f'Parsing {rows} main rows: {result}', flush=True)
+    return result
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmarks the vectorised parsing of the main page numbers against per-row parsing.')
+    parser.add_argument('--rows', type=int, default=2_000_000)
+    parser.add_argument('--row-sample', type=int, default=100_000, help='rows parsed one by one (the time is scaled to --rows)')
+    args = parser.parse_args()
+    benchmark(args.rows, args.row_sample)
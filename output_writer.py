@@ -0,0 +1,193 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from manifest import store_artifact, flush_stores, record_artifacts
+
+
+
+WRITE_QUEUE_SIZE = 1000 # data frames waiting for the writer; a full queue makes the scrapers wait (back pressure)
+WRITE_BATCH = 200 # data frames written and recorded together at most
+FSYNC_EVERY = 5 # seconds between two fsyncs of the written files
+
+
+
+######################################################
+### Writer thread behind a bounded queue of outputs ###
+######################################################
+
+class OutputWriter:
+
+    '''
+    Writes the data frames of the scrapers in a dedicated thread, so a scraper thread only queues its output and
+    releases its browser without waiting for the disk. The writer takes the queued data frames by batches
+    (of many titles), writes them (see manifest.store_artifact, one bulk insert with the SQLite sink), records the whole batch in the manifest in one
+    transaction, and fsyncs the appended files every FSYNC_EVERY seconds instead of after each append
+    (the other CSV files are synced before their rename, see write_journal.atomic_to_csv).
+
+    Params:
+    -------
+    maxsize: int.
+      The size of the queue.
+
+    batch: int.
+      The maximum number of data frames per batch.
+
+    fsync_every: float.
+      Seconds between two fsyncs.
+    '''
+
+    def __init__(self, maxsize=WRITE_QUEUE_SIZE, batch=WRITE_BATCH, fsync_every=FSYNC_EVERY):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.batch = batch
+        self.fsync_every = fsync_every
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock() # the writer and close both fsync
+        self._unsynced = set() # files written since the last fsync
+        self._last_fsync = time.monotonic()
+        self._latencies = []
+        self.stats = {'written': 0, 'unchanged': 0, 'rows': 0, 'batches': 0, 'failed': 0, 'fsyncs': 0, 'max_queue': 0}
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+
+    def submit(self, df, path, tconst, artifact, append=False, negative=None, journal_id=None, digest=None):
+
+        '''Queues a data frame for the writer (see manifest.write_artifact for the arguments).'''
+
+        self.queue.put((time.monotonic(), (df, path, tconst, artifact, append, negative, journal_id, digest)))
+        depth = self.queue.qsize()
+        with self._lock:
+            self.stats['max_queue'] = max(self.stats['max_queue'], depth)
+
+
+    def _run(self):
+        while True:
+            try:
+                items = [self.queue.get(timeout=self.fsync_every)]
+            except queue.Empty:
+                self._fsync()
+                continue
+            while len(items) < self.batch:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write(items)
+            for _ in items:
+                self.queue.task_done()
+            if time.monotonic() - self._last_fsync >= self.fsync_every:
+                self._fsync()
+
+
+    def _write(self, items):
+        written, done = [], []
+        for submitted, (df, path, tconst, artifact, append, negative, journal_id, digest) in items:
+            try:
+                stored = store_artifact(df, path, tconst, artifact, append, journal_id, digest)
+            except Exception as e:
+                print(f'Cannot write {artifact} of {tconst}: {e}', flush=True)
+                with self._lock:
+                    self.stats['failed'] += 1
+                continue
+            written.append((tconst, artifact, stored, len(df), append, negative, journal_id, digest))
+            done.append(submitted)
+            if stored is None:
+                with self._lock:
+                    self.stats['unchanged'] += 1
+            if append and stored == path and os.path.isfile(stored):
+                # an appended CSV file (the Parquet store and the SQLite sink sync on their own)
+                with self._sync_lock:
+                    self._unsynced.add(stored)
+        try:
+            # one bulk insert for the batch with the SQLite sink, recorded in the manifest once stored
+            flush_stores()
+            record_artifacts(written)
+        except Exception as e:
+            print(f'Cannot store or record a batch of {len(written)} outputs: {e}', flush=True)
+        now = time.monotonic()
+        with self._lock:
+            self.stats['written'] += len(written)
+            self.stats['rows'] += sum(w[3] for w in written if w[2] is not None)
+            self.stats['batches'] += 1
+            self._latencies.extend(now - t for t in done)
+            del self._latencies[:-10000]
+
+
+    def _fsync(self):
+        with self._sync_lock:
+            paths, self._unsynced = self._unsynced, set()
+            self._last_fsync = time.monotonic()
+        for path in paths:
+            try:
+                # a file opened for writing, as Windows needs
+                with open(path, 'ab') as f:
+                    os.fsync(f.fileno())
+            except OSError:
+                pass
+        if paths:
+            with self._lock:
+                self.stats['fsyncs'] += 1
+
+
+    def flush(self):
+
+        '''Waits until the queued data frames are written and recorded.'''
+
+        self.queue.join()
+
+
+    def close(self):
+
+        '''Writes what is queued, fsyncs the files and writes the buffers of the Parquet store.'''
+
+        self.flush()
+        self._fsync()
+        import manifest
+        if manifest.OUTPUT_BACKEND == 'parquet':
+            from parquet_store import get_parquet_store
+            get_parquet_store().flush()
+
+
+    def summary(self):
+
+        '''Returns the data frames and rows written (unchanged ones not written again included), the batches, the failures, the fsyncs,
+        the current and maximum queue depth, and the write latency (seconds from submit to recorded: mean, p95, max).'''
+
+        with self._lock:
+            s = dict(self.stats, queue=self.queue.qsize())
+            latencies = sorted(self._latencies)
+        if latencies:
+            s['latency_s'] = {'mean': round(sum(latencies) / len(latencies), 3),
+                              'p95': round(latencies[int(0.95 * (len(latencies) - 1))], 3),
+                              'max': round(latencies[-1], 3)}
+        return s
+
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_output_writer():
+
+    '''Returns the writer of the process, which writes what is still queued when the process exits.'''
+
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = OutputWriter()
+            atexit.register(_writer.close)
+    return _writer
+
+
+def flush_outputs():
+
+    '''Writes everything still queued or buffered, e.g., at the end of a worker process of multiprocessing, where the exit handlers do not run.'''
+
+    import manifest
+    if _writer is not None:
+        _writer.close()
+    elif manifest.OUTPUT_BACKEND == 'parquet':
+        from parquet_store import get_parquet_store
+        get_parquet_store().flush()
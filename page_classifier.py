@@ -0,0 +1,175 @@
+import threading
+import time
+from selenium.common.exceptions import TimeoutException, WebDriverException
+
+
+
+# Statuses returned by the classifier
+OK = 'ok'
+SERVER_ERROR = '503'
+NOT_FOUND = '404'
+TIMEOUT = 'timeout'
+EMPTY = 'empty-section'
+CONSENT = 'consent-banner' # the page is fine but the cookie banner is still shown
+ERROR = 'error' # webdriver or unexpected error while classifying
+
+# The text shown when a title has no info for the page
+EMPTY_TEXTS = {'main': None,
+               'awards': "It looks like we don't have any awards for this title yet.",
+               'releaseinfo': "It looks like we don't have any release date for this title yet.",
+               'companycredits': "It looks like we don't have any company credits for this title yet."}
+
+# The attributes of the h1 tag of a normal page (data-testid for the main page and class for others)
+H1_ID_STRINGS = ['hero__pageTitle', 'ipc-title__text']
+
+
+# Seconds between two evaluations while the h1 tag is not there yet
+CLASSIFY_POLL = 0.1
+
+
+# The whole check runs in the browser and only the result goes back over the wire.
+# It compares the text and attributes of the h1 tag, searches the empty-section text in the page
+# and checks whether the cookie banner is there. It returns null while there is no h1 tag, and classify_page polls it
+# (like the former WebDriverWait): each evaluation is short, so a tab of a TabBrowser does not hold the lock of the browser while it waits.
+CLASSIFY_SCRIPT = '''
+var emptyText = arguments[0];
+var idStrings = arguments[1];
+
+var h1 = document.querySelector('h1');
+if (h1 === null) { return null; }
+var banner = document.querySelector("button[data-testid='reject-button']") !== null;
+var text = h1.textContent.trim();
+var l10n = h1.getAttribute('data-l10n-id');
+var known = idStrings.indexOf(h1.getAttribute('data-testid')) >= 0 ||
+    idStrings.some(function (s) { return h1.classList.contains(s); });
+
+var status = 'ok';
+if (l10n !== null || text === 'The connection has timed out') {
+    status = 'timeout'; // the error page of the browser
+} else if (text.indexOf('404 Error') >= 0) {
+    status = '404'; // the 404 page of IMDB may have the h1 of a normal page
+} else if (!known && text === 'Error') {
+    status = '503';
+} else if (!known && text.indexOf('Error') >= 0) {
+    status = '404';
+} else if (emptyText && document.body.textContent.indexOf(emptyText) >= 0) {
+    status = 'empty-section';
+} else if (banner) {
+    status = 'consent-banner';
+}
+return {status: status, h1: text};
+'''
+
+
+
+####################################################
+### Timing of the classification by page type   ###
+####################################################
+
+class ClassifierStats:
+
+    '''Keeps the number of classifications, the total and the maximum time spent and the count of each status by page type.'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats = {}
+
+    def record(self, page_type, status, seconds):
+        with self._lock:
+            s = self.stats.setdefault(page_type, {'count': 0, 'total_s': 0.0, 'max_s': 0.0, 'status': {}})
+            s['count'] += 1
+            s['total_s'] += seconds
+            s['max_s'] = max(s['max_s'], seconds)
+            s['status'][status] = s['status'].get(status, 0) + 1
+
+    def summary(self):
+
+        '''Returns a dict by page type with the count, mean and max seconds and the statuses.'''
+
+        with self._lock:
+            return {page_type: {'count': s['count'],
+                                'mean_s': round(s['total_s'] / s['count'], 4),
+                                'max_s': round(s['max_s'], 4),
+                                'status': dict(s['status'])}
+                    for page_type, s in self.stats.items()}
+
+classifier_stats = ClassifierStats()
+
+
+
+#####################################
+### Function to classify the page ###
+#####################################
+
+def classify_page(driver, page_type, timeout=50):
+
+    '''
+    Classifies the loaded page with one evaluation in the browser (repeated until the h1 tag is there),
+    instead of probing the h1 tag attribute by attribute and searching the whole page source.
+
+    Params:
+    -------
+    driver: WebDriver.
+      The driver on the page.
+
+    page_type: str.
+      'main', 'awards', 'releaseinfo' or 'companycredits', which decides the empty-section text.
+
+    timeout: int.
+      Seconds to wait for the h1 tag to be present.
+
+    Returns:
+    --------
+    status: str.
+      One of OK, SERVER_ERROR, NOT_FOUND, TIMEOUT, EMPTY, CONSENT and ERROR.
+    '''
+
+    t1 = time.perf_counter()
+    end = time.monotonic() + timeout
+    try:
+        while True:
+            result = driver.execute_script(CLASSIFY_SCRIPT, EMPTY_TEXTS.get(page_type), H1_ID_STRINGS)
+            if result is not None:
+                status = result['status']
+                break
+            if time.monotonic() >= end:
+                status = TIMEOUT
+                break
+            time.sleep(CLASSIFY_POLL)
+    except TimeoutException:
+        status = TIMEOUT
+    except WebDriverException as e:
+        print({e}, flush=True)
+        status = ERROR
+    except Exception as e:
+        print(f"\nAn unexpected error occurred: {e}", flush=True)
+        status = ERROR
+
+    classifier_stats.record(page_type, status, time.perf_counter() - t1)
+    return status
+
+
+
+def check_page_for_error(driver, page_type):
+
+    '''
+    Drop-in replacement of check_h1_for_error based on the classifier.
+
+    Returns:
+    --------
+    normal_error: bool.
+      True for a 503 error or a webdriver error, the page should be refreshed after a short pause.
+
+    connection_error: bool.
+      True when the page cannot be loaded, the page should be refreshed after a long pause.
+
+    status: str.
+      The status from classify_page, to be reused instead of checking the page again.
+    '''
+
+    status = classify_page(driver, page_type)
+    if status in [SERVER_ERROR, ERROR]:
+        print(f"Error '{status}' was found.", flush=True)
+    elif status == TIMEOUT:
+        print('Cannot load the page', flush=True)
+    return status in [SERVER_ERROR, ERROR], status == TIMEOUT, status
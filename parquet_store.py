@@ -0,0 +1,198 @@
+import atexit
+import os
+import threading
+import time
+import uuid
+from datetime import date
+import pandas as pd
+from write_journal import get_write_journal
+# !pip install pyarrow
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+
+
+STORE_ROOT = 'Store'
+FLUSH_ROWS = 5000 # rows buffered by dataset before a Parquet file is written
+FLUSH_SECONDS = 300 # a buffer older than this is written at the next append or by the flush thread
+
+# Dataset of each artifact of the manifest
+DATASETS = {'gen': 'awards_gen', 'award': 'awards_detail', 'release': 'release', 'distribution': 'distribution',
+            'pro': 'production', 'main': 'main', 'justwatch_new': 'justwatch_new'}
+
+
+
+#########################################################
+### Partitioned Parquet datasets with buffered writers ###
+#########################################################
+
+class ParquetStore:
+
+    '''
+    Appends the scraped rows to one Parquet dataset by artifact type (DATASETS), partitioned by fetch date
+    (Store/<dataset>/fetch_date=YYYY-MM-DD/part-<id>.parquet), instead of one CSV file per title, type and day.
+    The rows are buffered by dataset and date, and written as one file every FLUSH_ROWS rows or FLUSH_SECONDS.
+    The tconst is added as a column. All columns are stored as strings, since the placeholder rows
+    ('404', 'NoInfo') share the columns with the numbers. A file is written under a temp name and renamed, and the
+    entries of its rows in the write journal are completed only then (the buffered rows are lost by a crash).
+
+    Params:
+    -------
+    root: str.
+      The folder of the datasets.
+
+    flush_rows: int.
+      The number of buffered rows of a dataset that triggers a write.
+
+    flush_seconds: float.
+      The age of a buffer that triggers a write.
+    '''
+
+    def __init__(self, root=STORE_ROOT, flush_rows=FLUSH_ROWS, flush_seconds=FLUSH_SECONDS):
+        if pa is None:
+            raise ImportError('The Parquet store needs pyarrow: pip install pyarrow')
+        self.root = root
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._buffers = {} # (dataset, fetch date): [list of data frames, number of rows, time of the first append, journal ids]
+        self._stop = threading.Event()
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+
+
+    def append(self, artifact, df, tconst=None, journal_id=None):
+
+        '''Buffers the rows of the artifact (e.g., 'gen', 'release', 'main') with their tconst, and writes the buffer when it is full.'''
+
+        df = df.copy()
+        if 'tconst' not in df.columns:
+            df.insert(0, 'tconst', tconst)
+        key = (DATASETS.get(artifact, artifact), str(date.today()))
+        with self._lock:
+            buffer = self._buffers.setdefault(key, [[], 0, time.monotonic(), []])
+            buffer[0].append(df)
+            buffer[1] += len(df)
+            buffer[3].append(journal_id)
+            full = buffer[1] >= self.flush_rows
+            if full:
+                buffer = self._buffers.pop(key)
+        if full:
+            self._write(key, buffer[0], buffer[3])
+
+
+    def _write(self, key, frames, journal_ids):
+        dataset, fetch_date = key
+        df = pd.concat(frames, ignore_index=True)
+        # strings for every column, keeping the missing values
+        df = df.astype(object).where(df.notna(), None).astype('string')
+        directory = os.path.join(self.root, dataset, 'fetch_date=' + fetch_date)
+        os.makedirs(directory, exist_ok=True)
+        name = f'part-{uuid.uuid4().hex}.parquet'
+        # the readers skip the files starting with a dot
+        tmp = os.path.join(directory, '.' + name + '.tmp')
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp)
+        with open(tmp, 'rb+') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(directory, name))
+        get_write_journal().complete(journal_ids)
+
+
+    def flush(self, older_than=None):
+
+        '''Writes the buffers (only those older than older_than seconds if given).'''
+
+        now = time.monotonic()
+        with self._lock:
+            keys = [k for k, b in self._buffers.items() if older_than is None or now - b[2] >= older_than]
+            ready = [(k, self._buffers.pop(k)) for k in keys]
+        for key, buffer in ready:
+            self._write(key, buffer[0], buffer[3])
+
+
+    def _flush_loop(self):
+        while not self._stop.wait(min(self.flush_seconds, 30)):
+            self.flush(older_than=self.flush_seconds)
+
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_parquet_store():
+
+    '''Returns the Parquet store of the process. Its buffers are written when the process exits.'''
+
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ParquetStore()
+            atexit.register(_store.close)
+    return _store
+
+
+
+######################################
+### Reader: one DataFrame by type ###
+######################################
+
+def read_dataset(dataset, root=STORE_ROOT, start=None, end=None, tconsts=None, columns=None):
+
+    '''
+    Reads a dataset of the store into one DataFrame, e.g., read_dataset('release', start='2024-05-01').
+
+    Params:
+    -------
+    dataset: str.
+      One of the DATASETS values (e.g., 'awards_gen', 'production') or an artifact name (e.g., 'gen', 'pro').
+
+    root: str.
+      The folder of the datasets.
+
+    start, end: str or None.
+      The first and last fetch dates (YYYY-MM-DD) to read, all by default.
+
+    tconsts: list or None.
+      The titles to read, all by default.
+
+    columns: list or None.
+      The columns to read, all by default.
+
+    Returns:
+    --------
+    df: DataFrame.
+      The rows with the columns tconst and fetch_date. Empty if the dataset has no file.
+    '''
+
+    if pa is None:
+        raise ImportError('The Parquet store needs pyarrow: pip install pyarrow')
+    path = os.path.join(root, DATASETS.get(dataset, dataset))
+    if not os.path.isdir(path):
+        return pd.DataFrame()
+    filters = []
+    if start is not None:
+        filters.append(('fetch_date', '>=', str(start)))
+    if end is not None:
+        filters.append(('fetch_date', '<=', str(end)))
+    if tconsts is not None:
+        filters.append(('tconst', 'in', list(tconsts)))
+    df = pq.read_table(path, columns=columns, filters=filters or None, partitioning='hive').to_pandas()
+    if 'fetch_date' in df.columns:
+        # the partition column is read as a category
+        df['fetch_date'] = df['fetch_date'].astype(str)
+    return df
+
+
+def read_all(root=STORE_ROOT, **kwargs):
+
+    '''Returns a dict with one DataFrame by dataset of the store (see read_dataset for the arguments).'''
+
+    return {dataset: read_dataset(dataset, root, **kwargs) for dataset in sorted(set(DATASETS.values()))
+            if os.path.isdir(os.path.join(root, dataset))}
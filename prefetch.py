@@ -0,0 +1,147 @@
+import queue
+import threading
+import time
+from tab_mux import TabBrowser
+
+
+
+##################################################################
+### Pipeline that loads the next pages while one is being parsed ###
+##################################################################
+
+class PrefetchPipeline:
+
+    '''
+    Overlaps the navigation and the extraction of the pages: while the workers parse and save the loaded pages,
+    the next items are already loading in other tabs of the same browser (see tab_mux).
+    The scraping function does not need to change, since the get of a prefetched url on a tab only waits for it.
+
+    Params:
+    -------
+    depth: int.
+      The number of pages loading ahead of the workers.
+
+    workers: int.
+      The number of pages parsed at the same time.
+
+    Usage:
+    ------
+    with PrefetchPipeline(depth=2) as pipeline:
+        results = pipeline.map(scrape_view, tconsts, title_url)
+    '''
+
+    def __init__(self, depth=2, workers=1):
+        self.depth = depth
+        self.workers = workers
+        # one tab per page loading ahead and one per page being parsed
+        self.browser = TabBrowser(depth + workers)
+        self._lock = threading.Lock()
+        self.stats = {'pages': 0, 'navigation_s': 0.0, 'extraction_s': 0.0, 'wall_s': 0.0}
+
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    def _prefetch(self, items, url_func, loaded):
+        for i, item in enumerate(items):
+            tab = self.browser.acquire()
+            try:
+                tab.start_navigation(url_func(item))
+            except Exception as e:
+                # the worker will load the page itself
+                print(f'Cannot prefetch {item}: {e}', flush=True)
+                tab.pending_url = None
+            # blocks when 'depth' pages are already waiting for a worker
+            loaded.put((i, item, tab))
+        for _ in range(self.workers):
+            loaded.put(None)
+
+
+    def _work(self, func, loaded, results):
+        while True:
+            task = loaded.get()
+            if task is None:
+                return
+            i, item, tab = task
+            t1 = time.monotonic()
+            try:
+                results[i] = func(item, driver=tab, identity=self.browser.identity)
+            except Exception as e:
+                print(f'Error while scraping {item}: {e}', flush=True)
+                results[i] = None
+            finally:
+                t2 = time.monotonic()
+                with self._lock:
+                    self.stats['pages'] += 1
+                    if tab.nav_started is not None and tab.ready_at is not None:
+                        self.stats['navigation_s'] += tab.ready_at - tab.nav_started
+                        # extraction starts when both the page and the worker are ready
+                        self.stats['extraction_s'] += t2 - max(tab.ready_at, t1)
+                    else:
+                        self.stats['extraction_s'] += t2 - t1
+                self.browser.release(tab)
+
+
+    def map(self, func, items, url_func):
+
+        '''
+        Runs func(item, driver=tab, identity=identity) on every item, with the page url_func(item) loaded ahead.
+
+        Params:
+        -------
+        func: function.
+          The scraping function, e.g., scrape_view or save_title_files.
+
+        items: list.
+          The items, e.g., tconsts.
+
+        url_func: function.
+          Returns the url of the first page func loads for an item, e.g., title_url.
+
+        Returns:
+        --------
+        results: list.
+          The results of func in the order of the items (None when it failed).
+        '''
+
+        items = list(items)
+        results = [None] * len(items)
+        loaded = queue.Queue(maxsize=self.depth)
+        t1 = time.monotonic()
+
+        producer = threading.Thread(target=self._prefetch, args=(items, url_func, loaded), daemon=True)
+        producer.start()
+        workers = [threading.Thread(target=self._work, args=(func, loaded, results), daemon=True) for _ in range(self.workers)]
+        for w in workers:
+            w.start()
+        producer.join()
+        for w in workers:
+            w.join()
+
+        with self._lock:
+            self.stats['wall_s'] += time.monotonic() - t1
+        return results
+
+
+    def summary(self):
+
+        '''
+        Returns the seconds spent loading and extracting the pages, the wall time,
+        and the overlap, i.e., the share of the loading and extraction time that did not add to the wall time.
+        '''
+
+        with self._lock:
+            s = dict(self.stats)
+        busy = s['navigation_s'] + s['extraction_s']
+        s['overlap'] = round(max(0.0, 1 - s['wall_s'] / busy), 3) if busy else 0.0
+        for key in ['navigation_s', 'extraction_s', 'wall_s']:
+            s[key] = round(s[key], 2)
+        return s
+
+
+    def close(self):
+        self.browser.close()
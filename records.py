@@ -0,0 +1,196 @@
+import argparse
+import tracemalloc
+import pandas as pd
+
+
+
+##########################################
+### Slotted record types of the rows ###
+##########################################
+
+class Record:
+
+    '''
+    Base of the row types: one object with slots per row instead of one list per field, so the fields of a row
+    cannot get out of line. The fields left out are None. FIELDS are the attributes, COLUMNS the names in the output files.
+    '''
+
+    __slots__ = ()
+    FIELDS = ()
+    COLUMNS = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if 'COLUMNS' not in cls.__dict__:
+            cls.COLUMNS = cls.FIELDS
+
+
+    def __init__(self, *values, **fields):
+        if len(values) > len(self.FIELDS):
+            raise TypeError(f'{type(self).__name__} takes at most {len(self.FIELDS)} values')
+        for name, value in zip(self.FIELDS, values + (None,) * (len(self.FIELDS) - len(values))):
+            setattr(self, name, value)
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+
+    def values(self):
+        return tuple(getattr(self, name) for name in self.FIELDS)
+
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.values() == other.values()
+
+
+    def __repr__(self):
+        return f'{type(self).__name__}({", ".join(f"{n}={v!r}" for n, v in zip(self.FIELDS, self.values()))})'
+
+
+    @classmethod
+    def empty(cls):
+
+        '''The placeholder row of a page without the section: None, with 'NoInfo' in the last field.'''
+
+        return cls(*[None] * (len(cls.FIELDS) - 1), 'NoInfo')
+
+
+    @classmethod
+    def not_found(cls):
+
+        '''The placeholder row of a page that could not be loaded: '404' in every field.'''
+
+        return cls(*['404'] * len(cls.FIELDS))
+
+
+    @classmethod
+    def from_columns(cls, *columns):
+
+        '''
+        Builds the rows from the lists filled by the scraping helpers, one list per field in the order of FIELDS.
+        A list shorter than the others (a helper that appended nothing) is completed with None.
+        '''
+
+        n = max((len(c) for c in columns), default=0)
+        if any(len(c) != n for c in columns):
+            print(f'{cls.__name__}: fields of unequal lengths {[len(c) for c in columns]}, completed with None', flush=True)
+            columns = [list(c) + [None] * (n - len(c)) for c in columns]
+        return [cls(*values) for values in zip(*columns)]
+
+
+    @classmethod
+    def to_columns(cls, rows):
+
+        '''The rows as a dict of columns (tuples), in one transposition.'''
+
+        columns = list(zip(*(r.values() for r in rows))) or [()] * len(cls.FIELDS)
+        return dict(zip(cls.COLUMNS, columns))
+
+
+    @classmethod
+    def to_frame(cls, rows):
+
+        '''The rows as a DataFrame with the columns of the output files.'''
+
+        return pd.DataFrame.from_records([r.values() for r in rows], columns=list(cls.COLUMNS))
+
+
+    @classmethod
+    def to_arrow(cls, rows):
+
+        '''The rows as an Arrow table of strings, like the datasets of parquet_store (needs pyarrow).'''
+
+        # imported here since pyarrow is optional
+        import pyarrow as pa
+        return pa.table({name: pa.array([None if v is None else str(v) for v in column], type=pa.string())
+                         for name, column in cls.to_columns(rows).items()})
+
+
+
+class MainRow(Record):
+
+    '''The main page of a title (see scrape_view).'''
+
+    __slots__ = FIELDS = ('tconst', 'theater', 'price', 'season', 'streaming_provider', 'rent_provider', 'num_watchlist', 'num_review',
+                          'num_critic', 'metascore', 'num_photo', 'num_video', 'origin', 'language', 'filming_loc', 'budget',
+                          'open_boxoffice_america', 'gross_boxoffice_america', 'gross_boxoffice_world', 'color', 'soundmix', 'star', 'air_date')
+
+    @classmethod
+    def from_lists(cls, lists):
+
+        '''Builds the row from the lists of the fields of one title ({field: [value]}), None for an empty list.'''
+
+        return cls(**{name: values[0] if values else None for name, values in lists.items()})
+
+
+    @classmethod
+    def not_found(cls, tconst=None):
+
+        '''The placeholder row of a main page that could not be loaded (a 404): the tconst and '404' in the other fields.'''
+
+        return cls(tconst, *['404'] * (len(cls.FIELDS) - 1))
+
+
+    def is_not_found(self):
+        return self.values()[1:] == ('404',) * (len(self.FIELDS) - 1)
+
+
+class AwardEvent(Record):
+
+    '''An award of a title, with the number of its categories (the gen file).'''
+
+    __slots__ = FIELDS = ('award_name', 'award_id', 'num_category')
+
+
+class Nomination(Record):
+
+    '''A nomination or win of a person in a category (the award detail file).'''
+
+    __slots__ = FIELDS = ('award', 'nomination', 'category', 'person', 'person_id', 'note', 'note_id')
+
+
+class ReleaseRow(Record):
+
+    '''A release of a title: the country, the release id, the date and the location (e.g., a festival).'''
+
+    __slots__ = FIELDS = ('country', 'rel_id', 'date', 'location')
+
+
+class CreditRow(Record):
+
+    '''A company credited for a title: the firm, its id, the country and year, and the note (e.g., the kind of distribution).'''
+
+    __slots__ = FIELDS = ('firm', 'firm_id', 'country_yr', 'note')
+    COLUMNS = ('firm', 'firm_id', 'country, yr', 'note')
+
+
+
+#######################################
+### Memory of the rows of 1000 titles ###
+#######################################
+
+def memory_per_titles(titles=1000):
+
+    '''Returns the bytes allocated to keep the main rows of the titles: as dicts of lists (what scrape_view returned) and as MainRow objects.'''
+
+    # the same value strings for both, only the containers are measured
+    values = [[f'{name}{i}' for name in MainRow.FIELDS] for i in range(titles)]
+
+    def measure(build):
+        tracemalloc.start()
+        rows = [build(v) for v in values]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return size
+
+    return {'dict_of_lists': measure(lambda v: {name: [x] for name, x in zip(MainRow.FIELDS, v)}),
+            'main_row': measure(lambda v: MainRow(*v))}
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Memory of the main rows as dicts of lists and as slotted records.')
+    parser.add_argument('--titles', type=int, default=1000)
+    args = parser.parse_args()
+    memory = memory_per_titles(args.titles)
+    print(f'Main rows of {args.titles} titles: {memory}, {round(memory["dict_of_lists"] / memory["main_row"], 1)}x less with MainRow')
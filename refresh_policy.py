@@ -0,0 +1,178 @@
+import heapq
+import os
+from datetime import date, timedelta
+import pandas as pd
+from manifest import get_manifest
+
+
+
+# Days before an artifact is fetched again, by the age of the title: 'new' (released this year or last year),
+# 'recent' (in the last 5 years) and 'old'. The main page holds the streaming options, which change daily,
+# while the release info of an old film hardly ever changes.
+TTL_DAYS = {
+    'main':         {'new': 1,  'recent': 7,  'old': 14},
+    'gen':          {'new': 7,  'recent': 30, 'old': 180},
+    'award':        {'new': 7,  'recent': 30, 'old': 180},
+    'release':      {'new': 7,  'recent': 60, 'old': 365},
+    'pro':          {'new': 14, 'recent': 90, 'old': 365},
+    'distribution': {'new': 14, 'recent': 90, 'old': 365},
+    'justwatch':    {'new': 2,  'recent': 2,  'old': 2},
+    'justwatch_new': {'new': 2, 'recent': 2,  'old': 2},
+}
+DEFAULT_BUCKET = 'recent' # for titles without a known year, e.g., the batch files
+DEFAULT_TTL_DAYS = 14 # for the artifacts not in TTL_DAYS
+
+# How much a refresh of each artifact is worth compared with the others
+ARTIFACT_VALUE = {'main': 3, 'gen': 1, 'award': 2, 'release': 1, 'pro': 1, 'distribution': 1}
+
+# Popular titles (at least POPULAR_VOTES votes in title.ratings.tsv.gz) are refreshed twice as often and first
+RATINGS_FILE = 'title.ratings.tsv.gz'
+POPULAR_VOTES = 10000
+POPULAR_TTL_FACTOR = 0.5
+POPULAR_VALUE_FACTOR = 2
+
+NEVER_FETCHED = float('inf') # staleness of a title without any file, which comes first
+
+
+
+#####################################################
+### TTL by artifact and title, and refresh order ###
+#####################################################
+
+class RefreshPolicy:
+
+    '''
+    Decides when an artifact of a title is stale: its TTL depends on the artifact (TTL_DAYS), the age of the title
+    (the bucket from its release year) and its popularity (number of votes). The scheduler orders the titles
+    by priority, i.e., the age of their files relative to the TTL times the value of the artifact,
+    so the crawl capacity goes to the stalest and most valuable artifacts first.
+
+    Params:
+    -------
+    ttl_days: dict.
+      The TTL in days by artifact and bucket.
+
+    value: dict.
+      The value of each artifact.
+
+    popular_votes: int.
+      The number of votes above which a title is popular.
+    '''
+
+    def __init__(self, ttl_days=TTL_DAYS, value=ARTIFACT_VALUE, popular_votes=POPULAR_VOTES):
+        self.ttl_days = ttl_days
+        self.value = value
+        self.popular_votes = popular_votes
+        self.years = {} # tconst: release year
+        self.votes = {} # tconst: number of votes
+
+
+    def add_titles(self, tconsts, years):
+
+        '''Registers the release year of the titles, e.g., the columns tconst and title_yr of imdb_merged.csv.'''
+
+        for t, yr in zip(tconsts, years):
+            if pd.notna(yr):
+                self.years[t] = int(yr)
+
+
+    def load_votes(self, path=RATINGS_FILE):
+
+        '''Registers the number of votes of the titles from title.ratings.tsv.gz of the IMDB datasets, if the file exists.'''
+
+        if not os.path.exists(path):
+            return
+        df = pd.read_csv(path, sep='\t', usecols=['tconst', 'numVotes'])
+        self.votes.update(zip(df['tconst'], df['numVotes']))
+
+
+    def bucket(self, tconst):
+        yr = self.years.get(tconst)
+        if yr is None:
+            return DEFAULT_BUCKET
+        this_year = date.today().year
+        if yr >= this_year - 1:
+            return 'new'
+        if yr >= this_year - 5:
+            return 'recent'
+        return 'old'
+
+
+    def is_popular(self, tconst):
+        return self.votes.get(tconst, 0) >= self.popular_votes
+
+
+    def ttl(self, artifact, tconst=None):
+
+        '''Returns the TTL (timedelta) of the artifact of the title.'''
+
+        days = self.ttl_days.get(artifact, {}).get(self.bucket(tconst), DEFAULT_TTL_DAYS)
+        if tconst is not None and self.is_popular(tconst):
+            days *= POPULAR_TTL_FACTOR
+        return timedelta(days=days)
+
+
+    def is_fresh(self, tconst, artifact):
+
+        '''Whether the manifest has a file of the artifact of the title within its TTL.'''
+
+        return get_manifest().has_recent(tconst, artifact, self.ttl(artifact, tconst))
+
+
+    def priority(self, tconst, artifact, fetch_date, today=None):
+
+        '''The age of the file relative to its TTL (1 = just stale), times the value of the artifact.'''
+
+        today = today or date.today()
+        staleness = (today - fetch_date) / self.ttl(artifact, tconst) if fetch_date is not None else NEVER_FETCHED
+        value = self.value.get(artifact, 1)
+        if self.is_popular(tconst):
+            value *= POPULAR_VALUE_FACTOR
+        return staleness * value
+
+
+    def schedule(self, tconsts, artifacts=('main', 'gen', 'release', 'pro'), limit=None, with_priority=False):
+
+        '''
+        Returns the titles with at least one stale artifact, the highest priority first (as (tconst, priority) pairs with with_priority).
+        An artifact never fetched for a title that has other files (e.g., the sub pages of a title without streaming option)
+        does not make it stale, while a title without any file comes first.
+
+        Params:
+        -------
+        tconsts: iterable.
+          The candidate titles.
+
+        artifacts: tuple.
+          The artifacts to consider.
+
+        limit: int or None.
+          The maximum number of titles, e.g., what the crawl can do in one run.
+
+        with_priority: bool.
+          Whether to return the priority of each title, e.g., for the work queue.
+        '''
+
+        latest = get_manifest().latest_dates(artifacts)
+        today = date.today()
+        scored = []
+        for t in dict.fromkeys(tconsts):
+            dates = {a: latest.get((t, a)) for a in artifacts}
+            if not any(dates.values()):
+                scored.append((NEVER_FETCHED, t))
+                continue
+            stale = [self.priority(t, a, d, today) for a, d in dates.items() if d is not None and today - d > self.ttl(a, t)]
+            if stale:
+                scored.append((max(stale), t))
+
+        if limit is not None:
+            scored = heapq.nlargest(limit, scored)
+        else:
+            scored.sort(reverse=True)
+        if with_priority:
+            return [(t, p) for p, t in scored]
+        return [t for _, t in scored]
+
+
+
+refresh_policy = RefreshPolicy()
@@ -5,6 +5,7 @@ import re
 from datetime import date, datetime, timedelta
 import os
 import time
+import threading
 # !pip install selenium
 import selenium
 from selenium import webdriver
@@ -15,83 +16,82 @@ from selenium.webdriver.firefox.options import Options
 from selenium.webdriver.common.proxy import Proxy, ProxyType
 from selenium.common.exceptions import NoSuchElementException, TimeoutException, StaleElementReferenceException, WebDriverException
 from selenium.webdriver.firefox.service import Service
-# !pip install random_user_agent 
-from random_user_agent.user_agent import UserAgent
-from random_user_agent.params import SoftwareName, OperatingSystem
+from identity import decline_preferences
+from browser_profile import page_metrics
+from driver_factory import get_driver_factory, release_driver
+from memory_governor import get_memory_governor
+from tab_mux import TabBrowser
+from prefetch import PrefetchPipeline
+from hedging import hedged_get, hedging_summary
+from title_pipeline import Stage, Pipeline
+from work_queue import WorkQueue, tracked
+from seen_set import new_seen_set, drop_seen
+from manifest import write_artifact, batch_key
+from refresh_policy import refresh_policy
+from negative_cache import get_negative_cache
+from output_writer import get_output_writer
+from write_journal import get_write_journal
+from metrics_store import get_metrics_store
+from records import MainRow, AwardEvent, Nomination, ReleaseRow, CreditRow
+from page_classifier import check_page_for_error, classifier_stats, NOT_FOUND, EMPTY, ERROR
+
+
+
+# Number of tabs driven concurrently in one browser, 0 for one browser per thread (each costs several hundred MB)
+TABS_PER_BROWSER = 0
+
+# Number of pages loading in other tabs while the current one is parsed and saved, 0 to turn off the prefetching
+PREFETCH_DEPTH = 0
+PREFETCH_WORKERS = 2
+
+# Whether to fetch a page again on a spare driver when it is slower than the p95 (only for drivers owned by the scraper)
+HEDGE_REQUESTS = True
+
+# Whether __main__ streams the titles through the stages instead of waiting for batches of 20 titles
+STREAMING_PIPELINE = True
+# Workers and queue size of each stage of the streaming pipeline, and seconds between two reports
+STAGE_WORKERS = {'main': 4, 'gate': 1, 'subpages': 3, 'awards': 2, 'details': 2}
+STAGE_QUEUE_SIZE = 20
+PIPELINE_REPORT_EVERY = 60
+# Whether the streaming pipeline records the status of each title in a SQLite work queue to resume after a crash
+USE_WORK_QUEUE = True
+# Artifacts written by each stage: a done task goes back to pending on the next run when one of them is stale (see refresh_policy)
+STAGE_ARTIFACTS = {'main': ['main'], 'subpages': ['gen', 'release', 'pro'], 'awards': ['gen'], 'details': ['release', 'pro']}
+# Added to the name of the main file of the streaming pipeline, e.g., by the workers of crawl_shards ('_worker0')
+MAIN_STREAM_SUFFIX = ''
+
+# Whether to scrape the awards, release info and company credits of a title in one driver session (False for one browser per page)
+SAME_SESSION_SUBPAGES = True
+
+# Titles already processed in this run are dropped before their files are checked (the parent series come back in many chunks).
+# 0 for an exact set, otherwise the expected number of titles for a Bloom filter with the given false positive rate
+SEEN_SET_CAPACITY = 0
+SEEN_SET_FP_RATE = 0.001
+seen_titles = new_seen_set(SEEN_SET_CAPACITY, SEEN_SET_FP_RATE)
+
+# Whether the streaming pipeline takes the stale titles by priority (see refresh_policy) instead of the order of imdb_merged.csv,
+# and the maximum number of titles per run (0 for all stale titles). With a work queue, the limit applies to the main tasks claimed,
+# pending ones left by a former run included
+SCHEDULE_BY_PRIORITY = True
+REFRESH_LIMIT = 0
+
+# Whether the watchlist, review, photo and video counts, the metascore and the providers of the main pages are also recorded
+# as time series in metrics_store (only their changes are stored)
+RECORD_METRICS = True
+
+
+
+### Function to build the url of a page of a title ###
+def title_url(tconst, page=None):
+
+    '''Returns the url of the main page of the title, or of its sub page (e.g., 'awards', 'releaseinfo') if given.'''
+
+    if page is None:
+        return 'https://www.imdb.com/title/' + tconst + '/'
+    return 'https://www.imdb.com/title/' + tconst + '/' + page + '/'
 
 
 
-###########################################################
-### Functions to check for error and get proxies ready ###
-###########################################################
-
-### Function to capture webpage errors ###
-def check_h1_for_error(driver, substring, id_strings):
-
-    '''Checks whether the page contains the error message, or has some attributes indicating the server/page was not found.
-    
-    Params:
-    -------
-    driver: WebDriver.
-      The selenium driver used to locate the tag 'h1'. 
-      
-    substring: str.
-      The string that indicates there is an error on the page, by checking the text under 'h1'.
-      
-    id_strings: str or list.
-      The attribute(s) of a tag indicating the server or the page was not found.
-      For the main page, the 'data-testid' should exist and for other pages, 'class' should exist under 'h1' tag.
-      
-    Returns:
-    ---------
-      True if there is an error, False if not. '''
-    
-    normal_error = False
-    connection_error= False
-
-    try: 
-        # Locate the h1 tag (can be located without clicking the preference setting button)
-        h1_element = WebDriverWait(driver, 50).until(EC.presence_of_element_located((By.TAG_NAME, 'h1')))
-        # driver.find_element(By.TAG_NAME, 'h1')
-        h1_text = h1_element.text
-        if h1_element.get_attribute('data-testid') in id_strings or h1_element.get_attribute('class') in id_strings and h1_element.get_attribute('data-l10n-id') is None: # 'hero__pageTitle':
-            return normal_error, connection_error
-        # Check if the h1 text contains the specified substring
-        # Some title contains 'error'
-        if substring == h1_text: # 503 error
-            print(f"'{substring}' was found.", flush=True)
-            normal_error = True
-            return normal_error, connection_error
-        if h1_text == 'The connection has timed out': # substring != h1_text and h1_element.get_attribute('data-l10n-id') is not None: # connection error
-            print(f"Connection Error '{h1_element.get_attribute('data-l10n-id')}' was found.", flush=True)
-            connection_error = True
-            return normal_error, connection_error
-        if substring in h1_text and h1_element.get_attribute('data-l10n-id') is None: # 404 error
-            print(f"Error '{h1_text}' was found.", flush=True)
-            return normal_error, connection_error
-        
-    except TimeoutException:
-        print(f'Cannot load the page', flush=True)
-        connection_error = True
-        return normal_error, connection_error
-    
-    except StaleElementReferenceException as e:
-        print({e}, flush=True)
-        normal_error = True
-        return normal_error, connection_error
-    
-    except WebDriverException as e:
-        print({e}, flush=True)
-        normal_error = True
-        return normal_error, connection_error
-    
-    except Exception as e:
-        print(f"\nAn unexpected error occurred: {e}", flush=True)
-        normal_error = True
-        
-    return normal_error, connection_error
-    
-
 ######################################################
 ### Functions to scrape the awards and nominations ###
 ######################################################
@@ -243,7 +243,7 @@ def scrape_award_note(driver, text_list, href_list, xpath, crew_num):
 
 
 ### Function to scrape the award page ###
-def scrape_award(tconst):
+def scrape_award(tconst, driver=None, identity=None):
 
     '''Scrapes the award page of one title and extracts first, the full name of the award,
     the unique id of the award (event id) and the number of categories;
@@ -255,34 +255,32 @@ def scrape_award(tconst):
     -------
     tconst: str.
       The unique id for each title on IMDB.
+
+    driver: WebDriver or None.
+      A driver (or a tab of a TabBrowser, see tab_mux) to scrape with. If None, one is taken from the driver factory.
+
+    identity: Identity or None.
+      The identity the driver was launched with. Needed when the driver is given.
       
     Returns:
     ---------
     None. Outputs are saved to csv files. '''
 
 
-    # The version (4.4.3) has a different way of setting params
-    # Instances of options and service as well as the binary locaion of firefox
-    # and the path to the webdriver (geckodriver) are needed
-    options = Options()
-    options.set_preference('intl.accept_languages', 'en-US')
-    options.binary_location = 'C:/Program Files/Mozilla Firefox/firefox.exe' 
-    options.page_load_strategy = 'eager'
-
-    # user agent
-    software_names = [SoftwareName.FIREFOX.value, SoftwareName.CHROME.value]
-    operating_sys = [OperatingSystem.WINDOWS.value, OperatingSystem.LINUX.value]
-    user_agent_rotator = UserAgent(software_names=software_names, operating_systems = operating_sys, limit=100)
-    user_agent = user_agent_rotator.get_random_user_agent()
-    options.add_argument('--user-agent={}'.format(user_agent))
+    # Drivers passed in (e.g., one session for all pages of a title or a tab of a TabBrowser) are not released at the end
+    own_driver = driver is None
+    if own_driver:
+        # A ready (spare) headless Firefox cloned from the pre-warmed profile of its identity,
+        # i.e., user agent, consent cookies and blocked hosts (see driver_factory and browser_profile)
+        driver, identity = get_driver_factory().get()
 
-    PATH = 'C:/Users/zhang/Downloads/geckodriver-v0.36.0-win32/geckodriver.exe'
-    service = Service(executable_path=PATH)
-    driver = webdriver.Firefox(options=options, service=service)
-
-    url = 'https://www.imdb.com/title/' + tconst + '/awards/'
+    url = title_url(tconst, 'awards')
     
-    driver.get(url) 
+    if own_driver and HEDGE_REQUESTS:
+        # A second fetch on a spare driver when the page is slower than the running p95 of its page type
+        driver, identity = hedged_get(driver, identity, url, 'awards')
+    else:
+        driver.get(url)
     driver.implicitly_wait(5) # tell the webdriver to wait for 10 seconds for the page to load
 
     ############################################
@@ -290,7 +288,7 @@ def scrape_award(tconst):
     ############################################
     
     # Capture any error message such as 503 error or server not found error
-    normal_error, connection_error = check_h1_for_error(driver, 'Error', ['hero__pageTitle', 'ipc-title__text']) 
+    normal_error, connection_error, status = check_page_for_error(driver, 'awards')
 
     initial_sleep_n = 3 # initial seconds to sleep when there is a normal error (not webdriver exception)
     initial_sleep_s = 30 # for special errors
@@ -305,11 +303,12 @@ def scrape_award(tconst):
         print(f'refreshing {tconst} award...', flush=True)
             
         time.sleep(1)
-        normal_error, connection_error = check_h1_for_error(driver, 'Error', ['hero__pageTitle', 'ipc-title__text'])
+        normal_error, connection_error, status = check_page_for_error(driver, 'awards')
         
         if refresh_attempts==11:
             print(f'Still error. Closing and skipping award {tconst}. Please check later!', flush=True)
-            driver.close()
+            if own_driver:
+                release_driver(driver)
             break
 
     while connection_error and refresh_attempts<=5:
@@ -320,10 +319,11 @@ def scrape_award(tconst):
         driver.refresh()
         print(f'refreshing {tconst} award...', flush=True)
         time.sleep(1)
-        normal_error, connection_error = check_h1_for_error(driver, 'Error', ['hero__pageTitle', 'ipc-title__text'])
+        normal_error, connection_error, status = check_page_for_error(driver, 'awards')
         if refresh_attempts==6:
             print(f'Still connection error. Closing and skipping award {tconst}. Please check later!', flush=True)
-            driver.close()
+            if own_driver:
+                release_driver(driver)
             break
 
 
@@ -332,6 +332,7 @@ def scrape_award(tconst):
     #############################
 
     print(f'Award page {tconst} ready!', flush=True) 
+    page_metrics.measure(driver, 'awards')
 
     # output file save to a subfolder
     current_path = os.getcwd()
@@ -342,48 +343,35 @@ def scrape_award(tconst):
     if not os.path.exists(subfolder_path):
         os.makedirs(subfolder_path)
 
-    def save_award_gen_output(subfolder_path):
-        df_gen = pd.DataFrame({'award_name': awards, 'award_id': event_ids, 'num_category': num_of_cats})
+    def save_award_gen_output(subfolder_path, negative=None):
+        # negative: the reason when there is no award to save (see negative_cache)
+        df_gen = AwardEvent.to_frame(events)
         output_file_name_gen = tconst + '_gen_' + str(date.today()) + '.csv'
         output_file_path_gen = os.path.join(subfolder_path, output_file_name_gen)
-        df_gen.to_csv(output_file_path_gen, index=False)
+        write_artifact(df_gen, output_file_path_gen, tconst, 'gen', negative=negative)
 
     def save_award_detail_output(subfolder_path):
-        df_out = pd.DataFrame({'award': award_alias, 'nomination': nominations, 'category': categories, 
-                            'person': persons, 'person_id': person_ids, 'note': notes, 'note_id': note_ids})
+        df_out = Nomination.to_frame(nomination_rows)
         output_file_name = tconst + '_' + str(date.today()) + '.csv'
         # specify the output file path
         output_file_path = os.path.join(subfolder_path, output_file_name)
-        df_out.to_csv(output_file_path, index=False)
+        write_artifact(df_out, output_file_path, tconst, 'award')
 
-    # Set initial empty list for each element
-    awards = [] # award name
-    nominations = [] # whether the person is a nominee or a winner
-    award_alias = []
-    categories = [] # specific award such as best leading character
-    persons = []
-    person_ids = []
-    event_ids = []
-    notes = []
-    num_of_cats = [] # number of categories
-    note_ids = []
-
-    # Decline the preferences
-    decline_button = WebDriverWait(driver, 30).until(EC.element_to_be_clickable((By.XPATH, "//button[@data-testid='reject-button']")))
-    driver.execute_script("arguments[0].click();", decline_button)
+    # One record per award (name, event id and number of categories) and per nominee or winner of a category
+    events = []
+    nomination_rows = []
+
+    # Decline the preferences (no waiting when the saved consent was restored)
+    decline_preferences(driver, identity)
     
     
     try:
-        # Some titles do not have awards
-        # Define the text that will be shown when the title has no award
-        search_text = "It looks like we don't have any awards for this title yet."
-
-        # Check if the text is present on the page
-        if search_text in driver.page_source:
+        # Some titles do not have awards, which was already found by the classifier
+        # together with the 404 error that escaped the refresh loops
+        if status == EMPTY:
             raise NoSuchElementException
         
-        error_text = "404 Error"
-        if error_text in driver.find_element(By.TAG_NAME, 'h1').text:
+        if status == NOT_FOUND:
             raise Exception
         
         # When there is sponsered info that takes a lot of space, scroll down to the h1 tag
@@ -405,16 +393,15 @@ def scrape_award(tconst):
                 # Extract award name and event id
                 award = block_award_names[i].text
                 event = block_award_names[i].find_element(By.XPATH, "./span").get_attribute('id')
-                awards.append(award)
-                event_ids.append(event)
+                events.append(AwardEvent(award, event))
             except:
-                awards.append(None)
-                event_ids.append(None)
+                events.append(AwardEvent())
             print(f'Collected No. {i+1} award at {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}')
                 
         # Click the 'load more' button if there is one and count how many items for this event.
         # In the html, it shows that "some nodes were hidden". But on the page all is present and can be scraped.
-        for x in event_ids:
+        for event in events:
+            x = event.award_id
             testid = 'sub-section-' + x
             while True:
                 try: 
@@ -440,8 +427,7 @@ def scrape_award(tconst):
                     # Handle the case when there element becomes stale
                     continue
 
-            num_of_category = len(driver.find_elements(By.XPATH, f"//div[@data-testid='{testid}']/ul/li"))
-            num_of_cats.append(num_of_category)
+            event.num_category = len(driver.find_elements(By.XPATH, f"//div[@data-testid='{testid}']/ul/li"))
         
         
         
@@ -460,6 +446,9 @@ def scrape_award(tconst):
         num = sum(int(i) for i in re.findall(r'\d+', driver.find_element(By.XPATH, "//div[@data-testid='awards-signpost']").text))
     
         for i in range(0, int(num)): 
+            # The fields of the nominees or winners of the category, one row per person once collected
+            persons, person_ids, nominations, award_alias, categories, notes, note_ids = [], [], [], [], [], [], []
+
             # Collect the crew info and count the number of nominees or winners
             scrape_award_crew(blocks[i], persons, person_ids, "./ul/li/a[@class='ipc-metadata-list-summary-item__li ipc-metadata-list-summary-item__li--link']")
             crew_num = len(blocks[i].find_elements(By.XPATH, "./ul/li/a[@class='ipc-metadata-list-summary-item__li ipc-metadata-list-summary-item__li--link']"))
@@ -481,33 +470,43 @@ def scrape_award(tconst):
             scrape_award_note(blocks[i], notes, note_ids, "./div/span/div/div/div[@class='ipc-html-content-inner-div']", crew_num)
             print('Scraped notes!')
 
+            nomination_rows.extend(Nomination.from_columns(award_alias, nominations, categories, persons, person_ids, notes, note_ids))
+
     except NoSuchElementException:
-        num_of_cats.append(0)
-        awards.append(None)
-        event_ids.append(None)
-        # Only save the general file to keep track and show that there is no award
-        # But have to make sure the arrays are of the same length (appended list has len of 1 while others 0)
-        save_award_gen_output(subfolder_path)
-        print(f'{tconst} no award', flush=True)
+        # The awards collected before a missing element (e.g., the signpost) are kept, the placeholder is only for a title without any
+        if not events:
+            events.append(AwardEvent(None, None, 0))
+            negative = EMPTY
+            print(f'{tconst} no award', flush=True)
+        else:
+            negative = None
+            print(f'{tconst} award page incomplete, {len(events)} awards kept', flush=True)
+        # Only save the general file to keep track and show that there is no award (the nominations are saved below with it)
+        if not nomination_rows:
+            save_award_gen_output(subfolder_path, negative=negative)
 
     except Exception:
-        num_of_cats.append('404')
-        awards.append(None)
-        event_ids.append(None)
+        if not events:
+            events.append(AwardEvent(None, None, '404'))
+            negative = NOT_FOUND if status == NOT_FOUND else ERROR
+        else:
+            negative = None
         # 404 escaped the check at the beginning and only captured by checking the text of h1 tag
-        save_award_gen_output(subfolder_path)
+        if not nomination_rows:
+            save_award_gen_output(subfolder_path, negative=negative)
         print(f'404 error: {tconst} award', flush=True)
 
     finally:
         # If an exception occurs before this, the page will remain open
-        driver.close()
+        if own_driver:
+            release_driver(driver)
 
     ###########################################
     ### Save output dataframes to csv files ###
     ###########################################
     
     # only save detailed files if they are not all empty (i.e., the title has awards)
-    if not all(not lst for lst in [award_alias, nominations, categories, persons, person_ids]):
+    if nomination_rows:
         # There are 2 files, one has more general info including the full name of the award,
         # the number of categories of each award and the unique id of each award;
         # another has detailed info including nominees and/or winners, categories and notes.
@@ -597,11 +596,11 @@ def split_parentheses(s):
 
 
 ### Function to scrape producers, distributors, special effect and other companies & release info ###
-def scrape_sub_section(driver, section):
+def scrape_sub_section(driver, section, record=CreditRow):
 
     '''
     Scrapes the texts of all elements under one subsection on a page and 
-    appends to different lists after splitting by funcs above. 
+    builds one row per element after splitting by funcs above. 
     The section could be about production, distribution, special effect companies or releases.
     
     Params:
@@ -611,29 +610,22 @@ def scrape_sub_section(driver, section):
     
     section: str.
       The section that is being scraped.
+
+    record: type.
+      The row type: CreditRow for the company credits, ReleaseRow for the releases.
       
     Returns:
     ---------
-    firms: list.
-      The firms that are given credits or the country where the title is released.
-    
-    firm_ids: list.
-      The unique id for each firm that is given credits. 
-      Note that subsidiaries under a parent company has different firm ids.
-    
-    dates: list.
-      The date that the title is released or the country and year when the title is distributed.
-      Only available for some parameters (page='releaseinfo' or section='distribution').
-
-    notes: list.
-      The location that the title was released such as a film festival, or distributed such as in theater,
+    rows: list.
+      One row per element with, in this order:
+      the firm that is given credits or the country where the title is released;
+      the unique id for each firm that is given credits (note that subsidiaries under a parent company has different firm ids);
+      the date that the title is released or the country and year when the title is distributed
+      (only available for some parameters (page='releaseinfo' or section='distribution'));
+      the location that the title was released such as a film festival, or distributed such as in theater,
       or what the firm did specifically such as visual effects. '''
 
-    # Set initial empty lists for each element
-    firms = []
-    firm_ids = []
-    notes = []
-    dates= []
+    rows = []
 
     ##################################
     ### Click the load more button ###
@@ -656,9 +648,7 @@ def scrape_sub_section(driver, section):
     ### Scrape the sub section ###
     ##############################
     
-    app_firm = firms.append
-    app_note = notes.append
-    app_date = dates.append
+    app_row = rows.append
 
     try:
         # Since all 'load more' buttons are already pressed, it should be quick to locate all elements
@@ -673,15 +663,12 @@ def scrape_sub_section(driver, section):
             s = x.text
             # ID includes company id when the page is for company credits and release order otherwise (will be dropped)
             co_id = x.get_attribute('id')
-            firm_ids.append(co_id)
 
             if section == 'distribution':
                 firm, parentheses_content, date = split_parentheses(s)
             else:
                 firm, parentheses_content, date = regex_extract(s)
-            app_firm(firm)
-            app_note(parentheses_content)
-            app_date(date) 
+            app_row(record(firm, co_id, date, parentheses_content))
             # print(f'Finish collecting info of {section}')
     except NoSuchElementException:
         print(f'No {section} on the page found!')
@@ -689,12 +676,12 @@ def scrape_sub_section(driver, section):
     # else:
     #     
     
-    return firms, firm_ids, dates, notes
+    return rows
 
 
 
 ### Function to scrape a certain page ###
-def scrape_detail_page(tconst, page):
+def scrape_detail_page(tconst, page, driver=None, identity=None):
 
     '''
     Scrapes the texts of all elements under all desired subsections on one page and 
@@ -709,40 +696,38 @@ def scrape_detail_page(tconst, page):
     page: str.
       The page that contains the relevant info, such as company credits or release info.
 
+    driver: WebDriver or None.
+      A driver (or a tab of a TabBrowser, see tab_mux) to scrape with. If None, one is taken from the driver factory.
+
+    identity: Identity or None.
+      The identity the driver was launched with. Needed when the driver is given.
+
     Returns:
     ---------
     A DataFrame containing relevant info regarding release info or company credits.
     '''
 
     
-    # The version (4.4.3) has a different way of setting params
-    # Instances of options and service as well as the binary locaion of firefox
-    # and the path to the webdriver (geckodriver) are needed
-    options = Options()
-    options.set_preference('intl.accept_languages', 'en-US')
-    options.binary_location = 'C:/Program Files/Mozilla Firefox/firefox.exe'
-    options.page_load_strategy = 'eager'
-    
-    # user agent
-    software_names = [SoftwareName.FIREFOX.value, SoftwareName.CHROME.value]
-    operating_sys = [OperatingSystem.WINDOWS.value, OperatingSystem.LINUX.value]
-    user_agent_rotator = UserAgent(software_names=software_names, operating_systems = operating_sys, limit=100)
-    user_agent = user_agent_rotator.get_random_user_agent()
-    options.add_argument('--user-agent={}'.format(user_agent))
-
-    PATH = 'C:/Users/zhang/Downloads/geckodriver-v0.36.0-win32/geckodriver.exe'
-    service = Service(executable_path=PATH)
-    driver = webdriver.Firefox(options=options, service=service)
-    url = 'https://www.imdb.com/title/' + tconst + '/' + page + '/' 
+    # Drivers passed in (e.g., one session for all pages of a title or a tab of a TabBrowser) are not released at the end
+    own_driver = driver is None
+    if own_driver:
+        # A ready (spare) headless Firefox cloned from the pre-warmed profile of its identity,
+        # i.e., user agent, consent cookies and blocked hosts (see driver_factory and browser_profile)
+        driver, identity = get_driver_factory().get()
+    url = title_url(tconst, page)
     
-    driver.get(url) 
+    if own_driver and HEDGE_REQUESTS:
+        # A second fetch on a spare driver when the page is slower than the running p95 of its page type
+        driver, identity = hedged_get(driver, identity, url, page)
+    else:
+        driver.get(url)
     driver.implicitly_wait(10)
 
     # Capture any error message such as 503 error or server not found error
     initial_sleep = 3
     initial_sleep_s = 30
     refresh_attempts = 0
-    normal_error, connection_error = check_h1_for_error(driver, 'Error', ['hero__pageTitle', 'ipc-title__text'])
+    normal_error, connection_error, status = check_page_for_error(driver, page)
     while normal_error and refresh_attempts<=10:
         print(f'### Pause {initial_sleep}s for {tconst} {page} at {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}###', flush=True)
         time.sleep(initial_sleep)
@@ -751,11 +736,12 @@ def scrape_detail_page(tconst, page):
         driver.refresh()
         print(f'refreshing {tconst} {page}...', flush=True)
         time.sleep(1)
-        normal_error, connection_error = check_h1_for_error(driver, 'Error', ['hero__pageTitle', 'ipc-title__text'])
+        normal_error, connection_error, status = check_page_for_error(driver, page)
     
         if refresh_attempts==11: 
             print(f'Still error. Closing {tconst} page {page}', flush=True)
-            driver.close()
+            if own_driver:
+                release_driver(driver)
             break
 
     while connection_error and refresh_attempts<=5:
@@ -767,19 +753,20 @@ def scrape_detail_page(tconst, page):
         driver.refresh()
         print(f'refreshing {tconst} {page}...', flush=True)
         time.sleep(1)
-        normal_error, connection_error = check_h1_for_error(driver, 'Error', ['hero__pageTitle', 'ipc-title__text'])
+        normal_error, connection_error, status = check_page_for_error(driver, page)
         if refresh_attempts==6:
             print(f'Still connection error. Closing {tconst} {page}', flush=True)
-            driver.close()
+            if own_driver:
+                release_driver(driver)
             break
         
     print(f'Page {page} for {tconst} ready!', flush=True) 
+    page_metrics.measure(driver, page)
     
 
 
-    # Decline the preferences
-    decline_button = WebDriverWait(driver, 30).until(EC.element_to_be_clickable((By.XPATH, "//button[@data-testid='reject-button']")))
-    driver.execute_script("arguments[0].click();", decline_button)
+    # Decline the preferences (no waiting when the saved consent was restored)
+    decline_preferences(driver, identity)
     
 
     ### Function to build output path ###
@@ -832,38 +819,35 @@ def scrape_detail_page(tconst, page):
     if page == 'releaseinfo':
         output_file_path_re = build_output_path('Release', '_release_', tconst)
         try:
-            search_text = "It looks like we don't have any release date for this title yet."
-            # Check if the text is present on the page
-            if search_text in driver.page_source:
+            # The classifier already checked for the empty-section text and the 404 error
+            if status == EMPTY:
                 print(f'No release info for {tconst}')
                 raise NoSuchElementException
                 
-            error_text = "404 Error"
-            if error_text in driver.find_element(By.TAG_NAME, 'h1').text:
+            if status == NOT_FOUND:
                 raise Exception
 
             # when there is sponsered info that takes a lot of space, scroll down to the h1 tag
             h1_tag = driver.find_element(By.XPATH, f"//h1[contains(@class, 'ipc-title__text')]")
             driver.execute_script("arguments[0].scrollIntoView();", h1_tag)
 
-            firms, firm_ids, dates, notes = scrape_sub_section(driver, 'releases')
-
-            df = pd.DataFrame({'country': firms, 'rel_id': firm_ids, 'date': dates, 'location': notes})            
-            df.to_csv(output_file_path_re, index=False)
+            df = ReleaseRow.to_frame(scrape_sub_section(driver, 'releases', ReleaseRow))
+            write_artifact(df, output_file_path_re, tconst, 'release')
             print(f'Release file for {tconst} saved', flush=True)
 
         except NoSuchElementException:
-            df = pd.DataFrame({'country': [None], 'rel_id': [None], 'date': [None], 'location': ['NoInfo']})
-            df.to_csv(output_file_path_re, index=False)
+            df = ReleaseRow.to_frame([ReleaseRow.empty()])
+            write_artifact(df, output_file_path_re, tconst, 'release', negative=EMPTY)
             print(f'Release file for {tconst} saved. No release info.', flush=True)
 
         except Exception:
-            df = pd.DataFrame({'country': ['404'], 'rel_id': ['404'], 'date': ['404'], 'location': ['404']})
-            df.to_csv(output_file_path_re, index=False)
+            df = ReleaseRow.to_frame([ReleaseRow.not_found()])
+            write_artifact(df, output_file_path_re, tconst, 'release', negative=NOT_FOUND if status == NOT_FOUND else ERROR)
             print(f'404 error: Release file for {tconst}', flush=True)
 
         finally:
-            driver.close()
+            if own_driver:
+                release_driver(driver)
 
 
     if page == 'companycredits':
@@ -873,14 +857,12 @@ def scrape_detail_page(tconst, page):
         sections = ['production', 'distribution', 'specialEffects', 'miscellaneous', 'sales']
         dfs = []
         try:
-            search_text = "It looks like we don't have any company credits for this title yet."
-            # Check if the text is present on the page
-            if search_text in driver.page_source: # no need to handle the case when len(dfs)==0
+            # The classifier already checked for the empty-section text and the 404 error
+            if status == EMPTY: # no need to handle the case when len(dfs)==0
                 print(f'No company credits for {tconst}')
                 raise NoSuchElementException
             
-            error_text = "404 Error"
-            if error_text in driver.find_element(By.TAG_NAME, 'h1').text:
+            if status == NOT_FOUND:
                 raise Exception
 
             # when there is sponsered info that takes a lot of space, scroll down to the h1 tag
@@ -889,8 +871,7 @@ def scrape_detail_page(tconst, page):
 
             for sec in sections:
                 try:
-                    firms, firm_ids, dates, notes = scrape_sub_section(driver, sec)
-                    df = pd.DataFrame({'firm': firms, 'firm_id': firm_ids, 'country, yr': dates, 'note': notes})
+                    df = CreditRow.to_frame(scrape_sub_section(driver, sec))
                     dfs.append(df)
                     if sec == 'distribution':
                         dis = True
@@ -900,31 +881,32 @@ def scrape_detail_page(tconst, page):
 
             if len(dfs) == 1:
                 if dis:
-                    dfs[0].to_csv(output_file_path_dis, index=False)
+                    write_artifact(dfs[0], output_file_path_dis, tconst, 'distribution')
                     print(f'Distribution file for {tconst} saved', flush=True)
                 else:
-                    dfs[0].to_csv(output_file_path_pro, index=False)
+                    write_artifact(dfs[0], output_file_path_pro, tconst, 'pro')
                     print(f'Production file for {tconst} saved', flush=True)
             if len(dfs)>1:
                 # Append distribution to one df and all others to another concatenated df
-                dfs[1].to_csv(output_file_path_dis, index=False)
+                write_artifact(dfs[1], output_file_path_dis, tconst, 'distribution')
                 print(f'Distribution file for {tconst} saved')
                 
-                pd.concat([df for i, df in enumerate(dfs) if i != 1]).to_csv(output_file_path_pro, index=False)
+                write_artifact(pd.concat([df for i, df in enumerate(dfs) if i != 1]), output_file_path_pro, tconst, 'pro')
                 print(f'Production file for {tconst} saved', flush=True)
 
         except NoSuchElementException:
-            df = pd.DataFrame({'firm': [None], 'firm_id': [None], 'country, yr': [None], 'note': ['NoInfo']})
-            df.to_csv(output_file_path_pro, index=False)
+            df = CreditRow.to_frame([CreditRow.empty()])
+            write_artifact(df, output_file_path_pro, tconst, 'pro', negative=EMPTY)
             print(f'Company creds for {tconst} saved. No info.', flush=True)
 
         except Exception:
-            df = pd.DataFrame({'firm': ['404'], 'firm_id': ['404'], 'country, yr': ['404'], 'note': ['404']})
-            df.to_csv(output_file_path_re, index=False)
+            df = CreditRow.to_frame([CreditRow.not_found()])
+            write_artifact(df, output_file_path_pro, tconst, 'pro', negative=NOT_FOUND if status == NOT_FOUND else ERROR)
             print(f'404 error: Company creds for {tconst}', flush=True)
         
         finally:        
-            driver.close()
+            if own_driver:
+                release_driver(driver)
 
             
 
@@ -1110,7 +1092,7 @@ def scrape_air_date(driver, date_list):
 
 
 ### Function to scrape the main page using the funcs above ###
-def scrape_view(tconst):
+def scrape_view(tconst, driver=None, identity=None):
 
     ''' 
     Scrapes the main page of the title and collects the streaming options,
@@ -1122,31 +1104,25 @@ def scrape_view(tconst):
     Params:
     -------
     tconst: str.
+
+    driver: WebDriver or None.
+      A driver (or a tab of a TabBrowser, see tab_mux) to scrape with. If None, one is taken from the driver factory.
+
+    identity: Identity or None.
+      The identity the driver was launched with. Needed when the driver is given.
     
     Returns:
     ---------
-    data_dict: dict.
-      The dictionary with all the info on the main page. '''
+    row: MainRow.
+      The row with all the info on the main page (MainRow.not_found for a 404). '''
             
-    # The version (4.4.3) has a different way of setting params
-    # Instances of options and service as well as the binary locaion of firefox
-    # and the path to the webdriver (geckodriver) are needed
-    options = Options()
-    options.set_preference('intl.accept_languages', 'en-US')
-    options.binary_location = 'C:/Program Files/Mozilla Firefox/firefox.exe'
-    options.page_load_strategy = 'eager'
-
-    # user agent
-    software_names = [SoftwareName.FIREFOX.value, SoftwareName.CHROME.value]
-    operating_sys = [OperatingSystem.WINDOWS.value, OperatingSystem.LINUX.value]
-    user_agent_rotator = UserAgent(software_names=software_names, operating_systems=operating_sys, limit=100)
-    user_agent = user_agent_rotator.get_random_user_agent()
-    options.add_argument('--user-agent={}'.format(user_agent))
-   
-    PATH = 'C:/Users/zhang/Downloads/geckodriver-v0.36.0-win32/geckodriver.exe'
-    service = Service(executable_path=PATH)
-    driver = webdriver.Firefox(options=options, service=service)
-    url = 'https://www.imdb.com/title/' + tconst + '/'
+    # Drivers passed in (e.g., one session for all pages of a title or a tab of a TabBrowser) are not released at the end
+    own_driver = driver is None
+    if own_driver:
+        # A ready (spare) headless Firefox cloned from the pre-warmed profile of its identity,
+        # i.e., user agent, consent cookies and blocked hosts (see driver_factory and browser_profile)
+        driver, identity = get_driver_factory().get()
+    url = title_url(tconst)
 
     # Set initial empty list for each element
     tconsts = []
@@ -1194,11 +1170,15 @@ def scrape_view(tconst):
                 'soundmix': soundmix, 'star':stars, 'air_date': air_dates }
 
     
-    driver.get(url) 
+    if own_driver and HEDGE_REQUESTS:
+        # A second fetch on a spare driver when the page is slower than the running p95 of its page type
+        driver, identity = hedged_get(driver, identity, url, 'main')
+    else:
+        driver.get(url)
     driver.implicitly_wait(10) 
     
     # Capture any error message such as 503 error or server not found error
-    normal_error, connection_error = check_h1_for_error(driver, 'Error', ['hero__pageTitle', 'ipc-title__text'])
+    normal_error, connection_error, status = check_page_for_error(driver, 'main')
     initial_sleep = 3 
     initial_sleep_s = 30
     refresh_attempts = 0
@@ -1210,10 +1190,11 @@ def scrape_view(tconst):
         driver.refresh()
         print(f'refreshing {tconst} main page...', flush=True)
         time.sleep(1)
-        normal_error = check_h1_for_error(driver, 'Error', ['hero__pageTitle', 'ipc-title__text'])
+        normal_error, connection_error, status = check_page_for_error(driver, 'main')
    
         if refresh_attempts==11: 
-            driver.close()
+            if own_driver:
+                release_driver(driver)
             print(f'Main page {tconst} still error. Closing and skipping. Please check later!', flush=True)
             break
     
@@ -1226,18 +1207,26 @@ def scrape_view(tconst):
         driver.refresh()
         print(f'refreshing {tconst} main page...', flush=True)
         time.sleep(1)
-        normal_error, connection_error = check_h1_for_error(driver, 'Error', ['hero__pageTitle', 'ipc-title__text'])
+        normal_error, connection_error, status = check_page_for_error(driver, 'main')
         if refresh_attempts==6:
             print(f'Still connection error. Closing {tconst} main page. Please check later!', flush=True)
-            driver.close()
+            if own_driver:
+                release_driver(driver)
             break
+
+    if status == NOT_FOUND:
+        # the callers record the title in the negative cache (see save_main_row and save_main_file)
+        print(f'404 error: main page of {tconst}', flush=True)
+        if own_driver:
+            release_driver(driver)
+        return MainRow.not_found(tconst)
     
     print(f'Main page {tconst} ready!', flush=True)
+    page_metrics.measure(driver, 'main')
 
 
-    # Decline the preferences
-    decline_button = WebDriverWait(driver, 30).until(EC.element_to_be_clickable((By.XPATH, "//button[@data-testid='reject-button']")))
-    driver.execute_script("arguments[0].click();", decline_button)
+    # Decline the preferences (no waiting when the saved consent was restored)
+    decline_preferences(driver, identity)
 
     try:
         # when there is sponsered info that takes a lot of space, scroll down to the h1 tag
@@ -1335,12 +1324,11 @@ def scrape_view(tconst):
             li.append('404')
 
     finally:
-        driver.close()
+        if own_driver:
+            release_driver(driver)
 
-    for key in data_dict:
-        if not data_dict[key]:  # Check if the value corresponding to the key is an empty list
-            data_dict[key].append(None)
-    return data_dict
+    # One slotted row instead of the dict of lists, a field whose list is empty is None
+    return MainRow.from_lists(data_dict)
 
 
 
@@ -1366,33 +1354,16 @@ def check_recent_file(t, folder, directory):
       E.g., the subfolder is 'Release' while the file name contains 'release'.
       
     directory: path.
-      The path to the subfolder. 
+      The path to the subfolder. Not listed anymore, the files are looked up in the manifest.
       
     Returns:
     --------
     True if there is a recent file and False otherwise. '''
     
-    today = date.today()
-    two_week_ago = today - timedelta(weeks=2)
-    # Escape special characters in t
-    escaped_t = re.escape(t)
-    
-    if folder == None:
-        # Compile the RE pattern to a RE object to match files in the format 'tconst_YYYY-MM-DD.csv'
-        pattern = re.compile(rf'{t}_(\d{{4}}-\d{{2}}-\d{{2}})\.csv')
-    
-    else:
-        pattern = re.compile(rf'{escaped_t}_{folder}_(\d{{4}}-\d{{2}}-\d{{2}})\.csv')
-    
-    # List all files in the specified directory
-    for file_name in os.listdir(directory):
-        match = pattern.match(file_name)
-        if match:
-            file_date_str = match.group(1)
-            file_date = datetime.strptime(file_date_str, '%Y-%m-%d').date()
-            if two_week_ago <= file_date <= today:
-                return True  # Recent file found
-    return False  # No recent file found
+    # The manifest is an indexed lookup instead of listing and matching all files of the directory (see manifest)
+    # The award details (tconst_YYYY-MM-DD.csv) are the 'award' artifact
+    # How recent depends on the artifact and the age of the title (see refresh_policy)
+    return refresh_policy.is_fresh(t, folder if folder is not None else 'award')
 
 
 
@@ -1411,68 +1382,121 @@ def check_recent_batch(i, folder, directory):
       E.g., the subfolder is 'Release' while the file name contains 'release'.
       
     directory: path.
-      The path to the subfolder. 
+      The path to the subfolder. Not listed anymore, the files are looked up in the manifest.
 
     Returns:
     --------
     True if there is a recent file and False otherwise. '''
     
-    today = date.today()
-    two_week_ago = today - timedelta(weeks=2)
-    
-    pattern = re.compile(rf'{folder}_\({i+1}\)_(\d{{4}}-\d{{2}}-\d{{2}})\.csv')
-    
-    # List all files in the specified directory
-    for file_name in os.listdir(directory):
-        match = pattern.match(file_name)
-        if match:
-            file_date_str = match.group(1)
-            file_date = datetime.strptime(file_date_str, '%Y-%m-%d').date()
-            if two_week_ago <= file_date <= today:
-                return True  
-    return False  
+    return refresh_policy.is_fresh(batch_key(i), folder)
 
 
-### Function to check whether the output file for award exists and if not, scrape and save ###
-def save_award_file(t):
-    # output file save to a subfolder
-    current_path = os.getcwd()
-    # define the subfolder name with the same date that the scraping started
-    subfolder = 'Award'
-    # create the subfolder if it doesn't exist
-    subfolder_path = os.path.join(current_path, subfolder)
-    if check_recent_file(t, 'gen', subfolder_path):
+### Function to check whether the award page of a title is due ###
+def award_due(t):
+
+    '''Whether the award page of the title is to be scraped: not negative-cached and without a recent gen file.'''
+
+    # no browser for a title that had no award or a 404 recently (see negative_cache)
+    if get_negative_cache().should_skip(t, 'gen'):
+        return False
+    if check_recent_file(t, 'gen', os.path.join(os.getcwd(), 'Award')):
         # for no award titles, there is only gen file
         print(f'A recent {t} file exists.', flush=True)
-        return
+        return False
+    return True
+
+
+### Function to check which detail pages of a title are due ###
+def detail_pages_due(t):
+
+    '''
+    Returns the detail pages of the title to scrape ('releaseinfo' and/or 'companycredits'): none when both files are recent,
+    otherwise those not negative-cached.
+    '''
+
+    current_path = os.getcwd()
+    subfolder_path_release = os.path.join(current_path, 'Release')
+    subfolder_path_credit = os.path.join(current_path, 'Company credit')
+    if check_recent_file(t, 'release', subfolder_path_release) and check_recent_file(t, 'pro', subfolder_path_credit):
+        # use 'and' to check whether the collected info is complete (with production, unnecessary to include others such as distribution)
+        print(f'A recent {t} file for details exists.', flush=True)
+        return []
+    # no browser for a page that had no info or a 404 recently (see negative_cache)
+    return [txt for txt in ['releaseinfo', 'companycredits']
+            if not get_negative_cache().should_skip(t, 'release' if txt == 'releaseinfo' else 'pro')]
+
 
-    scrape_award(t)
+### Function to check whether the output file for award exists and if not, scrape and save ###
+def save_award_file(t, driver=None, identity=None):
+    if award_due(t):
+        scrape_award(t, driver, identity)
     
 
 ### Function to check whether the output file for detailed info exists and if not, scrape and save ###
-def save_detail_file(t):
-    current_path = os.getcwd()
-    for txt in ['releaseinfo', 'companycredits']:
-        subfolder_release = 'Release'
-        subfolder_credit = 'Company credit'
+def save_detail_file(t, driver=None, identity=None):
+    for txt in detail_pages_due(t):
+        scrape_detail_page(t, txt, driver, identity)
 
-        # create the subfolder if it doesn't exist
-        subfolder_path_release = os.path.join(current_path, subfolder_release)
-        subfolder_path_credit = os.path.join(current_path, subfolder_credit)
-        if check_recent_file(t, 'release', subfolder_path_release) and check_recent_file(t, 'pro', subfolder_path_credit):
-            # use 'and' to check whether the collected info is complete (with production, unnecessary to include others such as distribution)
-            print(f'A recent {t} file for details exists.', flush=True)
-            return
-        
-        scrape_detail_page(t, txt)
+
+### Function to scrape all sub pages of a title (awards, release info and company credits) in one driver session ###
+def save_title_files(t, driver=None, identity=None):
+
+    '''
+    Scrapes the due sub pages of one title (see award_due and detail_pages_due) with the same driver,
+    instead of launching a browser, declining the preferences and checking for errors again for each page.
+    No driver is taken when all pages are recent or negative-cached.
+
+    Params:
+    -------
+    t: str.
+      The tconst of the title.
+
+    driver: WebDriver or None.
+      A driver (or a tab of a TabBrowser) to scrape with. If None, one is taken from the driver factory and released at the end.
+
+    identity: Identity or None.
+      The identity the driver was launched with. Needed when the driver is given.
+
+    Returns:
+    --------
+    duration: float.
+      The wall time in seconds for the title.
+    '''
+
+    t1 = time.perf_counter()
+    # the freshness and negative cache checks first, so a title with nothing due does not launch a browser
+    scrape_awards = award_due(t)
+    detail_pages = detail_pages_due(t)
+    if not scrape_awards and not detail_pages:
+        return time.perf_counter() - t1
+
+    own_driver = driver is None
+    if own_driver:
+        driver, identity = get_driver_factory().get()
+    try:
+        if scrape_awards:
+            scrape_award(t, driver, identity)
+            if own_driver and detail_pages and get_memory_governor().should_recycle(driver):
+                # a long awards page made the browser too large, the details continue on a fresh one
+                release_driver(driver)
+                driver, identity = get_driver_factory().get()
+        for txt in detail_pages:
+            scrape_detail_page(t, txt, driver, identity)
+    finally:
+        if own_driver:
+            release_driver(driver)
+
+    duration = time.perf_counter() - t1
+    print(f'Sub pages of {t} took {round(duration, 2)} seconds', flush=True)
+    return duration
 
 
 ### Function to check whether the file for the i-th batch of main pages exists and if not, scrape and save ###
-def save_main_file(i, tconsts, dicts, result_dict):
+def save_main_file(i, tconsts, rows):
 
     '''
     First, checks whether the recent file for the i-th batch of the main pages exists. 
-    If not, use the thread pool executor to scrape and append the result dictionaries to a list.
+    If not, use the thread pool executor to scrape and append the result rows to a list.
 
     Params:
     -------
@@ -1482,16 +1506,13 @@ def save_main_file(i, tconsts, dicts, result_dict):
     tconsts: list.
       A list of tconsts of the titles.
 
-    dicts: list.
-      A list of dictionaries obtained from the func scrape_view.
-
-    result_dict: dict.
-      A dictionary containing the data to generate the saved main page file.
+    rows: list.
+      A list of MainRow obtained from the func scrape_view, saved as the main page file.
 
     Returns:
     --------
     empty_ids: list.
-      A list of title IDs (tconsts) without watching options.
+      A list of title IDs (tconsts) without watching options, or whose main page is a 404 (now or recently, see negative_cache).
 
     '''
 
@@ -1506,87 +1527,324 @@ def save_main_file(i, tconsts, dicts, result_dict):
         print(f'Main page file for {i+1}th batch exists!', flush=True)
         return
 
+    # no browser for a title whose main page was a 404 recently (see negative_cache)
+    negative_cache = get_negative_cache()
+    skipped = [t for t in tconsts if negative_cache.should_skip(t, 'main')]
+    tconsts = [t for t in tconsts if t not in skipped]
+
     def run_and_append(t):
-        dicts.append(scrape_view(t))
+        rows.append(scrape_view(t))
+
+    if PREFETCH_DEPTH:
+        # The next main pages load in other tabs while the current ones are parsed
+        with PrefetchPipeline(PREFETCH_DEPTH, PREFETCH_WORKERS) as pipeline:
+            rows.extend(r for r in pipeline.map(scrape_view, tconsts, title_url) if r is not None)
+            print(f'Main page prefetching: {pipeline.summary()}', flush=True)
+    elif TABS_PER_BROWSER:
+        # Several tabs of one browser instead of one browser per thread
+        with TabBrowser(TABS_PER_BROWSER) as browser:
+            rows.extend(browser.map(scrape_view, tconsts))
+    else:
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            executor.map(run_and_append, tconsts)
+
+    df = MainRow.to_frame(rows)
+    write_artifact(df, output_file_path, batch_key(i), 'main')
+    if RECORD_METRICS:
+        # the '404' of the placeholder rows are not counts
+        get_metrics_store().observe(MainRow.to_frame([r for r in rows if not r.is_not_found()]))
+    # the batch file is recorded under its batch key, the 404s of its titles are recorded one by one
+    for r in rows:
+        if r.is_not_found():
+            negative_cache.record(r.tconst, 'main', NOT_FOUND)
+        else:
+            negative_cache.clear(r.tconst, 'main')
+    print(f'Main file for {i+1} saved.', flush=True)
 
-    def update_dict(dicts, result_dict):
-        for d in dicts:
-            for key, value in d.items():
-                if key not in result_dict:
-                    result_dict[key] = value  # Instead of [value]
-                else:
-                    result_dict[key].extend(value)  # Instead of append.()
+    empty_ids = [r.tconst for r in rows if (r.streaming_provider is None and r.rent_provider is None) or r.is_not_found()]
+    return empty_ids + skipped
 
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        executor.map(run_and_append, tconsts)
 
-    update_dict(dicts, result_dict)
-    pd.DataFrame(result_dict).to_csv(output_file_path, index=False)
-    print(f'Main file for {i+1} saved.', flush=True)
 
-    empty_ids = [tconst for tconst, streaming_provider, rent_provider 
-                 in zip(result_dict['tconst'], result_dict['streaming_provider'], result_dict['rent_provider']) 
-                 if streaming_provider is None and rent_provider is None]
-    return empty_ids
 
 
+##################################################################
+### Streaming pipeline: main page -> streaming gate -> sub pages ###
+##################################################################
 
+_main_stream_lock = threading.Lock()
 
+### Function to scrape the main page of one title and append it to the main file of the day ###
+def save_main_row(t):
 
-if __name__ == '__main__':
-    
-    for i, chunk in enumerate(pd.read_csv('imdb_merged.csv', usecols=['tconst', 'title_yr'], chunksize=20)):
-        # First make sure the col yr is integer and Nan for invalid parsing
-        if (chunk['title_yr'].dtype != np.float64 or chunk['title_yr'].dtype != np.int64):
-            chunk['title_yr'] = pd.to_numeric(chunk['title_yr'], errors='coerce', downcast='integer') 
-
-        # If derised, we could limit the titles to only the recent ones, e.g., those after 2024
-        title_ids = chunk[chunk['title_yr']>=2024]['tconst'].unique()
-        if len(title_ids) == 0:
-            print(f'There is no title in No.{i+1}th batch later than 2024')
-            continue
+    '''
+    Scrapes the main page of one title and appends the row to 'main_stream_YYYY-MM-DD.csv' in the Main folder.
+    Used by the streaming pipeline, where the titles are not grouped in batches.
+
+    Params:
+    -------
+    t: str.
+      The tconst of the title.
+
+    Returns:
+    --------
+    row: MainRow.
+      The row from scrape_view.
+    '''
+
+    row = scrape_view(t)
+
+    subfolder_path = os.path.join(os.getcwd(), 'Main')
+    os.makedirs(subfolder_path, exist_ok=True)
+    output_file_path = os.path.join(subfolder_path, 'main_stream' + MAIN_STREAM_SUFFIX + '_' + str(date.today()) + '.csv')
+    with _main_stream_lock:
+        df = MainRow.to_frame([row])
+        write_artifact(df, output_file_path, t, 'main', append=True, negative=NOT_FOUND if row.is_not_found() else None)
+    if RECORD_METRICS and not row.is_not_found():
+        get_metrics_store().observe(df)
+    return row
+
+
+### Function to let only titles with streaming options through ###
+def streaming_gate(row):
+
+    '''Returns the tconst if the title (a MainRow) can be streamed, rented or bought, None (dropped) otherwise.'''
+
+    if row.is_not_found():
+        print(f"{row.tconst} main page is a 404", flush=True)
+        return None
+    if row.streaming_provider is None and row.rent_provider is None:
+        print(f"{row.tconst} has no streaming option", flush=True)
+        return None
+    return row.tconst
+
+
+### Function to check whether the files a stage writes for a title are stale ###
+def is_stale_in_stage(t, stage):
+    return not all(refresh_policy.is_fresh(t, artifact) for artifact in STAGE_ARTIFACTS[stage])
+
+
+### Function to run the titles through the stages ###
+def run_title_pipeline(title_ids=None, work_queue=None):
+
+    '''
+    Runs each title independently through the stages connected by bounded queues:
+    main page -> streaming gate -> awards and details (or all sub pages in one session with SAME_SESSION_SUBPAGES).
+    The main page of a title whose main row is still fresh is skipped, and the title goes straight to the sub pages.
+    Each stage has its own number of workers (STAGE_WORKERS), and the throughput and queue depth by stage are reported.
+
+    Params:
+    -------
+    title_ids: iterable or None.
+      The tconsts, e.g., a generator reading imdb_merged.csv by chunks. Not needed with a work queue.
+
+    work_queue: WorkQueue or None.
+      If given, the titles are claimed from the work queue (see work_queue), the status of each title is recorded by stage,
+      and the titles that passed the streaming gate in an interrupted run go straight to the sub pages.
+
+    Returns:
+    --------
+    report: dict.
+      The final report by stage.
+    '''
+
+    def stage_func(name, func):
+        # With a work queue, record whether the title is done or failed in the stage
+        return tracked(work_queue, name, func) if work_queue is not None else func
+
+    next_stages = ['subpages'] if SAME_SESSION_SUBPAGES else ['awards', 'details']
+
+    def main_func(t):
+        # Like the batches of the sequential path, a title with a fresh main row is not scraped again (see refresh_policy):
+        # its tconst goes on to the sub pages, which check their own freshness
+        if refresh_policy.is_fresh(t, 'main'):
+            print(f'A recent main row of {t} exists.', flush=True)
+            return t
+        # and no browser for a title whose main page was a 404 recently (see negative_cache)
+        if get_negative_cache().should_skip(t, 'main'):
+            return None
+        return save_main_row(t)
+
+    def gate_func(row):
+        t = row if isinstance(row, str) else streaming_gate(row)
+        if t is not None and work_queue is None and not seen_titles.add('subpages', t):
+            return None
+        if t is not None and work_queue is not None:
+            # the sub page tasks are recorded (and leased to this run) before they are queued, so they survive a crash
+            for name in next_stages:
+                work_queue.add([t], name)
+            work_queue.claim_titles([t], next_stages)
+        return t
+
+    main = Stage('main', stage_func('main', main_func), STAGE_WORKERS['main'], STAGE_QUEUE_SIZE)
+    gate = Stage('gate', gate_func, STAGE_WORKERS['gate'], STAGE_QUEUE_SIZE)
+    main.then(gate)
+    if SAME_SESSION_SUBPAGES:
+        subpages = Stage('subpages', stage_func('subpages', save_title_files), STAGE_WORKERS['subpages'], STAGE_QUEUE_SIZE)
+        gate.then(subpages)
+        stages = [main, gate, subpages]
+        resumable = [subpages]
+    else:
+        awards = Stage('awards', stage_func('awards', save_award_file), STAGE_WORKERS['awards'], STAGE_QUEUE_SIZE)
+        details = Stage('details', stage_func('details', save_detail_file), STAGE_WORKERS['details'], STAGE_QUEUE_SIZE)
+        gate.then(awards, details)
+        stages = [main, gate, awards, details]
+        resumable = [awards, details]
+
+    with Pipeline(main, stages, PIPELINE_REPORT_EVERY) as pipeline:
+        if work_queue is not None:
+            # Titles that passed the gate before the interruption do not need their main page again
+            for stage in resumable:
+                for t in work_queue.iter_claims(stage.name):
+                    stage.put(t)
+            title_ids = work_queue.iter_claims('main', limit=REFRESH_LIMIT or None)
         else:
-            print(f'No.{i+1}th batch has {len(title_ids)} titles')
+            # the work queue has one task per title and stage, the title list may repeat titles
+            title_ids = drop_seen(seen_titles, 'main', title_ids)
+        for t in title_ids:
+            pipeline.put(t)
+    return pipeline.report()
 
-            t1 = datetime.now()
-            print(f'Scraping the {i+1}th batch at {t1.strftime("%Y-%m-%d %H:%M:%S")}...')
-            dicts = []
-            result_dict = {}
-            try:
-                no_stream_tconsts = save_main_file(i, title_ids, dicts, result_dict)
-                if no_stream_tconsts is None:
-                    no_stream_tconsts = [] 
-            except: 
-                print(f'No.{i+1}th batch main page error!')
-                no_stream_tconsts = [] # skip the main file and scrape all details for this batch
-
-            # To save time, do not scrape the title if there is no streaming option
-            title_ids_detail = list(set(title_ids) - set(no_stream_tconsts))
-
-            if title_ids_detail:
-                print(title_ids_detail)
-
-                with concurrent.futures.ThreadPoolExecutor() as executor:
-                    executor.map(save_award_file, title_ids_detail)
-                    executor.map(save_detail_file, title_ids_detail)
-
-                t2 = datetime.now()
-                duration = t2 - t1
-                print(f'The {i+1}th batch took {round(duration.total_seconds(), 2)} seconds\n') 
-                break # to continue running for other chunks, comment this out 
-            else:
-                print('No title has streaming option')
-                
 
-            
 
-           
 
-        
 
-            
-    
+if __name__ == '__main__':
 
-    
+    if STREAMING_PIPELINE:
+        # Each title flows on its own from the main page to the streaming gate and the sub pages
+        def recent_titles():
+            for chunk in pd.read_csv('imdb_merged.csv', usecols=['tconst', 'title_yr'], chunksize=20):
+                chunk['title_yr'] = pd.to_numeric(chunk['title_yr'], errors='coerce', downcast='integer')
+                # If derised, we could limit the titles to only the recent ones, e.g., those after 2024
+                recent = chunk[chunk['title_yr']>=2024]
+                # the TTL of the files of a title depends on its release year
+                refresh_policy.add_titles(recent['tconst'], recent['title_yr'])
+                yield from recent['tconst'].unique()
+
+        def scheduled_titles():
+            # The stalest and most valuable titles first, those with only fresh files are left out
+            refresh_policy.load_votes()
+            scheduled = refresh_policy.schedule(recent_titles(), limit=REFRESH_LIMIT or None, with_priority=True)
+            print(f'{len(scheduled)} titles to refresh')
+            return dict(scheduled)
+
+        # scheduled_titles gives the priority of each title for the work queue
+        title_source = scheduled_titles if SCHEDULE_BY_PRIORITY else recent_titles
+
+        t1 = datetime.now()
+        print(f'Starting the pipeline at {t1.strftime("%Y-%m-%d %H:%M:%S")}...')
+        if USE_WORK_QUEUE:
+            work_queue = WorkQueue()
+            if work_queue.is_seeded('main'):
+                # A former run left work: the tasks of its killed processes are resumed now instead of when their lease runs out
+                print(f'Resuming the work queue, leases of dead processes released: {work_queue.release_dead_leases()}')
+            # Every run reads the title list: the new titles are added, and the done titles whose files are stale go back to pending
+            titles = title_source()
+            priorities = titles if SCHEDULE_BY_PRIORITY else None
+            titles = list(titles)
+            work_queue.add(titles, 'main', priorities)
+            work_queue.mark_seeded('main')
+            for stage in ['main'] + (['subpages'] if SAME_SESSION_SUBPAGES else ['awards', 'details']):
+                refreshed = work_queue.refresh(titles, stage, lambda t, stage=stage: is_stale_in_stage(t, stage), priorities)
+                print(f'Done titles of {stage} to refresh: {refreshed}')
+            # The titles whose output was left incomplete by a killed run go back to the stage that writes it
+            output_stages = {'main': 'main'}
+            for artifact in ['gen', 'award', 'release', 'pro', 'distribution']:
+                output_stages[artifact] = 'subpages' if SAME_SESSION_SUBPAGES else ('awards' if artifact in ['gen', 'award'] else 'details')
+            get_write_journal().recover(work_queue, output_stages)
+            print(f'Work queue: {work_queue.counts()}')
+            run_title_pipeline(work_queue=work_queue)
+            print(f'Work queue: {work_queue.counts()}')
+        else:
+            # without a work queue, the titles of the incomplete outputs are fetched again as they have no fresh file
+            get_write_journal().recover()
+            run_title_pipeline(title_source())
+        print(f'The pipeline took {round((datetime.now() - t1).total_seconds(), 2)} seconds\n')
+        print(f'Page classification: {classifier_stats.summary()}\n')
+        print(f'Page load: {page_metrics.summary()}\n')
+        print(f'Hedged fetches: {hedging_summary()}\n')
+        print(f'Memory: {get_memory_governor().summary()}\n')
+        print(f'Repeated titles dropped: {seen_titles.dropped}\n')
+        print(f'Negative cache: {get_negative_cache().summary()}\n')
+        # Files written by the writer thread, write latency and queue depth (see output_writer)
+        get_output_writer().flush()
+        print(f'Writer: {get_output_writer().summary()}\n')
 
+    else:
+        # Outputs left incomplete by a killed run: cleaned up and not fresh anymore, so fetched again
+        get_write_journal().recover()
+        # The former batches of 20 titles: the sub pages of a batch start after all its main pages are done
+        for i, chunk in enumerate(pd.read_csv('imdb_merged.csv', usecols=['tconst', 'title_yr'], chunksize=20)):
+            # First make sure the col yr is integer and Nan for invalid parsing
+            if (chunk['title_yr'].dtype != np.float64 or chunk['title_yr'].dtype != np.int64):
+                chunk['title_yr'] = pd.to_numeric(chunk['title_yr'], errors='coerce', downcast='integer') 
+            refresh_policy.add_titles(chunk['tconst'], chunk['title_yr'])
+
+            # If derised, we could limit the titles to only the recent ones, e.g., those after 2024
+            title_ids = chunk[chunk['title_yr']>=2024]['tconst'].unique()
+            # drop the titles of the previous chunks
+            title_ids = list(drop_seen(seen_titles, 'main', title_ids))
+            if len(title_ids) == 0:
+                print(f'There is no title in No.{i+1}th batch later than 2024')
+                continue
+            else:
+                print(f'No.{i+1}th batch has {len(title_ids)} titles')
 
+                t1 = datetime.now()
+                print(f'Scraping the {i+1}th batch at {t1.strftime("%Y-%m-%d %H:%M:%S")}...')
+                rows = []
+                try:
+                    no_stream_tconsts = save_main_file(i, title_ids, rows)
+                    if no_stream_tconsts is None:
+                        no_stream_tconsts = [] 
+                except: 
+                    print(f'No.{i+1}th batch main page error!')
+                    no_stream_tconsts = [] # skip the main file and scrape all details for this batch
+
+                # To save time, do not scrape the title if there is no streaming option
+                title_ids_detail = list(drop_seen(seen_titles, 'subpages', set(title_ids) - set(no_stream_tconsts)))
+
+                if title_ids_detail:
+                    print(title_ids_detail)
+
+                    if SAME_SESSION_SUBPAGES:
+                        # One driver session per title for all its sub pages
+                        if PREFETCH_DEPTH:
+                            # the award page (the first sub page) of the next titles loads ahead
+                            with PrefetchPipeline(PREFETCH_DEPTH, PREFETCH_WORKERS) as pipeline:
+                                title_times = [x for x in pipeline.map(save_title_files, title_ids_detail, lambda t: title_url(t, 'awards'))
+                                               if x is not None]
+                                print(f'Sub page prefetching: {pipeline.summary()}')
+                        elif TABS_PER_BROWSER:
+                            with TabBrowser(TABS_PER_BROWSER) as browser:
+                                title_times = browser.map(save_title_files, title_ids_detail)
+                        else:
+                            with concurrent.futures.ThreadPoolExecutor() as executor:
+                                title_times = list(executor.map(save_title_files, title_ids_detail))
+                        if title_times:
+                            print(f'Sub pages per title: mean {round(np.mean(title_times), 2)}s, max {round(max(title_times), 2)}s')
+                    elif TABS_PER_BROWSER:
+                        with TabBrowser(TABS_PER_BROWSER) as browser:
+                            browser.map(save_award_file, title_ids_detail)
+                            browser.map(save_detail_file, title_ids_detail)
+                    else:
+                        with concurrent.futures.ThreadPoolExecutor() as executor:
+                            executor.map(save_award_file, title_ids_detail)
+                            executor.map(save_detail_file, title_ids_detail)
+
+                    t2 = datetime.now()
+                    duration = t2 - t1
+                    print(f'The {i+1}th batch took {round(duration.total_seconds(), 2)} seconds\n') 
+                    # Time spent classifying the pages (error, empty section, etc.) by page type
+                    print(f'Page classification: {classifier_stats.summary()}\n')
+                    # Bytes transferred and page-ready time by page type (compare with browser_profile.LEAN_PROFILE = False)
+                    print(f'Page load: {page_metrics.summary()}\n')
+                    print(f'Hedged fetches: {hedging_summary()}\n')
+                    # Browsers admitted by the free memory, waits and recycled browsers
+                    print(f'Memory: {get_memory_governor().summary()}\n')
+                    get_output_writer().flush()
+                    print(f'Writer: {get_output_writer().summary()}\n')
+                    break # to continue running for other chunks, comment this out 
+                else:
+                    print('No title has streaming option')
@@ -4,8 +4,10 @@ from datetime import date, timedelta, datetime
 import os
 import time
 import random
-from random_user_agent.user_agent import UserAgent
-from random_user_agent.params import SoftwareName, OperatingSystem
+from identity import get_identity_manager
+from browser_profile import new_driver
+from refresh_policy import refresh_policy
+from manifest import write_artifact
 import selenium
 from selenium import webdriver
 from selenium.webdriver.common.by import By
@@ -39,7 +41,7 @@ def check_recent_file(t, folder, directory):
     True if there is a recent file and False otherwise. '''
     
     today = date.today()
-    two_day_ago = today - timedelta(days=2) # adjust by need
+    two_day_ago = today - refresh_policy.ttl('justwatch') # adjust by need in refresh_policy.TTL_DAYS
     # Escape special characters in t
     escaped_t = re.escape(t)
     
@@ -94,20 +96,10 @@ def scrape_justwatch_href_selenium(replace_str='new', platform='netflix'):
        print('URLs already retrieved!')
        return
     
-    options = Options()
-    options.set_preference('intl.accept_languages', 'en-US')
-    options.binary_location = 'C:/Program Files/Mozilla Firefox/firefox.exe' # Replace with the path of Firebox!
-
-    # user agent
-    software_names = [SoftwareName.FIREFOX.value, SoftwareName.CHROME.value]
-    operating_sys = [OperatingSystem.WINDOWS.value, OperatingSystem.LINUX.value]
-    user_agent_rotator = UserAgent(software_names=software_names, operating_systems = operating_sys, limit=100)
-    user_agent = user_agent_rotator.get_random_user_agent()
-    options.add_argument('--user-agent={}'.format(user_agent))
-
-    PATH = 'C:/Users/zhang/Downloads/geckodriver-v0.36.0-win32/geckodriver.exe' # Replace with the path of geckodriver!
-    service = Service(executable_path=PATH)
-    driver = webdriver.Firefox(options=options, service=service)
+    # user agent (the pool is built once per process)
+    identity = get_identity_manager().next_identity()
+    # The content is loaded while scrolling, so keep the normal page load strategy
+    driver = new_driver(identity, page_load_strategy='normal')
     driver.maximize_window()
 
     base_url = 'https://www.justwatch.com'
@@ -168,24 +160,15 @@ def scrape_justwatch_content_change(replace_str, url):
     if not os.path.exists(subfolder_path):
         os.makedirs(subfolder_path)
 
-    if check_recent_file(platform, replace_str, subfolder_path):
+    # the manifest also knows the files appended to the Parquet store (see manifest.OUTPUT_BACKEND)
+    if check_recent_file(platform, replace_str, subfolder_path) or refresh_policy.is_fresh(platform, 'justwatch_' + replace_str):
        print(f'recent Justwatch {replace_str} file for {platform} exists')
        return
     
-    options = Options()
-    options.set_preference('intl.accept_languages', 'en-US')
-    options.binary_location = 'C:/Program Files/Mozilla Firefox/firefox.exe' # Replace with the path of Firefox!
-
-    # user agent
-    software_names = [SoftwareName.FIREFOX.value, SoftwareName.CHROME.value]
-    operating_sys = [OperatingSystem.WINDOWS.value, OperatingSystem.LINUX.value]
-    user_agent_rotator = UserAgent(software_names=software_names, operating_systems = operating_sys, limit=100)
-    user_agent = user_agent_rotator.get_random_user_agent()
-    options.add_argument('--user-agent={}'.format(user_agent))
-
-    PATH = 'C:/Users/zhang/Downloads/geckodriver-v0.36.0-win32/geckodriver.exe' # Replace with the path of geckodriver!
-    service = Service(executable_path=PATH)
-    driver = webdriver.Firefox(options=options, service=service)
+    # user agent (the pool is built once per process)
+    identity = get_identity_manager().next_identity()
+    # The content is loaded while scrolling, so keep the normal page load strategy
+    driver = new_driver(identity, page_load_strategy='normal')
     driver.maximize_window()
 
     driver.get(url) 
@@ -253,7 +236,7 @@ def scrape_justwatch_content_change(replace_str, url):
         df = pd.DataFrame({'date': dates, 'href': title_hrefs})
         output_file_name = platform + '_' + replace_str + '_' + str(date.today()) + '.csv'
         output_file_path = os.path.join(subfolder_path, output_file_name)
-        df.to_csv(output_file_path, index=False) 
+        write_artifact(df, output_file_path, platform, 'justwatch_' + replace_str)
         print(f'{replace_str} titles for {platform} saved at {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}\n')
     
     except Exception as e:
@@ -0,0 +1,104 @@
+import hashlib
+import math
+import threading
+
+
+
+BLOOM_FP_RATE = 0.001 # share of new titles wrongly taken as seen by the Bloom filter
+
+
+
+#################################################
+### Titles already processed in this run ###
+#################################################
+
+class SeenSet:
+
+    '''The exact set of the (stage, tconst) already processed in this run. Fine up to a few million titles.'''
+
+    def __init__(self):
+        self._seen = set()
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def add(self, stage, tconst):
+
+        '''Adds the title to the stage. Returns True if it is new, False if it was already there.'''
+
+        key = (stage, tconst)
+        with self._lock:
+            if key in self._seen:
+                self.dropped += 1
+                return False
+            self._seen.add(key)
+            return True
+
+    def __len__(self):
+        return len(self._seen)
+
+
+
+class BloomFilter:
+
+    '''
+    A Bloom filter of the (stage, tconst) already processed in this run, for catalogue-scale runs:
+    about 1.8 bytes per title at a false positive rate of 0.001, instead of about 100 bytes in a set.
+    A false positive drops a new title, which is picked up by the next run.
+
+    Params:
+    -------
+    capacity: int.
+      The expected number of titles (summed over the stages).
+
+    fp_rate: float.
+      The false positive rate at capacity.
+    '''
+
+    def __init__(self, capacity, fp_rate=BLOOM_FP_RATE):
+        self.bits = max(8, int(-capacity * math.log(fp_rate) / math.log(2)**2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self._array = bytearray((self.bits + 7) // 8)
+        self._lock = threading.Lock()
+        self._count = 0
+        self.dropped = 0
+
+    def _positions(self, key):
+        # double hashing: the k positions come from the two halves of one digest
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, stage, tconst):
+
+        '''Adds the title to the stage. Returns True if it is new, False if it was (probably) already there.'''
+
+        positions = self._positions(stage + '\t' + tconst)
+        with self._lock:
+            if all(self._array[p >> 3] & (1 << (p & 7)) for p in positions):
+                self.dropped += 1
+                return False
+            for p in positions:
+                self._array[p >> 3] |= 1 << (p & 7)
+            self._count += 1
+            return True
+
+    def __len__(self):
+        return self._count
+
+
+
+def new_seen_set(capacity=0, fp_rate=BLOOM_FP_RATE):
+
+    '''Returns an exact SeenSet if capacity is 0, otherwise a BloomFilter sized for capacity titles.'''
+
+    return BloomFilter(capacity, fp_rate) if capacity else SeenSet()
+
+
+def drop_seen(seen, stage, tconsts):
+
+    '''Yields the titles that were not seen yet in the stage (and marks them as seen), before any file is checked.'''
+
+    for t in tconsts:
+        if seen.add(stage, t):
+            yield t
@@ -0,0 +1,162 @@
+import sqlite3
+import threading
+from datetime import date
+from records import MainRow, CreditRow
+
+
+
+SINK_FILE = 'scraped.sqlite'
+
+# Columns of the main page rows (without the tconst) and of the company credit files
+MAIN_COLUMNS = list(MainRow.FIELDS[1:])
+CREDIT_COLUMNS = list(zip(CreditRow.COLUMNS, CreditRow.FIELDS))
+# Table of each artifact of the manifest: (table, key column, [(column of the data frame, column of the table)], extra columns)
+TABLES = {
+    'main': ('titles', 'tconst', [(c, c) for c in MAIN_COLUMNS], {}),
+    'gen': ('award_events', 'tconst', [('award_name', 'award_name'), ('award_id', 'award_id'), ('num_category', 'num_category')], {}),
+    'award': ('award_nominations', 'tconst', [('award', 'award'), ('nomination', 'nomination'), ('category', 'category'),
+                                              ('person', 'person'), ('person_id', 'person_id'), ('note', 'note'), ('note_id', 'note_id')], {}),
+    'release': ('releases', 'tconst', [('country', 'country'), ('rel_id', 'rel_id'), ('date', 'date'), ('location', 'location')], {}),
+    'pro': ('company_credits', 'tconst', CREDIT_COLUMNS, {'kind': 'production'}),
+    'distribution': ('company_credits', 'tconst', CREDIT_COLUMNS, {'kind': 'distribution'}),
+    'justwatch_new': ('justwatch_additions', 'platform', [('date', 'date'), ('href', 'href')], {}),
+}
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS titles (tconst TEXT NOT NULL, fetch_date TEXT NOT NULL, {main});
+    CREATE INDEX IF NOT EXISTS idx_titles ON titles (tconst, fetch_date);
+    CREATE TABLE IF NOT EXISTS award_events (tconst TEXT NOT NULL, fetch_date TEXT NOT NULL, award_name, award_id, num_category);
+    CREATE INDEX IF NOT EXISTS idx_award_events ON award_events (tconst, fetch_date);
+    CREATE INDEX IF NOT EXISTS idx_award_events_id ON award_events (award_id);
+    CREATE TABLE IF NOT EXISTS award_nominations (tconst TEXT NOT NULL, fetch_date TEXT NOT NULL,
+        award, nomination, category, person, person_id, note, note_id);
+    CREATE INDEX IF NOT EXISTS idx_award_nominations ON award_nominations (tconst, fetch_date);
+    CREATE INDEX IF NOT EXISTS idx_award_nominations_person ON award_nominations (person_id);
+    CREATE TABLE IF NOT EXISTS releases (tconst TEXT NOT NULL, fetch_date TEXT NOT NULL, country, rel_id, date, location);
+    CREATE INDEX IF NOT EXISTS idx_releases ON releases (tconst, fetch_date);
+    CREATE INDEX IF NOT EXISTS idx_releases_country ON releases (country);
+    CREATE TABLE IF NOT EXISTS company_credits (tconst TEXT NOT NULL, fetch_date TEXT NOT NULL, kind TEXT NOT NULL,
+        firm, firm_id, country_yr, note);
+    CREATE INDEX IF NOT EXISTS idx_company_credits ON company_credits (tconst, fetch_date, kind);
+    CREATE INDEX IF NOT EXISTS idx_company_credits_firm ON company_credits (firm_id);
+    CREATE TABLE IF NOT EXISTS justwatch_additions (platform TEXT NOT NULL, fetch_date TEXT NOT NULL, date, href);
+    CREATE INDEX IF NOT EXISTS idx_justwatch_additions ON justwatch_additions (platform, fetch_date);
+    CREATE INDEX IF NOT EXISTS idx_justwatch_additions_href ON justwatch_additions (href);
+'''.format(main=', '.join(MAIN_COLUMNS))
+
+
+
+##############################################
+### SQLite tables for the scraped entities ###
+##############################################
+
+class SQLiteSink:
+
+    '''
+    Stores the scraped rows in SQLite tables (titles, award events and nominations, releases, company credits and
+    JustWatch additions) instead of CSV files, with the common query keys indexed (tconst and fetch date, award, person,
+    country, firm, platform and href). The rows are buffered by append and inserted in bulk, in one transaction, by flush.
+    In WAL mode the data can be queried while the crawl writes. Scraping a title again on the same day replaces its rows.
+
+    Params:
+    -------
+    path: str.
+      The SQLite file.
+    '''
+
+    def __init__(self, path=SINK_FILE):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._buffer = [] # (artifact, keys, fetch date, rows)
+        self._conn().executescript(SCHEMA)
+
+
+    def _conn(self):
+        # One connection per thread, SQLite connections cannot be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+
+    def append(self, artifact, df, key=None):
+
+        '''Buffers the rows of the artifact (e.g., 'gen', 'release', 'main') of the title (or the platform for JustWatch).'''
+
+        table, key_column, columns, extra = TABLES[artifact]
+        df = df.astype(object).where(df.notna(), None)
+        if key_column in df.columns:
+            keys = df[key_column].tolist()
+        else:
+            keys = [key] * len(df)
+        rows = [tuple(str(v) if isinstance(v, (list, tuple, dict)) else v for v in row)
+                for row in df.reindex(columns=[c for c, _ in columns]).itertuples(index=False, name=None)]
+        with self._lock:
+            self._buffer.append((artifact, keys, str(date.today()), rows))
+
+
+    def flush(self):
+
+        '''Inserts the buffered rows in one transaction, replacing the rows of the same titles fetched the same day.'''
+
+        with self._lock:
+            buffer, self._buffer = self._buffer, []
+        if not buffer:
+            return 0
+        # the last rows win when a title was written twice since the last flush
+        buffer = list({(artifact, tuple(sorted(set(keys))), fetch_date): (artifact, keys, fetch_date, rows)
+                       for artifact, keys, fetch_date, rows in buffer}.values())
+        conn = self._conn()
+        inserted = 0
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            by_statement = {}
+            deletes = set()
+            for artifact, keys, fetch_date, rows in buffer:
+                table, key_column, columns, extra = TABLES[artifact]
+                names = [key_column, 'fetch_date'] + list(extra) + [c for _, c in columns]
+                where = ' AND '.join([f'{key_column} = ?', 'fetch_date = ?'] + [f'{c} = ?' for c in extra])
+                for k in set(keys):
+                    deletes.add((f'DELETE FROM {table} WHERE {where}', (k, fetch_date) + tuple(extra.values())))
+                sql = f'INSERT INTO {table} ({", ".join(names)}) VALUES ({", ".join("?" * len(names))})'
+                by_statement.setdefault(sql, []).extend((k, fetch_date) + tuple(extra.values()) + row for k, row in zip(keys, rows))
+            for sql, params in deletes:
+                conn.execute(sql, params)
+            for sql, params in by_statement.items():
+                conn.executemany(sql, params)
+                inserted += len(params)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            with self._lock:
+                # kept for the next flush
+                self._buffer[:0] = buffer
+            raise
+        return inserted
+
+
+    def query(self, sql, params=()):
+
+        '''Runs a read query, e.g., query('SELECT * FROM releases WHERE tconst = ?', ('tt0111161',)), and returns a DataFrame.'''
+
+        import pandas as pd
+        return pd.read_sql_query(sql, self._conn(), params=params)
+
+
+
+_sink = None
+_sink_lock = threading.Lock()
+
+def get_sqlite_sink():
+
+    '''Returns the SQLite sink of the process.'''
+
+    global _sink
+    with _sink_lock:
+        if _sink is None:
+            _sink = SQLiteSink()
+    return _sink
@@ -0,0 +1,252 @@
+import concurrent.futures
+import queue
+import threading
+import time
+from selenium.webdriver.remote.webdriver import WebDriver as RemoteWebDriver
+from selenium.webdriver.remote.command import Command
+from selenium.common.exceptions import TimeoutException, NoSuchElementException
+from driver_factory import get_driver_factory, release_driver
+from memory_governor import get_memory_governor
+
+
+
+# Marks the document a navigation started from, the new document does not have it
+NAV_START_SCRIPT = "window.__tabNavigating = true; window.location.href = arguments[0];"
+# Null while the new page is loading, then the milliseconds since it became interactive (domInteractive of the page timing)
+NAV_READY_SCRIPT = """
+if (window.__tabNavigating === true || document.readyState === 'loading') { return null; }
+var interactive = performance.timing.domInteractive;
+return interactive > 0 ? Math.max(0, Date.now() - interactive) : 0;
+"""
+
+# The commands an implicit wait applies to, polled outside the lock of the browser (see TabHandle.execute)
+FIND_COMMANDS = {Command.FIND_ELEMENT, Command.FIND_CHILD_ELEMENT}
+FIND_ALL_COMMANDS = {Command.FIND_ELEMENTS, Command.FIND_CHILD_ELEMENTS}
+IMPLICIT_WAIT_POLL = 0.1 # seconds between two searches of a missing element
+
+
+
+###################################################
+### A tab that can be used as a separate driver ###
+###################################################
+
+class TabHandle(RemoteWebDriver):
+
+    '''
+    One tab (window handle) of a TabBrowser, which can be passed to the scraping functions in place of a driver.
+    It shares the WebDriver session of the browser. Every command (including those of the elements found through the tab)
+    takes the lock of the browser and switches to the tab first, so several threads can drive the tabs of one browser.
+    Navigation does not hold the lock while the page loads: the url is set in the tab and the readiness is polled,
+    so other tabs can be scraped in the meantime. The implicit wait is polled the same way: a missing element is searched
+    again every IMPLICIT_WAIT_POLL seconds, with the lock released in between.
+
+    Params:
+    -------
+    browser: TabBrowser.
+      The browser the tab belongs to.
+
+    handle: str.
+      The window handle of the tab.
+    '''
+
+    def __init__(self, browser, handle):
+        # Share the session of the browser instead of starting a new one
+        self.__dict__.update(browser.driver.__dict__)
+        self.browser = browser
+        self.handle = handle
+        self.identity = browser.identity
+        self.pending_url = None # the url loading in the tab ahead of the scraper (see prefetch)
+        self.nav_started = None
+        self.ready_at = None # when the page became interactive (monotonic), even if it was ready before the scraper polled it
+        self.implicit_wait_s = 0
+
+
+    def _execute_in_tab(self, driver_command, params=None):
+        with self.browser.lock:
+            if self.browser.current_handle != self.handle:
+                RemoteWebDriver.execute(self.browser.driver, Command.SWITCH_TO_WINDOW, {'handle': self.handle})
+                self.browser.current_handle = self.handle
+            return RemoteWebDriver.execute(self, driver_command, params)
+
+
+    def execute(self, driver_command, params=None):
+        if not self.implicit_wait_s or driver_command not in FIND_COMMANDS | FIND_ALL_COMMANDS:
+            return self._execute_in_tab(driver_command, params)
+        # the implicit wait of the tab: the search is repeated until an element is found or the wait is over
+        end = time.monotonic() + self.implicit_wait_s
+        while True:
+            try:
+                response = self._execute_in_tab(driver_command, params)
+                if driver_command in FIND_COMMANDS or response.get('value') or time.monotonic() >= end:
+                    return response
+            except NoSuchElementException:
+                if time.monotonic() >= end:
+                    raise
+            time.sleep(IMPLICIT_WAIT_POLL)
+
+
+    def start_navigation(self, url):
+
+        '''Starts loading the url in the tab and returns at once. A later get of the same url only waits for it.'''
+
+        self.pending_url = url
+        self.nav_started = time.monotonic()
+        self.ready_at = None
+        self.execute_script(NAV_START_SCRIPT, url)
+
+
+    def wait_until_ready(self, timeout=60, poll=0.1):
+
+        '''
+        Waits (without holding the lock of the browser) until the new page is interactive, like the 'eager' strategy.
+        ready_at is set from the page timing, i.e., when the load completed and not when it was polled (a prefetched page may have waited).
+        '''
+
+        end = time.monotonic() + timeout
+        while time.monotonic() < end:
+            try:
+                since_ready_ms = self.execute_script(NAV_READY_SCRIPT)
+                if since_ready_ms is not None:
+                    now = time.monotonic()
+                    self.ready_at = now - since_ready_ms / 1000
+                    if self.nav_started is not None:
+                        self.ready_at = min(max(self.ready_at, self.nav_started), now)
+                    return
+            except Exception:
+                # the document is being replaced
+                pass
+            time.sleep(poll)
+        raise TimeoutException(f'Tab {self.handle} did not load in {timeout}s')
+
+
+    def get(self, url):
+        if url != self.pending_url:
+            self.start_navigation(url)
+        self.pending_url = None
+        self.wait_until_ready()
+
+
+    def refresh(self):
+        self.get(self.current_url)
+
+
+    def implicitly_wait(self, time_to_wait):
+        # The wait of the browser would hold its lock while an element is missing, so it stays 0 and the tab polls instead
+        self.implicit_wait_s = time_to_wait
+
+
+    def close(self):
+        # The tab goes back to the browser, which is closed as a whole by TabBrowser.close
+        pass
+
+
+    def quit(self):
+        pass
+
+
+
+###############################################
+### One browser driving several tabs at once ###
+###############################################
+
+class TabBrowser:
+
+    '''
+    One Firefox instance (from the driver factory) with several tabs that are scraped concurrently,
+    so more pages are in flight for the same memory than with one browser per thread.
+    When the browser grows past the recycle size of the memory governor, no tab is handed out until all tabs are back,
+    and the browser is then replaced by a fresh one with new tabs.
+
+    Params:
+    -------
+    tabs: int.
+      The number of tabs.
+
+    Usage:
+    ------
+    with TabBrowser(4) as browser:
+        results = browser.map(scrape_view, tconsts)
+    '''
+
+    def __init__(self, tabs=4):
+        self.tabs = tabs
+        self.lock = threading.RLock()
+        self._cond = threading.Condition()
+        self._in_use = 0 # tabs handed out or waited for
+        self._recycle = False
+        self._open()
+
+
+    def _open(self):
+        self.driver, self.identity = get_driver_factory().get()
+        self.driver.implicitly_wait(0)
+
+        handles = [self.driver.current_window_handle]
+        for _ in range(self.tabs - 1):
+            self.driver.switch_to.new_window('tab')
+            handles.append(self.driver.current_window_handle)
+        self.driver.switch_to.window(handles[0])
+        self.current_handle = handles[0]
+
+        self.free_tabs = queue.Queue()
+        for h in handles:
+            self.free_tabs.put(TabHandle(self, h))
+
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    def acquire(self):
+
+        '''Returns a free tab, waiting for one if all are in use (or until the browser is replaced).'''
+
+        with self._cond:
+            while self._recycle:
+                self._cond.wait()
+            self._in_use += 1
+            free_tabs = self.free_tabs
+        return free_tabs.get()
+
+
+    def release(self, tab):
+
+        '''Gives the tab back. Between two pages, checks whether the browser should be recycled (see memory_governor).'''
+
+        self.free_tabs.put(tab)
+        with self._cond:
+            self._in_use -= 1
+            if not self._recycle and get_memory_governor().should_recycle(self.driver):
+                print(f'Browser of {self.tabs} tabs past the recycle size, replaced once its tabs are back', flush=True)
+                self._recycle = True
+            if self._recycle and self._in_use == 0:
+                release_driver(self.driver)
+                self._open()
+                self._recycle = False
+                self._cond.notify_all()
+
+
+    def run(self, func, item):
+
+        '''Runs func(item, driver=tab, identity=identity) on a free tab and gives the tab back afterwards.'''
+
+        tab = self.acquire()
+        try:
+            return func(item, driver=tab, identity=self.identity)
+        finally:
+            self.release(tab)
+
+
+    def map(self, func, items):
+
+        '''Runs func on every item, one tab per item at a time. Returns the results in the order of the items.'''
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.tabs) as executor:
+            return list(executor.map(lambda x: self.run(func, x), items))
+
+
+    def close(self):
+        release_driver(self.driver)
@@ -0,0 +1,40 @@
+import pandas as pd
+
+from compact_outputs import normalise_placeholders
+from records import ReleaseRow
+
+
+def frame(rows, columns):
+    df = pd.DataFrame(rows, columns=['tconst'] + columns)
+    df['fetch_date'] = '2026-10-01'
+    return df
+
+
+def test_release_placeholder_rows():
+    columns = list(ReleaseRow.COLUMNS)
+    df = frame([['tt1', *ReleaseRow.not_found().values()],
+                ['tt2', *ReleaseRow.empty().values()],
+                ['tt3', 'USA', 'rl1', '2025-01-01', None],
+                # a real value that happens to be a placeholder is kept
+                ['tt4', 'NoInfo', 'rl2', '2025-01-01', 'Cannes']],
+               columns)
+    out = normalise_placeholders(df, 'release')
+    assert list(out['status']) == ['404', 'empty', 'ok', 'ok']
+    assert out.loc[:1, columns].isna().all().all()
+    assert out.loc[3, 'country'] == 'NoInfo'
+
+
+def test_award_gen_without_award_has_0_categories():
+    df = frame([['tt1', None, None, '0'], ['tt2', 'Oscar', 'ev1', '0']], ['award_name', 'award_id', 'num_category'])
+    assert list(normalise_placeholders(df, 'awards_gen')['status']) == ['empty', 'ok']
+
+
+def test_main_rows_keep_the_page_without_watching_option():
+    columns = ['theater', 'price', 'season', 'streaming_provider', 'rent_provider', 'num_watchlist']
+    df = frame([['tt1', '404', '404', '404', '404', '404', '1.2K'],
+                ['tt2', '404', '404', '404', '404', '404', '404'],
+                ['tt3', None, None, None, 'Netflix', None, '5K']], columns)
+    out = normalise_placeholders(df, 'main')
+    assert list(out['status']) == ['404', '404', 'ok']
+    assert out.loc[0, 'num_watchlist'] == '1.2K' and out.loc[0, columns[:5]].isna().all()
+    assert out.loc[1, columns].isna().all()
@@ -0,0 +1,69 @@
+import pytest
+
+pytest.importorskip('selenium')
+import hedging
+from tab_mux import NAV_START_SCRIPT, NAV_READY_SCRIPT
+
+
+class FakeDriver:
+
+    '''Answers the navigation scripts: ready after ready_after polls (None before, like a loading page).'''
+
+    def __init__(self, ready_after):
+        self.ready_after = ready_after
+        self.polls = 0
+        self.started = None
+
+    def execute_script(self, script, *args):
+        if script == NAV_START_SCRIPT:
+            self.started = args[0]
+        elif script == NAV_READY_SCRIPT:
+            self.polls += 1
+            return 0 if self.polls > self.ready_after else None
+
+
+class FakeFactory:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def get(self):
+        return self.driver, 'backup-identity'
+
+
+class FakeGovernor:
+    def has_headroom(self):
+        return True
+
+
+@pytest.fixture
+def tracker(monkeypatch):
+    tracker = hedging.LoadTimeTracker()
+    for _ in range(hedging.MIN_SAMPLES):
+        tracker.record('main', 0.0)
+    monkeypatch.setattr(hedging, 'load_times', tracker)
+    monkeypatch.setattr(hedging, 'get_memory_governor', lambda: FakeGovernor())
+    released = []
+    monkeypatch.setattr(hedging, 'release_driver', released.append)
+    return tracker, released
+
+
+def test_slow_page_is_hedged_and_the_spare_wins(tracker, monkeypatch):
+    tracker, released = tracker
+    slow, spare = FakeDriver(ready_after=10**6), FakeDriver(ready_after=0)
+    monkeypatch.setattr(hedging, 'get_driver_factory', lambda: FakeFactory(spare))
+
+    driver, identity = hedging.hedged_get(slow, 'identity', 'https://www.imdb.com/title/tt0000001/', 'main', poll=0.001)
+
+    assert (driver, identity) == (spare, 'backup-identity')
+    assert spare.started == 'https://www.imdb.com/title/tt0000001/'
+    assert released == [slow]
+    assert tracker.counts['main'] == {'fetches': 1, 'hedged': 1, 'hedge_won': 1}
+
+
+def test_page_ready_at_0_ms_is_not_hedged(tracker, monkeypatch):
+    tracker, released = tracker
+    fast = FakeDriver(ready_after=0)
+    monkeypatch.setattr(hedging, 'get_driver_factory', lambda: pytest.fail('no spare driver for a ready page'))
+
+    assert hedging.hedged_get(fast, 'identity', 'https://www.imdb.com/', 'main', poll=0.001) == (fast, 'identity')
+    assert tracker.counts['main']['hedged'] == 0
@@ -0,0 +1,48 @@
+import os
+
+import pandas as pd
+import pytest
+
+import manifest
+from manifest import Manifest, content_hash, store_artifact
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(manifest, 'OUTPUT_BACKEND', 'csv')
+    monkeypatch.setattr(manifest, '_manifest', Manifest(str(tmp_path / 'manifest.sqlite')))
+    return manifest._manifest
+
+
+def test_content_hash_ignores_row_order_and_spaces():
+    df = pd.DataFrame({'country': ['USA', 'France'], 'rel_id': ['rl1', None]})
+    same = pd.DataFrame({'country': ['France ', 'USA'], 'rel_id': [None, 'rl1']})
+    assert content_hash(df) == content_hash(same)
+    assert content_hash(df) != content_hash(df.rename(columns={'rel_id': 'id'}))
+
+
+def test_unchanged_output_is_not_written_again(tmp_path, store):
+    df = pd.DataFrame({'country': ['USA'], 'date': ['2025-01-01']})
+    first = str(tmp_path / 'tt1_release_2026-10-01.csv')
+    assert store_artifact(df, first, 'tt1', 'release', digest=content_hash(df)) == first
+    store.record('tt1', 'release', first, 1, '2026-10-01', content_hash(df))
+
+    # the same content read back from the file
+    again = pd.read_csv(first, dtype=str)
+    second = str(tmp_path / 'tt1_release_2026-10-19.csv')
+    assert store_artifact(again, second, 'tt1', 'release', digest=content_hash(again)) is None
+    assert not os.path.exists(second)
+    store.record_many([('tt1', 'release', None, 1, content_hash(again))])
+    assert store._conn().execute('SELECT fetch_date, last_verified != fetch_date FROM artifacts').fetchall() == [('2026-10-01', 1)]
+
+    changed = df.assign(date='2025-02-01')
+    assert store_artifact(changed, second, 'tt1', 'release', digest=content_hash(changed)) == second
+
+
+def test_hash_of_a_file_indexed_before_the_hashes(tmp_path, store):
+    df = pd.DataFrame({'country': ['USA']})
+    path = str(tmp_path / 'tt1_release_2026-10-01.csv')
+    df.to_csv(path, index=False)
+    store.record('tt1', 'release', path, 1, '2026-10-01')
+    assert store.latest_hash('tt1', 'release') == content_hash(df)
@@ -0,0 +1,35 @@
+from metrics_store import MetricsStore
+
+
+def test_observe_stores_changes_with_their_deltas(tmp_path):
+    store = MetricsStore(str(tmp_path / 'metrics.sqlite'))
+    assert store.observe({'tconst': ['tt1'], 'num_watchlist': ['1.2K'], 'streaming_provider': ['Netflix']}, '2026-10-01') == 2
+    # unchanged: only the last_seen date moves
+    assert store.observe({'tconst': ['tt1'], 'num_watchlist': ['1.2K'], 'streaming_provider': ['Netflix']}, '2026-10-02') == 0
+    assert store.observe({'tconst': ['tt1'], 'num_watchlist': ['1.5K'], 'streaming_provider': ['Netflix']}, '2026-10-03') == 1
+
+    series = store.series('tt1', 'num_watchlist')
+    assert list(series['obs_date']) == ['2026-10-01', '2026-10-03']
+    assert list(series['num']) == [1200.0, 1500.0]
+    assert series['delta'].isna().iloc[0] and series['delta'].iloc[1] == 300.0
+    assert store._conn().execute("SELECT last_seen FROM latest WHERE metric = 'streaming_provider'").fetchone() == ('2026-10-03',)
+
+
+def test_older_and_missing_observations_are_ignored(tmp_path):
+    store = MetricsStore(str(tmp_path / 'metrics.sqlite'))
+    store.observe({'tconst': ['tt1'], 'num_review': ['20'], 'streaming_provider': ['Netflix']}, '2026-10-05')
+    assert store.observe({'tconst': ['tt1'], 'num_review': ['10']}, '2026-10-01') == 0
+    # a page that did not load has no count, its missing provider is not a change
+    assert store.observe({'tconst': ['tt1'], 'num_review': [None], 'streaming_provider': [None]}, '2026-10-06') == 0
+    # a page that loaded without the provider: the title left the platform
+    assert store.observe({'tconst': ['tt1'], 'num_review': ['20'], 'streaming_provider': [None]}, '2026-10-07') == 1
+    assert store.values_at('streaming_provider', '2026-10-07')['value'].isna().all()
+    assert store.values_at('streaming_provider', '2026-10-06')['value'].tolist() == ['Netflix']
+
+
+def test_growth_over_a_period(tmp_path):
+    store = MetricsStore(str(tmp_path / 'metrics.sqlite'))
+    store.observe({'tconst': ['tt1', 'tt2'], 'num_watchlist': ['100', '1K']}, '2026-07-01')
+    store.observe({'tconst': ['tt1', 'tt2'], 'num_watchlist': ['900', '1.1K']}, '2026-10-01')
+    growth = store.growth('num_watchlist', days=90, end='2026-10-01')
+    assert growth[['tconst', 'growth']].values.tolist() == [['tt1', 800.0], ['tt2', 100.0]]
@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+
+from numeric_parse import parse_count, parse_counts, parse_money
+
+
+def test_parse_counts():
+    s = pd.Series(['1.2K', '3M', '12,345', '99+', ' 87 ', '.5K', None, '0', 'NoInfo', '1.2K'], name='num_review')
+    expected = [1200.0, 3e6, 12345.0, 99.0, 87.0, 500.0, np.nan, 0.0, np.nan, 1200.0]
+    np.testing.assert_array_equal(parse_counts(s).to_numpy(), expected)
+    assert parse_counts(s).name == 'num_review'
+    assert [parse_count(v) for v in ['1.2K', None, 'NoInfo']] == [1200.0, None, None]
+
+
+def test_parse_counts_of_missing_values_only():
+    s = pd.Series([None, None], index=[5, 7], dtype=object)
+    out = parse_counts(s)
+    assert list(out.index) == [5, 7] and out.isna().all()
+
+
+def test_parse_money():
+    s = pd.Series(['$12,345,678 (estimated)', 'CA$1,000,000; Jul 21, 2023', '€5,000,000', '₹ 2,000,000,000', 'XY$10', None, 'NoInfo'],
+                  name='budget')
+    out = parse_money(s)
+    assert list(out.columns) == ['budget_amount', 'budget_currency', 'budget_estimated']
+    np.testing.assert_array_equal(out['budget_amount'].to_numpy(), [12345678.0, 1e6, 5e6, 2e9, 10.0, np.nan, np.nan])
+    assert out['budget_currency'].tolist()[:5] == ['USD', 'CAD', 'EUR', 'INR', 'XY$']
+    assert out['budget_currency'].isna().tolist()[5:] == [True, True]
+    assert out['budget_estimated'].tolist() == [True, False, False, False, False, pd.NA, pd.NA]
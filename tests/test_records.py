@@ -0,0 +1,13 @@
+from records import MainRow, ReleaseRow
+
+
+def test_main_not_found_keeps_the_tconst():
+    row = MainRow.not_found('tt0000001')
+    assert row.tconst == 'tt0000001' and row.is_not_found()
+    assert ReleaseRow.not_found().values() == ('404',) * len(ReleaseRow.FIELDS)
+
+
+def test_main_row_without_watching_option_is_not_a_404():
+    # scrape_view puts '404' in the watching fields only when the title has no watching option
+    row = MainRow('tt0000001', '404', '404', '404', '404', '404', '1.2K')
+    assert not row.is_not_found()
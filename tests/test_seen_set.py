@@ -0,0 +1,21 @@
+from seen_set import BloomFilter, SeenSet, drop_seen, new_seen_set
+
+
+def test_bloom_filter_false_positive_rate():
+    capacity, fp_rate = 20000, 0.01
+    seen = BloomFilter(capacity, fp_rate)
+    for i in range(capacity):
+        seen.add('main', f'tt{i:08d}')
+    # every added title is seen, and the new ones are wrongly seen at about the false positive rate
+    assert not any(seen.add('main', f'tt{i:08d}') for i in range(capacity))
+    # (the probes are added too, a few of them keep the filter close to its capacity)
+    probes = capacity // 10
+    false_positives = sum(not seen.add('main', f'tt{i:08d}') for i in range(capacity, capacity + probes))
+    assert false_positives / probes < 2 * fp_rate
+
+
+def test_stages_are_separate():
+    for seen in [SeenSet(), new_seen_set(1000, 0.001)]:
+        assert list(drop_seen(seen, 'main', ['tt1', 'tt2', 'tt1'])) == ['tt1', 'tt2']
+        assert list(drop_seen(seen, 'subpages', ['tt1'])) == ['tt1']
+        assert seen.dropped == 1
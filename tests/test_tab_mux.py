@@ -0,0 +1,64 @@
+import pytest
+
+pytest.importorskip('selenium')
+import tab_mux
+
+
+class FakeSwitch:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def new_window(self, kind):
+        self.driver.handles.append(f'{self.driver.name}-{len(self.driver.handles)}')
+        self.driver.current_window_handle = self.driver.handles[-1]
+
+    def window(self, handle):
+        self.driver.current_window_handle = handle
+
+
+class FakeDriver:
+    def __init__(self, name):
+        self.name = name
+        self.handles = [f'{name}-0']
+        self.current_window_handle = self.handles[0]
+        self.switch_to = FakeSwitch(self)
+
+    def implicitly_wait(self, seconds):
+        pass
+
+
+class FakeFactory:
+    def __init__(self):
+        self.launched = 0
+
+    def get(self):
+        self.launched += 1
+        return FakeDriver(f'browser{self.launched}'), 'identity'
+
+
+class FakeGovernor:
+    def __init__(self, oversized):
+        self.oversized = oversized
+
+    def should_recycle(self, driver):
+        return driver.name in self.oversized
+
+
+def test_oversized_browser_is_replaced_once_its_tabs_are_back(monkeypatch):
+    factory, governor, released = FakeFactory(), FakeGovernor({'browser1'}), []
+    monkeypatch.setattr(tab_mux, 'get_driver_factory', lambda: factory)
+    monkeypatch.setattr(tab_mux, 'get_memory_governor', lambda: governor)
+    monkeypatch.setattr(tab_mux, 'release_driver', lambda d: released.append(d.name))
+
+    browser = tab_mux.TabBrowser(2)
+    first, second = browser.acquire(), browser.acquire()
+    browser.release(first)
+    # the other tab is still in use, the browser stays
+    assert browser.driver.name == 'browser1' and released == []
+    browser.release(second)
+    assert browser.driver.name == 'browser2' and released == ['browser1']
+
+    tab = browser.acquire()
+    assert tab.browser is browser and tab.handle.startswith('browser2')
+    browser.release(tab)
+    assert browser.driver.name == 'browser2'
@@ -0,0 +1,88 @@
+import socket
+import sqlite3
+
+import work_queue
+from work_queue import WorkQueue, DONE, PENDING
+
+
+def test_claims_follow_the_priority(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'))
+    queue.add(['tt1', 'tt2', 'tt3'], 'main', {'tt1': 1.0, 'tt2': 5.0, 'tt3': 3.0})
+    assert queue.claim('main', 2) == ['tt2', 'tt3']
+    assert queue.claim('main', 2) == ['tt1']
+
+
+def test_add_and_refresh_update_the_priority(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'))
+    queue.add(['tt1', 'tt2', 'tt3'], 'main', {'tt1': 1.0, 'tt2': 2.0, 'tt3': 3.0})
+    queue.done('tt3', 'main')
+    # a pending task takes the new priority, a done one comes back with it only when refreshed
+    queue.add(['tt1', 'tt3'], 'main', {'tt1': 9.0, 'tt3': 8.0})
+    assert queue.status('tt3', 'main')[0] == DONE
+    assert queue.refresh(['tt3'], 'main', lambda t: True, {'tt3': 10.0}) == 1
+    assert queue.claim('main', 3) == ['tt3', 'tt1', 'tt2']
+
+
+def test_iter_claims_stops_at_the_limit(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'))
+    queue.add([f'tt{i}' for i in range(10)], 'main', {f'tt{i}': i for i in range(10)})
+    assert list(queue.iter_claims('main', batch=3, limit=4)) == ['tt9', 'tt8', 'tt7', 'tt6']
+    assert queue.counts()['main'] == {'in_progress': 4, PENDING: 6}
+
+
+def test_queue_without_priorities_is_upgraded(tmp_path):
+    path = str(tmp_path / 'queue.sqlite')
+    conn = sqlite3.connect(path)
+    conn.execute('''CREATE TABLE tasks (tconst TEXT NOT NULL, stage TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'pending',
+                    lease_owner TEXT, lease_until REAL, attempts INTEGER NOT NULL DEFAULT 0, reason TEXT, updated_at REAL,
+                    PRIMARY KEY (tconst, stage))''')
+    conn.execute("INSERT INTO tasks (tconst, stage) VALUES ('tt1', 'main')")
+    conn.commit()
+    conn.close()
+
+    queue = WorkQueue(path)
+    queue.add(['tt2'], 'main', {'tt2': 1.0})
+    assert queue.claim('main', 2) == ['tt2', 'tt1']
+
+
+def test_expired_lease_is_claimed_again(tmp_path):
+    path = str(tmp_path / 'queue.sqlite')
+    first, second = WorkQueue(path, lease_seconds=-1), WorkQueue(path)
+    first.add(['tt1'], 'main')
+    assert first.claim('main') == ['tt1']
+    assert second.claim('main') == ['tt1']
+    assert second.status('tt1', 'main')[:2] == ('in_progress', 2)
+
+
+def test_failed_task_is_retried_until_max_attempts(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'), max_attempts=2)
+    queue.add(['tt1'], 'main')
+    for _ in range(2):
+        assert queue.claim('main') == ['tt1']
+        queue.fail('tt1', 'main', 'TimeoutException')
+    assert queue.claim('main') == []
+    assert queue.status('tt1', 'main') == ('failed', 2, 'TimeoutException')
+
+
+def test_leases_of_dead_processes_are_released(tmp_path, monkeypatch):
+    path = str(tmp_path / 'queue.sqlite')
+    dead, alive, me = WorkQueue(path), WorkQueue(path), WorkQueue(path)
+    dead.owner, alive.owner = f'{socket.gethostname()}:111', f'{socket.gethostname()}:222'
+    me.add(['tt1', 'tt2', 'tt3'], 'main')
+    dead.claim_titles(['tt1'], ['main'])
+    alive.claim_titles(['tt2'], ['main'])
+    me.claim_titles(['tt3'], ['main'])
+    monkeypatch.setattr(work_queue, 'process_running', lambda pid: pid != 111)
+
+    assert me.release_dead_leases() == 1
+    assert [me.status(t, 'main')[0] for t in ['tt1', 'tt2', 'tt3']] == [PENDING, 'in_progress', 'in_progress']
+
+
+def test_refresh_puts_back_only_stale_done_tasks(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'))
+    queue.add(['tt1', 'tt2', 'tt3'], 'main')
+    queue.claim('main', 3)
+    queue.done('tt1', 'main')
+    queue.done('tt2', 'main')
+    assert queue.refresh(['tt1', 'tt2', 'tt3'], 'main', lambda t: t != 'tt2') == 1
+    assert [queue.status(t, 'main')[0] for t in ['tt1', 'tt2', 'tt3']] == [PENDING, DONE, 'in_progress']
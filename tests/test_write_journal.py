@@ -0,0 +1,68 @@
+import os
+import socket
+
+import pytest
+
+import manifest
+import work_queue
+from manifest import Manifest
+from work_queue import WorkQueue, PENDING
+from write_journal import WriteJournal, repair_tail
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(manifest, '_manifest', Manifest(str(tmp_path / 'manifest.sqlite')))
+    # the process 111 of this host was killed
+    monkeypatch.setattr(work_queue, 'process_running', lambda pid: pid != 111)
+    return manifest._manifest
+
+
+def begin_dead(journal, *args):
+    # an entry left on 2026-10-01 by the killed process
+    journal_id = journal.begin(*args)
+    journal._conn().execute('UPDATE journal SET owner = ?, fetch_date = ? WHERE id = ?', (f'{socket.gethostname()}:111', '2026-10-01', journal_id))
+    return journal_id
+
+
+def test_recover_cleans_up_and_requeues_the_outputs_of_dead_runs(tmp_path, store):
+    os.makedirs('Release')
+    os.makedirs('Main')
+    release = os.path.join('Release', 'tt1_release_2026-10-01.csv')
+    with open(release + '.111.1.tmp', 'w') as f:
+        f.write('country,rel_id')
+    stream = os.path.join('Main', 'main_stream_2026-10-01.csv')
+    with open(stream, 'w', newline='') as f:
+        f.write('tconst,theater\ntt2,\ntt3,Reg')
+    store.record('tt1', 'release', release, 1, '2026-10-01')
+    store.record('tt2', 'main', stream, 1, '2026-10-01')
+    journal = WriteJournal(str(tmp_path / 'journal.sqlite'))
+    begin_dead(journal, 'tt1', 'release', release)
+    begin_dead(journal, 'tt3', 'main', stream, True)
+    # an output of this (running) process is being written
+    journal.begin('tt4', 'main', stream, True)
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'))
+    queue.add(['tt1', 'tt3'], 'main')
+    queue.done('tt3', 'main')
+
+    recovered = journal.recover(queue, {'main': 'main', 'release': 'subpages'})
+
+    assert sorted(recovered) == [('tt1', 'release'), ('tt3', 'main')]
+    assert os.listdir('Release') == []
+    with open(stream) as f:
+        assert f.read() == 'tconst,theater\ntt2,\n'
+    assert store.latest('tt1', 'release') is None and store.latest('tt2', 'main') is not None
+    assert queue.status('tt1', 'subpages')[0] == PENDING and queue.status('tt3', 'main')[0] == PENDING
+    assert [e[1] for e in journal._conn().execute('SELECT * FROM journal')] == ['tt4']
+    assert journal.recover(queue, {}) == []
+
+
+def test_repair_tail_keeps_complete_lines(tmp_path):
+    path = str(tmp_path / 'main.csv')
+    with open(path, 'wb') as f:
+        f.write(b'a,b\r\n1,2\r\n3,')
+    assert repair_tail(path) == 2
+    assert repair_tail(path) == 0
+    with open(path, 'rb') as f:
+        assert f.read() == b'a,b\r\n1,2\r\n'
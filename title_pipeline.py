@@ -0,0 +1,212 @@
+import queue
+import threading
+import time
+
+
+
+_DONE = object() # sentinel closing a stage
+
+
+
+##########################################
+### A stage with its own queue/workers ###
+##########################################
+
+class Stage:
+
+    '''
+    One stage of the pipeline: a bounded input queue and its own worker threads.
+    Each worker takes an item, runs func on it and forwards the result to the next stages,
+    unless the result is None (e.g., the title is dropped by a gate).
+
+    Params:
+    -------
+    name: str.
+      The name shown in the report.
+
+    func: function.
+      Takes an item and returns the item for the next stages or None.
+
+    workers: int.
+      The number of worker threads.
+
+    maxsize: int.
+      The size of the input queue. A full queue blocks the previous stage (back pressure).
+    '''
+
+    def __init__(self, name, func, workers=1, maxsize=20):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.outputs = []
+        self._lock = threading.Lock()
+        self._finished = 0
+        self._threads = []
+        self.processed = 0
+        self.forwarded = 0
+        self.failed = 0
+        self.busy_s = 0.0
+        self.max_depth = 0
+
+
+    def then(self, *stages):
+
+        '''Forwards the results to the given stages (all of them, e.g., awards and details). Returns self.'''
+
+        self.outputs.extend(stages)
+        return self
+
+
+    def put(self, item):
+        self.queue.put(item)
+        depth = self.queue.qsize()
+        with self._lock:
+            self.max_depth = max(self.max_depth, depth)
+
+
+    def start(self):
+        for _ in range(self.workers):
+            t = threading.Thread(target=self._work, daemon=True)
+            t.start()
+            self._threads.append(t)
+
+
+    def close(self):
+
+        '''Tells the workers that no more items come. The next stages are closed once all workers are done.'''
+
+        for _ in range(self.workers):
+            self.queue.put(_DONE)
+
+
+    def join(self):
+        for t in self._threads:
+            t.join()
+
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is _DONE:
+                break
+            t1 = time.monotonic()
+            try:
+                result = self.func(item)
+            except Exception as e:
+                print(f'Stage {self.name} failed on {item}: {e}', flush=True)
+                result = None
+                with self._lock:
+                    self.failed += 1
+            with self._lock:
+                self.processed += 1
+                self.busy_s += time.monotonic() - t1
+            if result is not None:
+                with self._lock:
+                    self.forwarded += 1
+                for stage in self.outputs:
+                    stage.put(result)
+
+        with self._lock:
+            self._finished += 1
+            last = self._finished == self.workers
+        if last:
+            for stage in self.outputs:
+                stage.close()
+
+
+
+##########################################
+### The pipeline of stages and reports ###
+##########################################
+
+class Pipeline:
+
+    '''
+    Runs the stages concurrently: each item flows through the stages on its own,
+    so a slow item only holds one worker of one stage instead of the whole batch.
+
+    Params:
+    -------
+    first: Stage.
+      The stage the items are fed to.
+
+    stages: list.
+      All stages (including the first), in the order of the report.
+
+    report_every: int.
+      Seconds between two reports of the throughput and queue depth by stage. 0 for no periodic report.
+
+    Usage:
+    ------
+    main = Stage('main', scrape_main, workers=4)
+    gate = Stage('gate', check_streaming)
+    details = Stage('details', save_detail, workers=2)
+    main.then(gate)
+    gate.then(details)
+    with Pipeline(main, [main, gate, details]) as pipeline:
+        for t in tconsts:
+            pipeline.put(t)
+    '''
+
+    def __init__(self, first, stages, report_every=60):
+        self.first = first
+        self.stages = stages
+        self.report_every = report_every
+        self._stop = threading.Event()
+        self._t1 = None
+
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.finish()
+
+
+    def start(self):
+        self._t1 = time.monotonic()
+        for stage in self.stages:
+            stage.start()
+        if self.report_every:
+            threading.Thread(target=self._report_loop, daemon=True).start()
+
+
+    def put(self, item):
+
+        '''Feeds an item to the first stage, waiting while its queue is full.'''
+
+        self.first.put(item)
+
+
+    def finish(self):
+
+        '''Closes the first stage, waits for all stages to drain and prints the final report.'''
+
+        self.first.close()
+        for stage in self.stages:
+            stage.join()
+        self._stop.set()
+        print(f'Pipeline done: {self.report()}', flush=True)
+
+
+    def report(self):
+
+        '''Returns by stage: the items processed, forwarded and failed, the throughput (items per minute),
+        the mean seconds per item, and the current and maximum queue depth.'''
+
+        elapsed = max(time.monotonic() - self._t1, 1e-9)
+        report = {}
+        for stage in self.stages:
+            with stage._lock:
+                report[stage.name] = {'processed': stage.processed, 'forwarded': stage.forwarded, 'failed': stage.failed,
+                                      'per_min': round(stage.processed / elapsed * 60, 2),
+                                      'mean_s': round(stage.busy_s / stage.processed, 2) if stage.processed else None,
+                                      'queue': stage.queue.qsize(), 'max_queue': stage.max_depth}
+        return report
+
+
+    def _report_loop(self):
+        while not self._stop.wait(self.report_every):
+            print(f'Pipeline: {self.report()}', flush=True)
@@ -0,0 +1,357 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+
+
+WORK_QUEUE_FILE = 'work_queue.sqlite'
+LEASE_SECONDS = 1800 # a task in progress is given to another worker when its lease runs out
+MAX_ATTEMPTS = 3 # failed tasks are retried until this number of attempts
+
+# Status of a task
+PENDING = 'pending'
+IN_PROGRESS = 'in_progress'
+DONE = 'done'
+FAILED = 'failed'
+
+
+
+def process_running(pid):
+
+    '''
+    Whether the process pid is running on this host (with psutil if installed, otherwise with signal 0).
+    Without psutil on Windows, where os.kill(pid, 0) would send CTRL_C_EVENT, the process is taken as running.
+    '''
+
+    try:
+        # imported here since psutil is optional for the offline tools
+        import psutil
+        return psutil.pid_exists(pid)
+    except ImportError:
+        pass
+    if os.name == 'nt':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # running under another user
+        return True
+    return True
+
+
+def owner_is_dead(owner):
+
+    '''Whether the owner (host:pid) of a lease or a journal entry is a process of this host that is no longer running.'''
+
+    host, _, pid = (owner or '').rpartition(':')
+    return host == socket.gethostname() and pid.isdigit() and not process_running(int(pid))
+
+
+
+############################################
+### Durable work queue backed by SQLite ###
+############################################
+
+class WorkQueue:
+
+    '''
+    A local work queue that keeps the status of each title by stage (pending, in progress with a lease, done, failed with the reason)
+    in a SQLite file, so a restarted run resumes where it left off instead of checking all titles against the output folders again.
+    Several threads and processes can claim tasks from the same file: a claim is one write transaction,
+    and a task whose lease has expired can be claimed again (at once if its process is dead, see release_dead_leases).
+    The tasks are claimed by decreasing priority (e.g., from refresh_policy.schedule), set when they are added or refreshed.
+    The done tasks stay done until refresh puts back those whose files are stale.
+
+    Params:
+    -------
+    path: str.
+      The SQLite file.
+
+    lease_seconds: int.
+      How long a claimed task stays with its worker.
+
+    max_attempts: int.
+      How many times a task is tried before it stays failed.
+    '''
+
+    def __init__(self, path=WORK_QUEUE_FILE, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+        self._local = threading.local()
+
+        conn = self._conn()
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS tasks (
+                tconst TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                lease_owner TEXT,
+                lease_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                reason TEXT,
+                updated_at REAL,
+                priority REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (tconst, stage));
+            CREATE TABLE IF NOT EXISTS seeded (stage TEXT PRIMARY KEY, seeded_at REAL);
+        ''')
+        # queues created before the priorities
+        if 'priority' not in [r[1] for r in conn.execute('PRAGMA table_info(tasks)')]:
+            conn.execute('ALTER TABLE tasks ADD COLUMN priority REAL NOT NULL DEFAULT 0')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_claim ON tasks (stage, status, lease_until)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_priority ON tasks (stage, priority)')
+
+
+    def _conn(self):
+        # One connection per thread, SQLite connections cannot be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+
+    def add(self, tconsts, stage, priorities=None):
+
+        '''
+        Adds the titles to the stage as pending tasks. Titles already in the stage keep their status,
+        and take the new priority if they are not done.
+
+        Params:
+        -------
+        tconsts: iterable.
+
+        stage: str.
+
+        priorities: dict or None.
+          The priority of each title (higher is claimed first), 0 for the titles without one.
+        '''
+
+        priorities = priorities or {}
+        now = time.time()
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany('''
+                INSERT INTO tasks (tconst, stage, status, updated_at, priority) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (tconst, stage) DO UPDATE SET priority = excluded.priority WHERE status != ? AND ?''',
+                ((t, stage, PENDING, now, priorities.get(t, 0), DONE, t in priorities) for t in tconsts))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+
+    def requeue(self, tconsts, stage):
+
+        '''Puts the titles back in the stage as pending tasks, whatever their status (e.g., their output was lost by a crash).'''
+
+        now = time.time()
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany('INSERT OR REPLACE INTO tasks (tconst, stage, status, updated_at) VALUES (?, ?, ?, ?)',
+                             ((t, stage, PENDING, now) for t in tconsts))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+
+    def refresh(self, tconsts, stage, is_stale, priorities=None):
+
+        '''
+        Puts the done tasks of the titles back in the stage as pending when is_stale(tconst) is True, e.g., when the files
+        of the title are older than their TTL (see refresh_policy), with their priority (see add). Returns the number of tasks put back.
+        '''
+
+        priorities = priorities or {}
+
+        done = {r[0] for r in self._conn().execute('SELECT tconst FROM tasks WHERE stage = ? AND status = ?', (stage, DONE))}
+        # the staleness is checked outside the transaction, it may look up the manifest
+        stale = [t for t in dict.fromkeys(tconsts) if t in done and is_stale(t)]
+        now = time.time()
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany('UPDATE tasks SET status = ?, attempts = 0, reason = NULL, updated_at = ?, priority = ? WHERE tconst = ? AND stage = ? AND status = ?',
+                             ((PENDING, now, priorities.get(t, 0), t, stage, DONE) for t in stale))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return len(stale)
+
+
+    def release_dead_leases(self):
+
+        '''
+        Puts the tasks leased by processes of this host that are no longer running (e.g., a killed run) back as pending,
+        instead of waiting for their lease to run out. Returns the number of tasks released.
+        '''
+
+        owners = [r[0] for r in self._conn().execute('SELECT DISTINCT lease_owner FROM tasks WHERE status = ?', (IN_PROGRESS,))]
+        dead = [o for o in owners if o != self.owner and owner_is_dead(o)]
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            released = 0
+            for owner in dead:
+                released += conn.execute('''
+                    UPDATE tasks SET status = ?, lease_owner = NULL, lease_until = NULL, updated_at = ?
+                    WHERE status = ? AND lease_owner = ?''', (PENDING, time.time(), IN_PROGRESS, owner)).rowcount
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return released
+
+
+    def is_seeded(self, stage):
+        return self._conn().execute('SELECT 1 FROM seeded WHERE stage = ?', (stage,)).fetchone() is not None
+
+
+    def mark_seeded(self, stage):
+
+        '''Records that the title list was added to the stage, i.e., a later run has work of a former run to resume.'''
+
+        self._conn().execute('INSERT OR REPLACE INTO seeded VALUES (?, ?)', (stage, time.time()))
+
+
+    def claim(self, stage, n=1):
+
+        '''
+        Claims up to n tasks of the stage, the highest priority first: pending ones, failed ones with attempts left and those whose lease expired.
+
+        Returns:
+        --------
+        tconsts: list.
+          The claimed titles, leased to this process for lease_seconds.
+        '''
+
+        now = time.time()
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute('''
+                SELECT tconst FROM tasks
+                WHERE stage = ? AND (status = ?
+                                     OR (status = ? AND lease_until < ?)
+                                     OR (status = ? AND attempts < ?))
+                ORDER BY priority DESC
+                LIMIT ?''', (stage, PENDING, IN_PROGRESS, now, FAILED, self.max_attempts, n)).fetchall()
+            tconsts = [r[0] for r in rows]
+            conn.executemany('''
+                UPDATE tasks SET status = ?, lease_owner = ?, lease_until = ?, attempts = attempts + 1, updated_at = ?
+                WHERE tconst = ? AND stage = ?''',
+                ((IN_PROGRESS, self.owner, now + self.lease_seconds, now, t, stage) for t in tconsts))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return tconsts
+
+
+    def claim_titles(self, tconsts, stages):
+
+        '''Claims the given titles in the given stages (if they are pending), e.g., right after adding them.'''
+
+        now = time.time()
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany('''
+                UPDATE tasks SET status = ?, lease_owner = ?, lease_until = ?, attempts = attempts + 1, updated_at = ?
+                WHERE tconst = ? AND stage = ? AND status = ?''',
+                ((IN_PROGRESS, self.owner, now + self.lease_seconds, now, t, stage, PENDING) for t in tconsts for stage in stages))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+
+    def iter_claims(self, stage, batch=20, limit=None):
+
+        '''Yields the tasks of the stage, claiming them by batches until there is none left or limit tasks were claimed.'''
+
+        claimed = 0
+        while limit is None or claimed < limit:
+            tconsts = self.claim(stage, batch if limit is None else min(batch, limit - claimed))
+            if not tconsts:
+                return
+            claimed += len(tconsts)
+            yield from tconsts
+
+
+    def renew(self, tconst, stage):
+
+        '''Extends the lease of a task that takes long.'''
+
+        self._conn().execute('UPDATE tasks SET lease_until = ?, updated_at = ? WHERE tconst = ? AND stage = ? AND lease_owner = ?',
+                             (time.time() + self.lease_seconds, time.time(), tconst, stage, self.owner))
+
+
+    def done(self, tconst, stage):
+        self._conn().execute('UPDATE tasks SET status = ?, lease_owner = NULL, lease_until = NULL, reason = NULL, updated_at = ? WHERE tconst = ? AND stage = ?',
+                             (DONE, time.time(), tconst, stage))
+
+
+    def fail(self, tconst, stage, reason):
+        self._conn().execute('UPDATE tasks SET status = ?, lease_owner = NULL, lease_until = NULL, reason = ?, updated_at = ? WHERE tconst = ? AND stage = ?',
+                             (FAILED, str(reason)[:500], time.time(), tconst, stage))
+
+
+    def status(self, tconst, stage):
+
+        '''Returns (status, attempts, reason) of the task, or None if the title is not in the stage.'''
+
+        return self._conn().execute('SELECT status, attempts, reason FROM tasks WHERE tconst = ? AND stage = ?', (tconst, stage)).fetchone()
+
+
+    def counts(self):
+
+        '''Returns the number of tasks by stage and status, e.g., {'main': {'done': 120, 'pending': 30}}.'''
+
+        counts = {}
+        for stage, status, n in self._conn().execute('SELECT stage, status, COUNT(*) FROM tasks GROUP BY stage, status'):
+            counts.setdefault(stage, {})[status] = n
+        return counts
+
+
+
+def tracked(work_queue, stage, func):
+
+    '''
+    Wraps a stage function so that the task of the title is marked done when func succeeds and failed (with the error) otherwise.
+
+    Params:
+    -------
+    work_queue: WorkQueue.
+
+    stage: str.
+      The name of the stage in the work queue.
+
+    func: function.
+      Takes the tconst.
+
+    Returns:
+    --------
+    The wrapped function, which returns the result of func.
+    '''
+
+    def run(t):
+        try:
+            result = func(t)
+        except Exception as e:
+            work_queue.fail(t, stage, repr(e))
+            raise
+        work_queue.done(t, stage)
+        return result
+    return run
@@ -0,0 +1,241 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+from datetime import date
+from work_queue import owner_is_dead
+
+
+
+WRITE_JOURNAL_FILE = 'write_journal.sqlite'
+TEMP_SUFFIX = '.tmp' # temp files are named <path>.<pid>.<thread>.tmp, which the file patterns of the manifest do not match
+
+
+
+##########################################
+### Atomic writes of the output files ###
+##########################################
+
+def _fsync_dir(directory):
+    # the rename is durable once the folder is synced (not possible on Windows, where the rename is already durable)
+    if os.name == 'nt':
+        return
+    fd = os.open(directory or '.', os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_to_csv(df, path):
+
+    '''
+    Writes the data frame to a temp file next to path, fsyncs it and renames it to path,
+    so path is either the former file or the complete new one, never a truncated file.
+    '''
+
+    tmp = f'{path}.{os.getpid()}.{threading.get_ident()}{TEMP_SUFFIX}'
+    try:
+        with open(tmp, 'w', newline='', encoding='utf-8') as f:
+            df.to_csv(f, index=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    _fsync_dir(os.path.dirname(path))
+
+
+def append_csv(df, path):
+
+    '''
+    Appends the data frame to the CSV file (with the header only if the file is new). An append cut by a crash
+    leaves a partial last line, which repair_tail removes at startup (see WriteJournal.recover).
+    '''
+
+    with open(path, 'a', newline='', encoding='utf-8') as f:
+        df.to_csv(f, header=f.tell() == 0, index=False)
+
+
+def repair_tail(path):
+
+    '''Truncates the file after its last complete line. Returns the number of bytes removed.'''
+
+    if not os.path.isfile(path):
+        return 0
+    with open(path, 'rb+') as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return 0
+        # reads back from the end until a new line
+        pos = size
+        while pos > 0:
+            step = min(65536, pos)
+            f.seek(pos - step)
+            chunk = f.read(step)
+            i = chunk.rfind(b'\n')
+            if i != -1:
+                pos = pos - step + i + 1
+                break
+            pos -= step
+        if pos == size:
+            return 0
+        f.truncate(pos)
+        f.flush()
+        os.fsync(f.fileno())
+    return size - pos
+
+
+
+#####################################
+### Journal of the pending writes ###
+#####################################
+
+class WriteJournal:
+
+    '''
+    Records each output before it is written (when write_artifact is called, i.e., possibly while it waits in the queue
+    of the writer thread or in the buffer of the Parquet store) and removes the entry once it is written and recorded
+    in the manifest. The entries left by a killed or crashed run are the incomplete outputs: recover cleans them up
+    (temp files, partial appends, manifest records of rows lost in a buffer) and queues the titles again.
+
+    Params:
+    -------
+    path: str.
+      The SQLite file.
+    '''
+
+    def __init__(self, path=WRITE_JOURNAL_FILE):
+        self.path = path
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+        self._local = threading.local()
+        self._conn().executescript('''
+            CREATE TABLE IF NOT EXISTS journal (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                tconst TEXT NOT NULL,
+                artifact TEXT NOT NULL,
+                path TEXT,
+                append INTEGER NOT NULL,
+                fetch_date TEXT NOT NULL,
+                owner TEXT NOT NULL,
+                started REAL NOT NULL);
+        ''')
+
+
+    def _conn(self):
+        # One connection per thread, SQLite connections cannot be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+
+    def begin(self, tconst, artifact, path, append=False):
+
+        '''Records an output about to be written. Returns the id of the entry.'''
+
+        cursor = self._conn().execute('INSERT INTO journal (tconst, artifact, path, append, fetch_date, owner, started) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                      (tconst, artifact, path, int(append), str(date.today()), self.owner, time.time()))
+        return cursor.lastrowid
+
+
+    def complete(self, ids):
+
+        '''Removes the entries of the written outputs, in one transaction.'''
+
+        ids = [i for i in ids if i is not None]
+        if not ids:
+            return
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany('DELETE FROM journal WHERE id = ?', ((i,) for i in ids))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+
+    def incomplete(self):
+
+        '''
+        Returns the entries (id, tconst, artifact, path, append, fetch_date) left by processes that are no longer running on this host.
+        The entries of running processes (e.g., the other workers of crawl_shards) and of other hosts are left alone.
+        '''
+
+        # psutil is imported only here (see work_queue.process_running), so the offline tools importing the manifest do not need it
+        entries = []
+        for row in self._conn().execute('SELECT id, tconst, artifact, path, append, fetch_date, owner FROM journal ORDER BY id'):
+            if owner_is_dead(row[6]):
+                entries.append(row[:6])
+        return entries
+
+
+    def recover(self, work_queue=None, stages=None):
+
+        '''
+        Cleans up the outputs of the crashed runs and queues their titles again.
+
+        Params:
+        -------
+        work_queue: WorkQueue or None.
+          The work queue of the run. Without one, the titles are fetched again since they have no fresh record in the manifest.
+
+        stages: dict or None.
+          The stage of the work queue of each artifact, e.g., {'main': 'main', 'gen': 'subpages'}.
+
+        Returns:
+        --------
+        recovered: list.
+          The (tconst, artifact) of the incomplete outputs.
+        '''
+
+        # imported here since the manifest imports this module
+        from manifest import get_manifest
+        entries = self.incomplete()
+        if not entries:
+            return []
+        manifest = get_manifest()
+        requeue = {}
+        for _, tconst, artifact, path, append, fetch_date in entries:
+            if path:
+                directory, name = os.path.split(path)
+                if os.path.isdir(directory or '.'):
+                    # the temp files of an interrupted atomic write
+                    for f in os.listdir(directory or '.'):
+                        if f.startswith(name + '.') and f.endswith(TEMP_SUFFIX):
+                            os.remove(os.path.join(directory, f))
+                if append:
+                    repair_tail(path)
+            # the rows may have been lost in a buffer after the record (Parquet store)
+            manifest.forget(tconst, artifact, fetch_date)
+            stage = (stages or {}).get(artifact)
+            if work_queue is not None and stage is not None:
+                requeue.setdefault(stage, set()).add(tconst)
+        for stage, tconsts in requeue.items():
+            work_queue.requeue(sorted(tconsts), stage)
+        self.complete([e[0] for e in entries])
+        recovered = [(e[1], e[2]) for e in entries]
+        print(f'Recovered {len(recovered)} incomplete outputs, titles queued again: {sum(len(t) for t in requeue.values())}', flush=True)
+        return recovered
+
+
+
+_journal = None
+_journal_lock = threading.Lock()
+
+def get_write_journal():
+
+    '''Returns the write journal of the process.'''
+
+    global _journal
+    with _journal_lock:
+        if _journal is None:
+            _journal = WriteJournal()
+    return _journal